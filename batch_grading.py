@@ -0,0 +1,401 @@
+"""Offline grading of pending essays through file-based batch requests.
+
+Essays submitted with `mode=offline` are stored without grades. This module turns
+every missing (essay, category) pair into the exact `single_grader` chat request,
+writes them as a JSONL batch, submits it through a batch backend, polls until it
+completes and writes the results back as `EssayGrade` rows.
+
+Submitted batches are recorded in the database until their results are written back, so a
+run stopped by --timeout or a crash never resubmits their requests; --resume picks them up.
+
+    python batch_grading.py --backend local   # simulated batch service, runs against OPENAI_BASE_URL
+    python batch_grading.py --backend openai  # OpenAI Batch API (24h completion window)
+    python batch_grading.py --backend openai --resume  # write back batches a previous run left in progress
+"""
+import os
+import json
+import time
+import uuid
+import argparse
+from abc import ABC, abstractmethod
+from contextlib import closing
+from dotenv import load_dotenv
+from openai import DEFAULT_MAX_RETRIES
+from sqlalchemy import and_, distinct, func, select, union
+
+import llm_gateway
+from rate_limit import llm_limiter, estimate_tokens
+from database import Essay, EssayGrade, GradingBatch, GradingBatchRequest, SessionLocal, write_session
+from persistence import grade_row, add_grade_stats
+from grading import categories, grader_messages, parse_grader_content, grade_record, usage_record, GRADING_MODEL, GRADER_COMPLETION_TOKENS
+from grading import grade_cache_key, normalize_essay, store_grade, conventions_plan, CONVENTIONS_POLICY, CONVENTIONS_POLICIES
+from conventions import analyze_batch, local_grades, essay_features
+
+load_dotenv()
+
+# Where batch input/output files (and the local backend's simulated batches) are kept
+BATCH_DIR = os.getenv("BATCH_DIR", "batches")
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "30"))
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+COMPLETED, FAILED, IN_PROGRESS = "completed", "failed", "in_progress"
+
+
+class BatchBackend(ABC):
+    """Interface of a batch service: submit a JSONL file of requests, poll it, fetch its output lines."""
+
+    @abstractmethod
+    def submit(self, input_path: str) -> str:
+        """Submits the JSONL file of requests and returns the batch id."""
+
+    @abstractmethod
+    def status(self, batch_id: str) -> str:
+        """COMPLETED, FAILED or IN_PROGRESS."""
+
+    @abstractmethod
+    def results(self, batch_id: str) -> list:
+        """The batch's output lines, parsed."""
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """The OpenAI Batch API, through the shared gateway client."""
+
+    def __init__(self, client=None, completion_window: str = "24h"):
+        # The gateway client leaves retries to llm_limiter, which only wraps chat requests; the Batch and
+        # Files API calls keep the SDK's own retries so a transient 429 or 5xx does not end a long poll
+        self.client = (client or llm_gateway.get_client()).with_options(max_retries=DEFAULT_MAX_RETRIES)
+        self.completion_window = completion_window
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as input_file:
+            uploaded = self.client.files.create(file=input_file, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        status = self.client.batches.retrieve(batch_id).status
+        if status == "completed":
+            return COMPLETED
+        if status in ("failed", "expired", "cancelled"):
+            return FAILED
+        return IN_PROGRESS
+
+    def results(self, batch_id: str) -> list:
+        batch = self.client.batches.retrieve(batch_id)
+        if not batch.output_file_id:
+            return []
+        content = self.client.files.content(batch.output_file_id).text
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+class LocalBatchBackend(BatchBackend):
+    """Simulates the batch service in a local directory.
+
+    Each batch gets `<directory>/<batch_id>/` with `input.jsonl` and `status.json`. The
+    first poll "runs" the batch by sending every request through `responder`, which by
+    default is the gateway's sync client (so it works against testing/fake_openai.py),
+    and writes `output.jsonl` in the Batch API output format.
+    """
+
+    def __init__(self, directory: str = None, responder=None):
+        self.directory = directory or os.path.join(BATCH_DIR, "local")
+        self.responder = responder or self._send
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _send(self, body: dict) -> dict:
+        # Through the shared limiter, like every other model request, for its budgets and retries
+        client = llm_gateway.get_client()
+        send = lambda: client.chat.completions.create(**body, timeout=llm_gateway.GRADING_TIMEOUT)
+        return llm_limiter.call_sync(send, estimate_tokens(body["messages"], GRADER_COMPLETION_TOKENS)).model_dump()
+
+    def _path(self, batch_id: str, name: str) -> str:
+        return os.path.join(self.directory, batch_id, name)
+
+    def _write_status(self, batch_id: str, status: str):
+        with open(self._path(batch_id, "status.json"), "w") as status_file:
+            json.dump({"id": batch_id, "status": status, "updated_at": time.time()}, status_file)
+
+    def submit(self, input_path: str) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        os.makedirs(os.path.join(self.directory, batch_id))
+        with open(input_path) as source, open(self._path(batch_id, "input.jsonl"), "w") as target:
+            target.write(source.read())
+        self._write_status(batch_id, IN_PROGRESS)
+        return batch_id
+
+    def run(self, batch_id: str):
+        """Processes every request of the batch and marks it completed."""
+        with open(self._path(batch_id, "input.jsonl")) as input_file:
+            requests = [json.loads(line) for line in input_file if line.strip()]
+        with open(self._path(batch_id, "output.jsonl"), "w") as output_file:
+            for request in requests:
+                try:
+                    line = {"custom_id": request["custom_id"], "response": {"status_code": 200, "body": self.responder(request["body"])}, "error": None}
+                except Exception as e:
+                    line = {"custom_id": request["custom_id"], "response": None, "error": {"message": str(e)}}
+                output_file.write(json.dumps(line) + "\n")
+        self._write_status(batch_id, COMPLETED)
+
+    def status(self, batch_id: str) -> str:
+        with open(self._path(batch_id, "status.json")) as status_file:
+            status = json.load(status_file)["status"]
+        if status == IN_PROGRESS:
+            self.run(batch_id)
+            return COMPLETED
+        return status
+
+    def results(self, batch_id: str) -> list:
+        with open(self._path(batch_id, "output.jsonl")) as output_file:
+            return [json.loads(line) for line in output_file if line.strip()]
+
+
+def pending_essays(session, limit: int = None) -> list:
+    """Essays missing a grade for at least one rubric category, with the categories they miss.
+
+    Categories requested in a batch that is still in progress count as covered, so they are not
+    requested twice. The essays are picked by one grouped query instead of loading every essay's grades.
+    """
+    names = list(categories)
+    covered = union(
+        select(EssayGrade.essay_id, EssayGrade.grade_type),
+        select(GradingBatchRequest.essay_id, GradingBatchRequest.grade_type)
+        .join(GradingBatch).where(GradingBatch.status == IN_PROGRESS),
+    ).subquery()
+    query = (session.query(Essay)
+             .outerjoin(covered, and_(covered.c.essay_id == Essay.id, covered.c.grade_type.in_(names)))
+             .group_by(Essay.id)
+             .having(func.count(distinct(covered.c.grade_type)) < len(names))
+             .order_by(Essay.id))
+    essays = query.limit(limit).all() if limit else query.all()
+    done = {}
+    if essays:
+        rows = session.execute(select(covered.c.essay_id, covered.c.grade_type).where(covered.c.essay_id.in_([essay.id for essay in essays])))
+        for essay_id, grade_type in rows:
+            done.setdefault(essay_id, set()).add(grade_type)
+    return [(essay, [category for category in categories if category not in done.get(essay.id, ())]) for essay in essays]
+
+
+def custom_id(essay_id: int, category: str) -> str:
+    return f"essay-{essay_id}-{category}"
+
+
+def parse_custom_id(value: str):
+    _, essay_id, category = value.split("-", 2)
+    return int(essay_id), category
+
+
+def plan_conventions(pending: list, policy: str = None) -> dict:
+    """Runs the conventions analyzer over every pending essay in one batch.
+
+    Returns {essay_id: (result, hint)} as `grading.conventions_plan` would for each essay.
+    """
+    policy = policy or CONVENTIONS_POLICY
+    essays = [essay for essay, missing in pending if "conventions" in missing]
+    if policy == "llm" or not essays:
+        return {}
+    features = analyze_batch([essay.text for essay in essays])
+    grades = local_grades(features)
+    return {
+        essay.id: conventions_plan(essay.text, policy, {**essay_features(features, index), "local_grade": int(grades[index])})
+        for index, essay in enumerate(essays)
+    }
+
+
+def category_hint(plans: dict, essay_id: int, category: str):
+    return plans.get(essay_id, (None, None))[1] if category == "conventions" else None
+
+
+def build_batch_requests(pending: list, plans: dict = None) -> list:
+    """One Batch API request line per missing (essay, category), identical to what `single_grader_async` sends.
+
+    Categories graded locally in `plans` get no request.
+    """
+    plans = plans or {}
+    return [
+        {
+            "custom_id": custom_id(essay.id, category),
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": GRADING_MODEL,
+                "messages": grader_messages(essay.text, categories[category], category_hint(plans, essay.id, category)),
+                "response_format": {"type": "json_object"},
+            },
+        }
+        for essay, missing in pending
+        for category in missing
+        if not (category == "conventions" and plans.get(essay.id, (None, None))[0] is not None)
+    ]
+
+
+def add_local_grades(session, plans: dict) -> int:
+    """Adds the locally graded conventions results as `EssayGrade` rows, without committing."""
+    written = 0
+    graded = {essay_id: result for essay_id, (result, _) in plans.items() if result is not None}
+    if not graded:
+        return 0
+    for essay in session.query(Essay).filter(Essay.id.in_(graded)).order_by(Essay.id):
+        record = grade_record("conventions", graded[essay.id])
+        row = grade_row(record, essay=essay)
+        session.add(row)
+        add_grade_stats(session, essay.author, [row], essay.date_submitted)
+        written += 1
+    return written
+
+
+def write_batch_file(requests: list, directory: str = None) -> str:
+    directory = directory or BATCH_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"grading_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.jsonl")
+    with open(path, "w") as batch_file:
+        for request in requests:
+            batch_file.write(json.dumps(request) + "\n")
+    return path
+
+
+def record_batch(session, batch_id: str, requests: list, plans: dict = None):
+    """Records a submitted batch and its (essay, category) pairs, without committing."""
+    plans = plans or {}
+    batch = GradingBatch(id=batch_id, status=IN_PROGRESS)
+    session.add(batch)
+    for request in requests:
+        essay_id, category = parse_custom_id(request["custom_id"])
+        session.add(GradingBatchRequest(batch=batch, essay_id=essay_id, grade_type=category, hint=category_hint(plans, essay_id, category)))
+
+
+def apply_batch_results(session, results: list, hints: dict = None) -> dict:
+    """Adds successful results as `EssayGrade` rows, without committing, and returns counts.
+
+    `hints` maps custom ids to the hint their prompt carried. Categories the essay has a grade for
+    by now are skipped, so a result never adds a second grade or counts twice in the author stats.
+    """
+    hints = hints or {}
+    essay_ids = {parse_custom_id(line["custom_id"])[0] for line in results}
+    essays = {essay.id: essay for essay in session.query(Essay).filter(Essay.id.in_(essay_ids))}
+    graded = set(session.query(EssayGrade.essay_id, EssayGrade.grade_type).filter(EssayGrade.essay_id.in_(essay_ids)))
+    written, failed, skipped = 0, 0, 0
+    for line in results:
+        essay_id, category = parse_custom_id(line["custom_id"])
+        response = line.get("response") or {}
+        essay = essays.get(essay_id)
+        if essay is None or line.get("error") or response.get("status_code") != 200:
+            failed += 1
+            continue
+        if (essay_id, category) in graded:
+            skipped += 1
+            continue
+        result = parse_grader_content(response["body"]["choices"][0]["message"]["content"])
+        if "error" in result:
+            failed += 1
+            continue
+        # Results land in the grading cache too, so regrading the same text is free
+        hint = hints.get(line["custom_id"])
+        store_grade(grade_cache_key(grader_messages(normalize_essay(essay.text), categories[category], hint)), result, True)
+        record = grade_record(category, {**result, "usage": usage_record(response["body"].get("usage"))})
+        row = grade_row(record, essay=essay)
+        session.add(row)
+        add_grade_stats(session, essay.author, [row], essay.date_submitted)
+        graded.add((essay_id, category))
+        written += 1
+    return {"grades_written": written, "requests_failed": failed, "already_graded": skipped}
+
+
+def wait_for_batch(backend: BatchBackend, batch_id: str, poll_interval: float, timeout: float = None) -> str:
+    """Polls the batch until it is no longer in progress or `timeout` seconds have passed, and returns its status."""
+    started = time.monotonic()
+    status = backend.status(batch_id)
+    while status == IN_PROGRESS:
+        if timeout is not None and time.monotonic() - started > timeout:
+            break
+        time.sleep(poll_interval)
+        status = backend.status(batch_id)
+    return status
+
+
+def finish_batch(backend: BatchBackend, batch_id: str, status: str) -> dict:
+    """Writes a finished batch's results back and closes its record in the same transaction.
+
+    A batch another run already finished is left alone, so its results are never applied twice.
+    """
+    counts = {"grades_written": 0, "requests_failed": 0, "already_graded": 0}
+    results = backend.results(batch_id) if status == COMPLETED else []
+    with write_session() as session:
+        batch = session.get(GradingBatch, batch_id)
+        if batch is None or batch.status != IN_PROGRESS:
+            return counts
+        if results:
+            hints = {custom_id(request.essay_id, request.grade_type): request.hint for request in batch.requests}
+            counts = apply_batch_results(session, results, hints)
+        batch.status = status
+    return counts
+
+
+def run_offline_batch(backend: BatchBackend, poll_interval: float = None, timeout: float = None, limit: int = None,
+                      conventions_policy: str = None) -> dict:
+    """Grades every pending essay through `backend` and returns a summary of the run.
+
+    No database transaction stays open while the batch runs: SQLite keeps a reader's snapshot
+    until its transaction ends, and a write on a snapshot that someone else committed after
+    fails with "database is locked". Pending essays are read in a short session, and local
+    grades, the batch record and the batch results are each written in their own `write_session`.
+    A batch still in progress at `timeout` stays recorded for `resume_batches`.
+    """
+    poll_interval = BATCH_POLL_INTERVAL if poll_interval is None else poll_interval
+    with closing(SessionLocal()) as session:
+        pending = pending_essays(session, limit)
+        plans = plan_conventions(pending, conventions_policy)
+        requests = build_batch_requests(pending, plans)
+        essay_count = len(pending)
+    with write_session() as session:
+        graded_locally = add_local_grades(session, plans)
+    if not requests:
+        return {"essays": essay_count, "requests": 0, "graded_locally": graded_locally, "grades_written": 0,
+                "requests_failed": 0, "status": COMPLETED}
+
+    batch_id = backend.submit(write_batch_file(requests))
+    with write_session() as session:
+        record_batch(session, batch_id, requests, plans)
+    status = wait_for_batch(backend, batch_id, poll_interval, timeout)
+
+    summary = {"batch_id": batch_id, "essays": essay_count, "requests": len(requests), "graded_locally": graded_locally,
+               "status": status, "grades_written": 0, "requests_failed": 0}
+    if status != IN_PROGRESS:
+        summary.update(finish_batch(backend, batch_id, status))
+    return summary
+
+
+def resume_batches(backend: BatchBackend, poll_interval: float = None, timeout: float = None) -> list:
+    """Waits for the batches earlier runs left in progress and writes their results back; one summary per batch."""
+    poll_interval = BATCH_POLL_INTERVAL if poll_interval is None else poll_interval
+    with closing(SessionLocal()) as session:
+        batch_ids = [batch_id for (batch_id,) in session.query(GradingBatch.id)
+                     .filter(GradingBatch.status == IN_PROGRESS).order_by(GradingBatch.submitted_at)]
+    summaries = []
+    for batch_id in batch_ids:
+        status = wait_for_batch(backend, batch_id, poll_interval, timeout)
+        summary = {"batch_id": batch_id, "status": status, "grades_written": 0, "requests_failed": 0}
+        if status != IN_PROGRESS:
+            summary.update(finish_batch(backend, batch_id, status))
+        summaries.append(summary)
+    return summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grade pending essays through a batch API.")
+    parser.add_argument("--backend", choices=["local", "openai"], default="local")
+    parser.add_argument("--poll-interval", type=float, default=BATCH_POLL_INTERVAL)
+    parser.add_argument("--timeout", type=float, default=None, help="Stop polling after this many seconds")
+    parser.add_argument("--limit", type=int, default=None, help="Grade at most this many essays")
+    parser.add_argument("--conventions-policy", choices=CONVENTIONS_POLICIES, default=None, help="Overrides CONVENTIONS_POLICY")
+    parser.add_argument("--resume", action="store_true", help="Write back the batches earlier runs left in progress instead of submitting a new one")
+    args = parser.parse_args()
+
+    backend = LocalBatchBackend() if args.backend == "local" else OpenAIBatchBackend()
+    if args.resume:
+        print(json.dumps(resume_batches(backend, args.poll_interval, args.timeout), indent=2))
+    else:
+        print(json.dumps(run_offline_batch(backend, args.poll_interval, args.timeout, args.limit, args.conventions_policy), indent=2))
@@ -0,0 +1,96 @@
+"""Ingest benchmark: essays persisted per second and commits per essay for each persistence mode.
+
+    python benchmarks/bench_ingest.py --essays 500
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+import persistence  # noqa: E402
+from database import Author, Essay, EssayImage, EssayGrade  # noqa: E402
+
+GRADE_TYPES = ["ideas", "organization", "voice", "word_choice", "sentence_fluency", "conventions"]
+ESSAY_TEXT = "I visited puerto rico in 2015. It was very hot and the water was lightish blue. " * 10
+
+
+class CommitCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, connection):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "commit", self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "commit", self._count)
+
+
+def essay_records(count: int, authors: int = 30, pages: int = 2):
+    return [
+        (f"student{index % authors}", f"Essay {index}", ESSAY_TEXT,
+         [{"filename": f"page_{page + 1}.png"} for page in range(pages)],
+         [{"type": grade_type, "grade": 3, "comments": "Add more details."} for grade_type in GRADE_TYPES])
+        for index in range(count)
+    ]
+
+
+def save_essay_one_commit_per_step(authorname, title, full_text, extracted_texts, grades):
+    """The original persistence: separate commits for the author, essay, images and grades."""
+    with database.write_session() as session:
+        author = session.query(Author).filter_by(authorname=authorname).first()
+        if not author:
+            author = Author(authorname=authorname)
+            session.add(author)
+            session.commit()
+        essay = Essay(author=author, title=title, text=full_text)
+        session.add(essay)
+        session.commit()
+        for extracted_text in extracted_texts:
+            session.add(EssayImage(essay=essay, image_path=extracted_text["filename"]))
+        session.commit()
+        for grade in grades:
+            session.add(EssayGrade(essay=essay, grade_type=grade["type"], grade=grade["grade"], comments=grade["comments"]))
+        session.commit()
+
+
+def run_mode(name: str, records: list, batch_size: int):
+    with tempfile.TemporaryDirectory() as directory:
+        engine = database.configure(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        database.migrate_schema(engine)
+        with CommitCounter(engine) as commits:
+            started = time.perf_counter()
+            if name == "commit per step":
+                for record in records:
+                    save_essay_one_commit_per_step(*record)
+            elif name == "single transaction":
+                for record in records:
+                    persistence.save_essay(*record)
+            else:
+                for start in range(0, len(records), batch_size):
+                    persistence.save_essays(records[start:start + batch_size])
+            elapsed = time.perf_counter() - started
+        engine.dispose()
+    print(f"{name:22} {len(records) / elapsed:10.1f} {commits.count / len(records):14.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--essays", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=persistence.WRITE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    records = essay_records(args.essays)
+    print(f"{'mode':22} {'essays/s':>10} {'commits/essay':>14}")
+    for mode in ("commit per step", "single transaction", f"batched ({args.batch_size})"):
+        run_mode(mode, records, args.batch_size)
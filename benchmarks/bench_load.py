@@ -0,0 +1,134 @@
+"""Load benchmark: drives /submit-essay/ and the read endpoints against a local fake OpenAI server under increasing concurrency.
+
+    python benchmarks/bench_load.py --levels 1 4 16 --rounds 3 --latency 0.4 --jitter 0.4 --rate-limit-rate 0.05
+
+Reports throughput, p50/p95/p99 latency per endpoint and how long the event loop was
+blocked, so regressions show up before deploys. The app runs in-process on the same
+event loop as the clients, which is what makes loop blocking visible.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+import llm_gateway  # noqa: E402
+import main  # noqa: E402
+from testing.fake_openai import FakeOpenAIServer  # noqa: E402
+from testing.sample_essay import SAMPLE_ESSAY_TEXT  # noqa: E402
+from testing.synthetic_pages import synthetic_page, encode_png  # noqa: E402
+
+# A stall of the event loop shorter than this is scheduling noise, not blocking
+LAG_THRESHOLD = 0.005
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class LoopLagProbe:
+    """Sleeps `interval` seconds in a loop and records how late it wakes up: time the loop spent blocked."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def __enter__(self):
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    def __exit__(self, *exc_info):
+        self._task.cancel()
+
+    @property
+    def blocked(self) -> float:
+        return sum(lag for lag in self.lags if lag > LAG_THRESHOLD)
+
+
+async def timed(latencies: dict, errors: dict, endpoint: str, request):
+    started = time.perf_counter()
+    try:
+        response = await request
+    except httpx.HTTPError:
+        response = None
+    latencies.setdefault(endpoint, []).append(time.perf_counter() - started)
+    if response is None or response.status_code != 200:
+        errors[endpoint] = errors.get(endpoint, 0) + 1
+        return None
+    return response
+
+
+async def run_level(concurrency: int, rounds: int, pages: list):
+    latencies, errors = {}, {}
+    transport = httpx.ASGITransport(app=main.app)
+
+    async def student(client: httpx.AsyncClient, index: int):
+        authorname = f"student{index}"
+        for round_number in range(rounds):
+            files = [("files", (f"page_{number + 1}.png", page, "image/png")) for number, page in enumerate(pages)]
+            params = {"authorname": authorname, "title": f"Essay {round_number}", "use_cache": False}
+            submitted = await timed(latencies, errors, "POST /submit-essay/", client.post("/submit-essay/", params=params, files=files))
+            await timed(latencies, errors, "GET /get-authors/", client.get("/get-authors/"))
+            await timed(latencies, errors, "POST /get-author-grades/",
+                        client.post("/get-author-grades/", params={"authorname": authorname, "include_text": False}))
+            if submitted is not None:
+                await timed(latencies, errors, "GET /essays/{id}", client.get(f"/essays/{submitted.json()['essay_id']}"))
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        with LoopLagProbe() as probe:
+            started = time.perf_counter()
+            await asyncio.gather(*(student(client, index) for index in range(concurrency)))
+            elapsed = time.perf_counter() - started
+    await llm_gateway.aclose()
+    return latencies, errors, elapsed, probe
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16], help="Concurrent clients per run")
+    parser.add_argument("--rounds", type=int, default=3, help="Essays each client submits per run")
+    parser.add_argument("--pages", type=int, default=2, help="Pages per essay")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake model response time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Extra random response time, up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of model requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of model requests answered with 429")
+    args = parser.parse_args()
+
+    database.configure(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+    database.migrate_schema(database.engine)
+    pages = [encode_png(synthetic_page(width=1200, height=1600, margin=150, lines=14, seed=number)) for number in range(args.pages)]
+
+    with FakeOpenAIServer(ocr_text=SAMPLE_ESSAY_TEXT, latency=args.latency, jitter=args.jitter,
+                          error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate) as server:
+        llm_gateway.configure(base_url=server.url, api_key="bench")
+        print(f"{args.pages}-page essays, model latency {args.latency}s + up to {args.jitter}s, "
+              f"{args.error_rate:.0%} errors, {args.rate_limit_rate:.0%} rate limited")
+        print(f"{'clients':>7} {'endpoint':26} {'n':>5} {'err':>4} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for concurrency in args.levels:
+            latencies, errors, elapsed, probe = asyncio.run(run_level(concurrency, args.rounds, pages))
+            for endpoint, values in latencies.items():
+                print(f"{concurrency:7} {endpoint:26} {len(values):5} {errors.get(endpoint, 0):4} {len(values) / elapsed:7.2f} "
+                      f"{percentile(values, 50) * 1000:8.0f} {percentile(values, 95) * 1000:8.0f} {percentile(values, 99) * 1000:8.0f}")
+            essays = len(latencies.get("POST /submit-essay/", [])) - errors.get("POST /submit-essay/", 0)
+            print(f"{concurrency:7} {'essays/s':26} {essays / elapsed:20.2f}   loop blocked {probe.blocked * 1000:.0f} ms "
+                  f"of {elapsed * 1000:.0f} ms, worst stall {max(probe.lags, default=0) * 1000:.0f} ms, "
+                  f"p99 stall {percentile(probe.lags, 99) * 1000:.1f} ms")
+        print(f"fake server responses: {dict(sorted(server.statuses.items()))}")
+    llm_gateway.close()
+    main.shutdown_pool()
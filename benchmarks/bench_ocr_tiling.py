@@ -0,0 +1,82 @@
+"""OCR tiling benchmark: vision requests, tokens and latency per essay for several OCR_PAGES_PER_REQUEST settings.
+
+    python benchmarks/bench_ocr_tiling.py --essays 20 --pages 4 --overhead 0.8 --per-page 1.2
+
+Vision calls go to an in-process stand-in whose latency is a fixed per-request overhead
+plus generation time for each page transcribed, so results depend on those two settings.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import integrations  # noqa: E402
+import llm_gateway  # noqa: E402
+import main  # noqa: E402
+import preprocessing  # noqa: E402
+import tiered_ocr  # noqa: E402
+from rate_limit import estimate_tokens  # noqa: E402
+from testing.synthetic_pages import synthetic_page, encode_png  # noqa: E402
+
+
+class TimedCompletions:
+    def __init__(self, overhead: float, per_page: float):
+        self.overhead = overhead
+        self.per_page = per_page
+        self.requests = 0
+        self.tokens = 0
+
+    async def create(self, model, messages, **kwargs):
+        self.requests += 1
+        self.tokens += estimate_tokens(messages, integrations.OCR_COMPLETION_TOKENS)
+        images = sum(1 for part in messages[0]["content"] if part.get("type") == "image_url")
+        await asyncio.sleep(self.overhead + self.per_page * images)
+        if images == 1:
+            content = "Page text."
+        else:
+            content = "\n".join(f"{integrations.PAGE_MARKER.format(number)}\nPage text." for number in range(1, images + 1))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+async def run(essays: list, pages_per_request: int, completions: TimedCompletions):
+    main.OCR_PAGES_PER_REQUEST = pages_per_request
+    latencies = []
+
+    async def essay(pages):
+        started = time.perf_counter()
+        await main.extract_texts(pages, use_cache=False)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(essay(pages) for pages in essays))
+    return latencies, time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--essays", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=4)
+    parser.add_argument("--overhead", type=float, default=0.8, help="Seconds each vision request costs regardless of size")
+    parser.add_argument("--per-page", type=float, default=1.2, help="Seconds of generation per page transcribed")
+    parser.add_argument("--tiles", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    # Every page is escalated and preprocessed inline, so only the vision requests differ between runs
+    tiered_ocr.OCR_LOCAL_FIRST = False
+    preprocessing.PREPROCESS_PROCESSES = 0
+    page = encode_png(synthetic_page(width=600, height=800, margin=60, lines=8))
+    essays = [[(f"page_{number + 1}.png", page) for number in range(args.pages)] for _ in range(args.essays)]
+
+    print(f"{args.essays} essays of {args.pages} pages, {args.overhead}s per request + {args.per_page}s per page")
+    print(f"{'pages/request':>13} {'requests':>9} {'req/essay':>9} {'tokens':>9} {'p50 s':>7} {'max s':>7} {'total s':>8}")
+    for pages_per_request in args.tiles:
+        completions = TimedCompletions(args.overhead, args.per_page)
+        llm_gateway.get_async_client = lambda: SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        latencies, elapsed = asyncio.run(run(essays, pages_per_request, completions))
+        print(f"{pages_per_request:13} {completions.requests:9} {completions.requests / args.essays:9.1f} {completions.tokens:9} "
+              f"{statistics.median(latencies):7.2f} {max(latencies):7.2f} {elapsed:8.2f}")
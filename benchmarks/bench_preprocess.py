@@ -0,0 +1,82 @@
+"""Preprocessing benchmark: pages per second per core and payload bytes saved by deskew and cropping.
+
+    python benchmarks/bench_preprocess.py --pages 48 --processes 4
+"""
+import io
+import os
+import sys
+import time
+import random
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps, ImageEnhance
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import preprocessing  # noqa: E402
+from testing.synthetic_pages import synthetic_page, encode_png  # noqa: E402
+
+
+def legacy_prepare_page(image_data: bytes, max_side: int = preprocessing.OCR_MAX_SIDE):
+    """The PIL/OpenCV round trip main.py used before preprocessing.py: full page, smallest of three encodings."""
+    image = Image.open(io.BytesIO(image_data))
+    if max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    enhanced = ImageEnhance.Contrast(ImageOps.grayscale(image)).enhance(2.0)
+    blurred = cv2.GaussianBlur(np.array(enhanced), (5, 5), 0)
+    _, binary = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    gray = Image.fromarray(binary)
+    candidates = []
+    for mode, options in (("L", {"format": "PNG", "optimize": True}), ("1", {"format": "PNG", "optimize": True}),
+                          ("L", {"format": "JPEG", "quality": preprocessing.OCR_JPEG_QUALITY, "optimize": True})):
+        buffer = io.BytesIO()
+        gray.convert(mode).save(buffer, **options)
+        candidates.append(buffer.getvalue())
+    return min(candidates, key=len)
+
+
+def page_set(count: int, seed: int = 0) -> list:
+    """Phone-photo-like pages: varied margins and a tilt of up to 5 degrees."""
+    rng = random.Random(seed)
+    return [encode_png(synthetic_page(angle=rng.uniform(-5, 5), margin=rng.randint(200, 500), seed=index)) for index in range(count)]
+
+
+def run(name: str, pages: list, task, processes: int):
+    started = time.perf_counter()
+    if processes:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+            # Start the workers before timing, as the API's long-lived pool would be
+            list(pool.map(abs, range(processes)))
+            started = time.perf_counter()
+            results = list(pool.map(task, pages, chunksize=max(1, len(pages) // (4 * processes))))
+    else:
+        results = [task(page) for page in pages]
+    elapsed = time.perf_counter() - started
+    sizes = [len(result[0]) if isinstance(result, tuple) else len(result) for result in results]
+    cores = processes or 1
+    print(f"{name:34} {len(pages) / elapsed:9.2f} {len(pages) / elapsed / cores:10.2f} {sum(sizes) / len(sizes) / 1024:12.1f}")
+    return sizes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=24)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    pages = page_set(args.pages)
+    print(f"{args.pages} synthetic pages, {args.processes} processes on {os.cpu_count()} cores")
+    print(f"{'pipeline':34} {'pages/s':>9} {'pages/s/core':>10} {'avg KiB sent':>12}")
+    legacy = run("legacy (PIL, one thread)", pages, legacy_prepare_page, 0)
+    run("engine, 1 process", pages, preprocessing.page_task(), 0)
+    uncropped = run(f"engine, no deskew/crop, {args.processes} proc.",
+                    pages, preprocessing.partial(preprocessing.prepare_page, deskew=False, crop=False), args.processes)
+    cropped = run(f"engine, {args.processes} processes", pages, preprocessing.page_task(), args.processes)
+    print(f"payload saved by deskew + crop: {1 - sum(cropped) / sum(uncropped):.0%} "
+          f"({(sum(uncropped) - sum(cropped)) / len(pages) / 1024:.1f} KiB per page); "
+          f"vs legacy: {1 - sum(cropped) / sum(legacy):.0%}")
@@ -0,0 +1,109 @@
+"""Read path benchmark: seeds a large synthetic database and measures queries and latency per call.
+
+    python benchmarks/bench_read_path.py --authors 2000 --essays 5
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+from sqlalchemy import event, insert
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from database import create_db_engine, EssayImage  # noqa: E402
+
+GRADE_TYPES = ["ideas", "organization", "voice", "word_choice", "sentence_fluency", "conventions"]
+ESSAY_TEXT = "I visited puerto rico in 2015. It was very hot and the water was lightish blue. " * 10
+
+
+class QueryCounter:
+    """Counts the SQL queries an engine executes inside the `with` block, leaving out transaction control."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, connection, cursor, statement, *args):
+        if not statement.lstrip().upper().startswith(("BEGIN", "COMMIT", "ROLLBACK")):
+            self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._count)
+
+
+def seed_database(engine, authors: int, essays_per_author: int, images_per_essay: int = 2):
+    """Bulk inserts synthetic authors, each with essays, six grades and page images per essay."""
+    with engine.begin() as connection:
+        connection.execute(insert(main.Author), [
+            {"id": a + 1, "authorname": f"student{a + 1}", "name": f"Student {a + 1}"} for a in range(authors)
+        ])
+        essays = [
+            {"id": a * essays_per_author + e + 1, "author_id": a + 1, "title": f"Essay {e + 1}", "text": ESSAY_TEXT,
+             "date_submitted": f"2025-03-{e % 28 + 1:02d} 10:00:00"}
+            for a in range(authors) for e in range(essays_per_author)
+        ]
+        connection.execute(insert(main.Essay), essays)
+        connection.execute(insert(main.EssayGrade), [
+            {"essay_id": essay["id"], "grade_type": grade_type, "grade": (essay["id"] + i) % 5 + 1, "comments": "Add details."}
+            for essay in essays for i, grade_type in enumerate(GRADE_TYPES)
+        ])
+        connection.execute(insert(EssayImage), [
+            {"essay_id": essay["id"], "image_path": f"page_{p + 1}.png"}
+            for essay in essays for p in range(images_per_essay)
+        ])
+
+
+def measure(engine, call, repeat: int):
+    """Runs `call` `repeat` times and returns (queries per call, latencies in ms)."""
+    latencies = []
+    with QueryCounter(engine) as counter:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            call()
+            latencies.append((time.perf_counter() - started) * 1000)
+    return counter.count / repeat, latencies
+
+
+def run_benchmark(authors: int, essays_per_author: int, repeat: int, limit: int):
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_db_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        main.migrate_schema(engine)
+        started = time.perf_counter()
+        seed_database(engine, authors, essays_per_author)
+        print(f"Seeded {authors} authors x {essays_per_author} essays in {time.perf_counter() - started:.1f}s")
+
+        session = sessionmaker(bind=engine)()
+        middle = f"student{authors // 2}"
+        calls = {
+            "get_authors (first page)": lambda: main.get_authors(limit=limit, session=session),
+            "get_authors (last page)": lambda: main.get_authors(cursor=authors - limit, limit=limit, session=session),
+            "get_author_grades": lambda: main.get_author_grades(middle, limit=limit, session=session),
+        }
+        print(f"{'call':28} {'queries':>8} {'p50 ms':>8} {'p95 ms':>8}")
+        for name, call in calls.items():
+            session.expire_all()
+            queries, latencies = measure(engine, call, repeat)
+            latencies.sort()
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            print(f"{name:28} {queries:8.1f} {statistics.median(latencies):8.2f} {p95:8.2f}")
+        session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--authors", type=int, default=2000)
+    parser.add_argument("--essays", type=int, default=5, help="Essays per author")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=main.DEFAULT_PAGE_SIZE)
+    args = parser.parse_args()
+    run_benchmark(args.authors, args.essays, args.repeat, args.limit)
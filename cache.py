@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# SQLite file holding the persistent cache tiers, kept next to database.db
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "cache.db")
+# A size-bounded cache that goes over its limit evicts down to this share of it, so eviction runs once per burst of writes
+EVICT_TO = 0.9
+# Seconds between sweeps for expired entries and between writes of buffered access times
+MAINTENANCE_INTERVAL = 30
+
+
+def content_hash(*parts) -> str:
+    """Stable SHA-256 of the given parts (str, bytes or JSON-serializable values)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        elif not isinstance(part, bytes):
+            part = json.dumps(part, sort_keys=True).encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Two-tier cache: an in-memory LRU in front of a SQLite table.
+
+    Values are JSON-serializable. Keys are content hashes, so a changed input
+    (essay text, prompt, model, ...) simply misses instead of needing invalidation.
+    Optionally entries expire after `max_age` seconds and the least recently used
+    ones are evicted once the stored values exceed `max_bytes`.
+
+    Async code should use `aget`/`aset`: memory hits are answered inline and disk
+    reads and writes run on a worker thread, off the event loop.
+    """
+
+    def __init__(self, table: str, path: str = CACHE_DB_PATH, memory_size: int = 1024, enabled: bool = True,
+                 max_bytes: int = None, max_age: float = None):
+        self.table = table
+        self.path = path
+        self.memory_size = memory_size
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._memory = OrderedDict()
+        # Guards the memory tier and is never held during disk I/O, so the event loop can take it
+        self._memory_lock = threading.Lock()
+        # Guards the SQLite connection
+        self._lock = threading.Lock()
+        self._connection = None
+        # Bytes of stored values, kept as a running total instead of summed on every write
+        self._total_bytes = 0
+        # Access times not yet written to disk; they only matter when picking eviction victims
+        self._accessed = {}
+        self._maintained = 0.0
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "bypassed": 0, "evictions": 0}
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, "
+                "size INTEGER NOT NULL DEFAULT 0, accessed_at REAL NOT NULL DEFAULT 0)"
+            )
+            columns = {row[1] for row in self._connection.execute(f"PRAGMA table_info({self.table})")}
+            # Tables created before eviction existed lack the bookkeeping columns
+            if "size" not in columns:
+                self._connection.execute(f"ALTER TABLE {self.table} ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            if "accessed_at" not in columns:
+                self._connection.execute(f"ALTER TABLE {self.table} ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0")
+            self._connection.execute(f"CREATE INDEX IF NOT EXISTS ix_{self.table}_accessed_at ON {self.table} (accessed_at)")
+            self._connection.execute(f"CREATE INDEX IF NOT EXISTS ix_{self.table}_created_at ON {self.table} (created_at)")
+            self._connection.commit()
+            self._total_bytes = self._connection.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+        return self._connection
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.max_age is not None and now - created_at > self.max_age
+
+    def _remember(self, key: str, value, created_at: float):
+        with self._memory_lock:
+            self._memory[key] = (value, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _forget(self, rows):
+        """Deletes (key, size) rows from both tiers."""
+        with self._memory_lock:
+            for key, _ in rows:
+                self._memory.pop(key, None)
+                self._accessed.pop(key, None)
+        self._db().executemany(f"DELETE FROM {self.table} WHERE key = ?", [(key,) for key, _ in rows])
+        self._total_bytes -= sum(size for _, size in rows)
+        self.stats["evictions"] += len(rows)
+
+    def _memory_get(self, key: str, now: float):
+        """(True, value) on a memory hit, else (False, None)."""
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is None or self._expired(entry[1], now):
+                return False, None
+            self._memory.move_to_end(key)
+            if self.max_bytes is not None:
+                self._accessed[key] = now
+            self.stats["hits"] += 1
+            self.stats["memory_hits"] += 1
+            return True, entry[0]
+
+    def _disk_get(self, key: str, now: float):
+        with self._lock:
+            row = self._db().execute(f"SELECT value, created_at, size FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is not None and self._expired(row[1], now):
+                self._forget([(key, row[2])])
+                self._db().commit()
+                row = None
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            value = json.loads(row[0])
+            self._remember(key, value, row[1])
+            if self.max_bytes is not None:
+                with self._memory_lock:
+                    self._accessed[key] = now
+            self.stats["hits"] += 1
+            self.stats["disk_hits"] += 1
+            return value
+
+    def get(self, key: str):
+        """Returns the cached value for `key`, or None."""
+        now = time.time()
+        hit, value = self._memory_get(key, now)
+        return value if hit else self._disk_get(key, now)
+
+    async def aget(self, key: str):
+        """`get` for async code: only a memory miss goes to a worker thread."""
+        now = time.time()
+        hit, value = self._memory_get(key, now)
+        if hit:
+            return value
+        return await asyncio.get_running_loop().run_in_executor(None, self._disk_get, key, now)
+
+    def _store(self, key: str, encoded: str, now: float):
+        with self._lock:
+            db = self._db()
+            previous = db.execute(f"SELECT size FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            db.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, size, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, encoded, now, len(encoded), now),
+            )
+            self._total_bytes += len(encoded) - (previous[0] if previous else 0)
+            self._maintain(now)
+            db.commit()
+            self.stats["writes"] += 1
+
+    def set(self, key: str, value):
+        now = time.time()
+        self._remember(key, value, now)
+        self._store(key, json.dumps(value), now)
+
+    async def aset(self, key: str, value):
+        """`set` for async code: the value is in the memory tier at once and written to disk on a worker thread."""
+        now = time.time()
+        self._remember(key, value, now)
+        await asyncio.get_running_loop().run_in_executor(None, self._store, key, json.dumps(value), now)
+
+    def _flush_accessed(self):
+        with self._memory_lock:
+            accessed, self._accessed = self._accessed, {}
+        if accessed:
+            self._db().executemany(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?",
+                                   [(accessed_at, key) for key, accessed_at in accessed.items()])
+
+    def _maintain(self, now: float):
+        """Expires and evicts in batches: a sweep every MAINTENANCE_INTERVAL seconds, and eviction
+        down to EVICT_TO of `max_bytes` only once the total goes over it."""
+        due = now - self._maintained >= MAINTENANCE_INTERVAL
+        over = self.max_bytes is not None and self._total_bytes > self.max_bytes
+        if not (due or over):
+            return
+        self._flush_accessed()
+        if due:
+            self._maintained = now
+            if self.max_age is not None:
+                self._forget(self._db().execute(
+                    f"SELECT key, size FROM {self.table} WHERE created_at < ?", (now - self.max_age,)).fetchall())
+        if self.max_bytes is not None and self._total_bytes > self.max_bytes:
+            target = self.max_bytes * EVICT_TO
+            total, victims = self._total_bytes, []
+            # Walks the accessed_at index from the least recently used entry, only as far as needed
+            for key, size in self._db().execute(f"SELECT key, size FROM {self.table} ORDER BY accessed_at"):
+                if total <= target:
+                    break
+                victims.append((key, size))
+                total -= size
+            self._forget(victims)
+
+    def record_bypass(self):
+        with self._memory_lock:
+            self.stats["bypassed"] += 1
+
+    def clear(self):
+        with self._lock:
+            with self._memory_lock:
+                self._memory.clear()
+                self._accessed.clear()
+            self._db().execute(f"DELETE FROM {self.table}")
+            self._db().commit()
+            self._total_bytes = 0
+
+    def reset_stats(self):
+        with self._memory_lock:
+            for name in self.stats:
+                self.stats[name] = 0
+
+    def get_stats(self) -> dict:
+        with self._memory_lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+            }
@@ -0,0 +1,84 @@
+import asyncio
+import io
+
+import pytest
+from PIL import Image
+import database
+import grading
+import integrations
+import llm_gateway
+import main
+from rate_limit import RateLimiter, llm_limiter
+from cache import ResultCache
+from testing.sample_essay import SAMPLE_ESSAY_TEXT
+
+
+@pytest.fixture(autouse=True)
+def isolated_caches(tmp_path, monkeypatch):
+    """Gives every test empty caches stored under its own temporary directory."""
+    monkeypatch.setattr(grading, "grade_cache", ResultCache("grade_cache", path=str(tmp_path / "cache.db")))
+    monkeypatch.setattr(integrations, "ocr_cache", ResultCache("ocr_cache", path=str(tmp_path / "cache.db")))
+
+
+@pytest.fixture
+def isolated_gateway(monkeypatch):
+    """Lets a test point the gateway at a fake server and use the shared limiter from a fresh state.
+
+    The gateway settings and every attribute of the limiter (budgets, pauses, concurrency limit,
+    stats) are put back afterwards, so later tests neither reach a stopped server nor inherit a
+    halved limit or a pause.
+    """
+    monkeypatch.setattr(llm_gateway, "_settings", dict(llm_gateway._settings))
+    for name, value in vars(RateLimiter()).items():
+        monkeypatch.setattr(llm_limiter, name, value)
+    yield llm_limiter
+    # Drop the clients bound to the fake server; the next ones are built from the restored settings
+    llm_gateway.configure()
+
+
+@pytest.fixture
+def sample_essay():
+    """The transcribed sample essay from data/Anchor_-_2b, as the OCR step would return it."""
+    return SAMPLE_ESSAY_TEXT
+
+
+GRADES = [{"type": "ideas", "grade": 4, "comments": "Clear idea."}]
+
+
+@pytest.fixture
+def db_session(tmp_path):
+    """Points the app at an empty database under the test's temporary directory."""
+    previous = database.engine
+    engine = database.configure(f"sqlite:///{tmp_path / 'database.db'}")
+    database.migrate_schema(engine)
+    session = database.SessionLocal()
+    yield session
+    session.close()
+    engine.dispose()
+    database.configure(previous)
+
+
+@pytest.fixture
+def fake_pipeline(monkeypatch):
+    """Replaces the model calls: OCR returns the page width after a delay, grading returns GRADES."""
+    in_flight = {"now": 0, "max": 0, "calls": 0}
+
+    async def read_text(image_bytes, mime_type="image/png", use_cache=True):
+        width = Image.open(io.BytesIO(image_bytes)).width
+        in_flight["calls"] += 1
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        # Later pages answer first, so ordering has to come from the upload order
+        await asyncio.sleep(0.5 - width / 1000)
+        in_flight["now"] -= 1
+        return f"page-{width}"
+
+    async def grade(full_text, mode=None, use_cache=True, on_grade=None):
+        for record in GRADES:
+            if on_grade:
+                on_grade(record)
+        return GRADES
+
+    monkeypatch.setattr(main, "read_text_in_image_async", read_text)
+    monkeypatch.setattr(main, "grade_essay_mode_async", grade)
+    return in_flight
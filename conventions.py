@@ -0,0 +1,167 @@
+import os
+import re
+from functools import lru_cache
+import numpy as np
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# One lowercase word per line; inflected forms (plurals, -ed, -ing, ...) are derived from the base words
+WORDS_PATH = os.getenv("CONVENTIONS_WORDS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "words.txt"))
+
+# Essays shorter than this are always left to the model
+MIN_WORDS = 20
+# Clear-cut thresholds for the local grade; anything in between goes to the model.
+# Spelling alone never lowers a local grade: a word missing from the short word list may be
+# spelled correctly, so essays with many unknown words go to the model with the hint instead
+CLEAN_SPELLING_RATE = 0.01
+MISSING_PUNCTUATION_RATE = 0.5
+
+WORD_PATTERN = re.compile(r"[A-Za-z]+(?:'[A-Za-z]+)?")
+SENTENCE_PATTERN = re.compile(r"[^.!?]+[.!?]*")
+TERMINALS = ".!?"
+# Marks counted towards punctuation variety
+PUNCTUATION_MARKS = ".,!?;:\"'()-"
+
+# (suffix, replacement) pairs tried when a word is not in the list, e.g. "cried" -> "cry", "making" -> "make"
+SUFFIX_RULES = [
+    ("'s", ""), ("s'", "s"), ("ies", "y"), ("ied", "y"), ("ier", "y"), ("iest", "y"), ("ily", "y"), ("iness", "y"),
+    ("es", ""), ("s", ""), ("ed", ""), ("ed", "e"), ("d", ""), ("ing", ""), ("ing", "e"), ("er", ""), ("er", "e"),
+    ("est", ""), ("est", "e"), ("ly", ""), ("ful", ""), ("ness", ""), ("less", ""), ("ment", ""), ("y", ""),
+]
+PREFIXES = ("un", "re", "dis", "over", "out")
+
+
+@lru_cache(maxsize=1)
+def load_words(path: str = None) -> frozenset:
+    with open(path or WORDS_PATH) as words_file:
+        return frozenset(line.strip() for line in words_file if line.strip() and not line.startswith("#"))
+
+
+@lru_cache(maxsize=65536)
+def is_known(word: str, depth: int = 2) -> bool:
+    """True if `word` (lowercase) is in the word list or derives from one by a common suffix or prefix."""
+    words = load_words()
+    if word in words:
+        return True
+    if depth == 0:
+        return False
+    for suffix, replacement in SUFFIX_RULES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 2:
+            stem = word[:len(word) - len(suffix)]
+            # Doubled final consonant: running -> run, hopped -> hop
+            if is_known(stem + replacement, depth - 1) or (len(stem) > 2 and stem[-1] == stem[-2] and is_known(stem[:-1], depth - 1)):
+                return True
+    return any(word.startswith(prefix) and is_known(word[len(prefix):], depth - 1) for prefix in PREFIXES if len(word) > len(prefix) + 2)
+
+
+def analyze_batch(texts: list) -> dict:
+    """Conventions features for a batch of essays, one array entry per essay.
+
+    Spelling is checked once per distinct word across the whole batch, and the per-essay
+    counts are reduced with `np.bincount`. Capitalized words other than "I" are skipped by
+    the spelling check, since most of them are names the word list cannot know.
+    """
+    count = len(texts)
+    word_owner, words, sentence_owner, sentence_flags, lowercase_i, variety = [], [], [], [], [], []
+    for index, text in enumerate(texts):
+        checked = [word.lower() for word in WORD_PATTERN.findall(text) if not word[0].isupper() or word == "I"]
+        words.extend(checked)
+        word_owner.extend([index] * len(checked))
+        for sentence in SENTENCE_PATTERN.findall(text):
+            letters = [char for char in sentence if char.isalpha()]
+            if not letters:
+                continue
+            sentence_owner.append(index)
+            sentence_flags.append((letters[0].isupper(), sentence.rstrip()[-1] in TERMINALS))
+        lowercase_i.append(len(re.findall(r"(?<![A-Za-z'])i(?![A-Za-z])", text)))
+        variety.append(len(set(text) & set(PUNCTUATION_MARKS)))
+
+    word_owner = np.asarray(word_owner, dtype=np.intp)
+    if words:
+        unique_words, inverse = np.unique(np.asarray(words), return_inverse=True)
+        unknown_unique = np.fromiter((not is_known(str(word)) for word in unique_words), dtype=bool, count=len(unique_words))
+        unknown = unknown_unique[inverse]
+    else:
+        unknown = np.zeros(0, dtype=bool)
+    word_count = np.bincount(word_owner, minlength=count)
+    misspelled = np.bincount(word_owner, weights=unknown, minlength=count).astype(int)
+
+    sentence_owner = np.asarray(sentence_owner, dtype=np.intp)
+    flags = np.asarray(sentence_flags, dtype=bool).reshape(-1, 2)
+    sentences = np.bincount(sentence_owner, minlength=count)
+    capitalized = np.bincount(sentence_owner, weights=flags[:, 0], minlength=count).astype(int)
+    terminated = np.bincount(sentence_owner, weights=flags[:, 1], minlength=count).astype(int)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "words": word_count,
+            "misspelled": misspelled,
+            "misspelling_rate": np.where(word_count > 0, misspelled / np.maximum(word_count, 1), 0.0),
+            "sentences": sentences,
+            "capitalized": capitalized,
+            "capitalization_rate": np.where(sentences > 0, capitalized / np.maximum(sentences, 1), 0.0),
+            "terminated": terminated,
+            "terminal_rate": np.where(sentences > 0, terminated / np.maximum(sentences, 1), 0.0),
+            "lowercase_i": np.asarray(lowercase_i, dtype=int),
+            "punctuation_variety": np.asarray(variety, dtype=int),
+            "examples": [examples(text) for text in texts],
+        }
+
+
+def examples(text: str, limit: int = 3) -> list:
+    """A few words of the essay that are not in the word list, for feedback."""
+    found = []
+    for word in WORD_PATTERN.findall(text):
+        lower = word.lower()
+        if (not word[0].isupper() or word == "I") and lower not in found and not is_known(lower):
+            found.append(lower)
+            if len(found) == limit:
+                break
+    return found
+
+
+def local_grades(features: dict) -> np.ndarray:
+    """Rubric grade for the clear-cut essays of a batch and 0 for the ones the model should grade.
+
+    1: sentences mostly lack capitals and end punctuation.
+    4: spelling, capitals and end punctuation are all correct, but only periods are used.
+    """
+    long_enough = features["words"] >= MIN_WORDS
+    missing_punctuation = (features["terminal_rate"] == 0) | (
+        (features["terminal_rate"] < MISSING_PUNCTUATION_RATE) & (features["capitalization_rate"] < MISSING_PUNCTUATION_RATE))
+    clean = ((features["misspelling_rate"] <= CLEAN_SPELLING_RATE) & (features["capitalization_rate"] == 1)
+             & (features["terminal_rate"] == 1) & (features["lowercase_i"] == 0) & (features["punctuation_variety"] <= 1))
+    grades = np.select([missing_punctuation, clean], [1, 4], default=0)
+    return np.where(long_enough, grades, 0)
+
+
+def essay_features(features: dict, index: int) -> dict:
+    """Plain-Python features of one essay of a batch."""
+    return {key: (values[index] if key == "examples" else values[index].item()) for key, values in features.items()}
+
+
+def analyze(text: str) -> dict:
+    """Conventions features of one essay, plus its local grade (0 when not clear-cut)."""
+    features = analyze_batch([text])
+    return {**essay_features(features, 0), "local_grade": int(local_grades(features)[0])}
+
+
+def local_comments(features: dict) -> str:
+    """Short feedback for a locally graded essay, in the voice of the rubric."""
+    grade = features["local_grade"]
+    if grade == 1:
+        return "Remember to start every sentence with a capital letter and end it with a period, question mark or exclamation point."
+    return "Your spelling, capital letters and end punctuation are correct. Try using commas, question marks or quotes for variety."
+
+
+def features_hint(features: dict) -> str:
+    """One-line summary of the features to attach to the model prompt."""
+    parts = [f"{features['misspelling_rate']:.0%} of checked words are not in a basic word list"
+             + (f" (e.g. {', '.join(features['examples'])})" if features["examples"] else ""),
+             f"{features['capitalized']} of {features['sentences']} sentences start with a capital letter",
+             f"{features['terminated']} of {features['sentences']} end with . ! or ?"]
+    if features["lowercase_i"]:
+        parts.append(f"lowercase 'i' used {features['lowercase_i']} times")
+    return "Automated conventions checks (they can miss names and rare words): " + "; ".join(parts) + "."
@@ -1,13 +1,42 @@
 # from llama_index import ServiceContext, LLMPredictor
-from openai import OpenAI
+from openai import AsyncOpenAI
+import asyncio
 import json
 import os
 from dotenv import load_dotenv
+import llm_gateway
+from cache import ResultCache, content_hash
+from rate_limit import llm_limiter, estimate_tokens
+from conventions import analyze, local_comments, features_hint
+from metrics import usage_record, record_usage, model_call, category_seconds
 
 
 load_dotenv()
 
-prompt_one_grader = """You are an expert writing evaluator and you are going to write evaluations for children between the age of 5 and 12. Given the essay below, assess it based on the following categories:
+GRADING_MODEL = "gpt-4o"
+# Maximum number of category requests in flight at once for a single essay
+GRADING_CONCURRENCY = int(os.getenv("GRADING_CONCURRENCY", "6"))
+# "per_category" sends one request per rubric category, "combined" grades every category in one request.
+# main.py also accepts "offline", which leaves grading to batch_grading.py
+GRADING_MODES = ("per_category", "combined")
+GRADING_MODE = os.getenv("GRADING_MODE", "per_category")
+# Set to 0 to always call the model instead of reusing stored grades for identical essays
+GRADE_CACHE_ENABLED = os.getenv("GRADE_CACHE_ENABLED", "1") == "1"
+# How the conventions category uses the local analyzer (conventions.py):
+# "llm" always asks the model, "hint" attaches the analyzer's features to the model prompt,
+# "local" grades clear-cut essays locally without a model call and sends the rest with the hint
+CONVENTIONS_POLICIES = ("llm", "hint", "local")
+CONVENTIONS_POLICY = os.getenv("CONVENTIONS_POLICY", "llm")
+# Expected completion sizes, reserved against the tokens-per-minute budget before each request
+GRADER_COMPLETION_TOKENS = 400
+COMBINED_GRADER_COMPLETION_TOKENS = 1500
+
+# Context every grading request starts with, ahead of the essay and the category instructions
+GRADER_CONTEXT = "You are an expert writing evaluator and you are going to write evaluations for children between the age of 5 and 12. You will be given an essay, followed by instructions for the categories to grade it on."
+
+grade_cache = ResultCache("grade_cache", memory_size=int(os.getenv("GRADE_CACHE_MEMORY_SIZE", "1024")), enabled=GRADE_CACHE_ENABLED)
+
+prompt_one_grader = """You are an expert writing evaluator and you are going to write evaluations for children between the age of 5 and 12. Given the essay above, assess it based on the following categories:
 Ideas:
 Are the ideas clear, focused, and original?
 Grade (1-5): Provide detailed reasoning.
@@ -32,11 +61,9 @@ Conventions:
 Is the essay free from spelling, punctuation, and grammatical errors?
 Grade (1-5): Provide detailed reasoning.
 
-After providing grades, include specific, actionable suggestions for improvement in each category.
+After providing grades, include specific, actionable suggestions for improvement in each category."""
 
-Essay:"""
-
-prompt_ideas = """ Ideas Grader: You are an expert writing evaluator and you are going to write evaluations for children between the age of 5 and 12. Given the essay below, evaluate the essay specifically for the clarity, originality, and development of ideas. Grade (1-5) based on how clear, focused, original, and thoroughly developed the main idea is. Provide detailed reasoning and succint suggestions (less than 180 characters) for improving idea development and creativity.
+prompt_ideas = """ Ideas Grader: You are an expert writing evaluator and you are going to write evaluations for children between the age of 5 and 12. Given the essay above, evaluate the essay specifically for the clarity, originality, and development of ideas. Grade (1-5) based on how clear, focused, original, and thoroughly developed the main idea is. Provide detailed reasoning and succint suggestions (less than 180 characters) for improving idea development and creativity.
 Grades explanation:
 1: I started my writing, but I need to add ideas connected to the topic.
 2: I have a focus, but I need to make my main idea clearer.
@@ -45,7 +72,7 @@ Grades explanation:
 5: I have a clear, focused, important, and fully developed main idea, with original thoughts and opinions.
 """
 
-prompt_organization = """ Organization Grader: You are an expert writing evaluator and you are going to write evaluations for children between the age of 5 and 12. Given the essay below, evaluate the essay specifically for organization, structure, clarity of transitions, and effectiveness of the conclusion. Grade (1-5) based on how well-organized, clear, and purposeful the writing is. Provide detailed reasoning and succint suggestions (less than 180 characters)  for improving the essay's organization and transitions.
+prompt_organization = """ Organization Grader: You are an expert writing evaluator and you are going to write evaluations for children between the age of 5 and 12. Given the essay above, evaluate the essay specifically for organization, structure, clarity of transitions, and effectiveness of the conclusion. Grade (1-5) based on how well-organized, clear, and purposeful the writing is. Provide detailed reasoning and succint suggestions (less than 180 characters)  for improving the essay's organization and transitions.
 Grades explanation:
 1: I have sentences, but I can organize them better so they make more sense.
 2: I have sentences but I need to organize my ideas into a clear paragraph and add transitions.
@@ -54,7 +81,7 @@ Grades explanation:
 5: I have a clear purpose, satisfying conclusion, and use thoughtful, varied language to keep the reader's attention.
 """
 
-prompt_voice = """ Voice Grader: You are an expert writing evaluator and you are going to write evaluations for children between the age of 5 and 12. Given the essay below, evaluate the essay specifically for voice, tone, expression of personality, and reader engagement. Grade (1-5) based on how effectively the writer expresses their opinion, engages the reader, and shows personality in the writing. Provide detailed reasoning and succint suggestions (less than 180 characters)  for improving the essay's voice and reader engagement.
+prompt_voice = """ Voice Grader: You are an expert writing evaluator and you are going to write evaluations for children between the age of 5 and 12. Given the essay above, evaluate the essay specifically for voice, tone, expression of personality, and reader engagement. Grade (1-5) based on how effectively the writer expresses their opinion, engages the reader, and shows personality in the writing. Provide detailed reasoning and succint suggestions (less than 180 characters)  for improving the essay's voice and reader engagement.
 Grades explanation:
 1: I have sentences, but I need to express my opinion.
 2: I shared my opinion, but I can express how I feel about the topic better.
@@ -63,7 +90,7 @@ Grades explanation:
 5: I have a strong tone that supports my topic and engages the reader, and I consistently use a variety of techniques to enhance the flavor of my writing.
 """
 
-prompt_word_choice = """ Word Choice Grader: You are an expert writing evaluator and you are going to write evaluations for children between the age of 5 and 12. Given the essay below, evaluate the essay specifically for word choice, vocabulary variety, and use of figurative language. Grade (1-5) based on how well the writer selects words to enhance meaning and avoid repetition. Provide detailed reasoning and succint suggestions (less than 180 characters)  for improving word choice and vocabulary usage.
+prompt_word_choice = """ Word Choice Grader: You are an expert writing evaluator and you are going to write evaluations for children between the age of 5 and 12. Given the essay above, evaluate the essay specifically for word choice, vocabulary variety, and use of figurative language. Grade (1-5) based on how well the writer selects words to enhance meaning and avoid repetition. Provide detailed reasoning and succint suggestions (less than 180 characters)  for improving word choice and vocabulary usage.
 Grades explanation:
 1: I have ideas, but I need to make sure I use the right words without repeating.
 2: I have some juicy words, but I can add more juicy words that fit.
@@ -72,7 +99,7 @@ Grades explanation:
 5: I use strong and specific words to create imagery for my reader, but I can add more powerful/varied types of figurative language.
 """
 
-prompt_sentence_fluency = """ Sentence Fluency Grader: You are an expert writing evaluator and you are going to write evaluations for children between the age of 5 and 12. Given the essay below, evaluate the essay specifically for sentence structure, rhythm, and variety. Grade (1-5) based on how well the sentences flow, their complexity, and variation in structure. Provide detailed reasoning and succint suggestions (less than 180 characters)  for improving sentence fluency and rhythm.
+prompt_sentence_fluency = """ Sentence Fluency Grader: You are an expert writing evaluator and you are going to write evaluations for children between the age of 5 and 12. Given the essay above, evaluate the essay specifically for sentence structure, rhythm, and variety. Grade (1-5) based on how well the sentences flow, their complexity, and variation in structure. Provide detailed reasoning and succint suggestions (less than 180 characters)  for improving sentence fluency and rhythm.
 Grades explanation:
 1: I have complete sentences, but they can be reorganized to help my reader understand them better.
 2: I have sentences that make sense, but I can try using complex and compound sentences.
@@ -81,7 +108,7 @@ Grades explanation:
 5: I have well-structured sentences with strong rhythm and cadence, and I use varied words/phrases to enhance the flow of the overall writing.
 """
 
-prompt_conventions = """ Conventions Grader: You are an expert writing evaluator and you are going to write evaluations for children between the age of 5 and 12. Given the essay below, evaluate the essay specifically for spelling, punctuation, and grammar accuracy. Grade (1-5) based on how well the writer follows standard writing conventions. Provide detailed reasoning and succint suggestions (less than 180 characters) for improving grammar, punctuation, and spelling.
+prompt_conventions = """ Conventions Grader: You are an expert writing evaluator and you are going to write evaluations for children between the age of 5 and 12. Given the essay above, evaluate the essay specifically for spelling, punctuation, and grammar accuracy. Grade (1-5) based on how well the writer follows standard writing conventions. Provide detailed reasoning and succint suggestions (less than 180 characters) for improving grammar, punctuation, and spelling.
 Grades explanation:
 1: I have ideas, but I need to add periods and capital letters.
 2: I have sentences and the reader understands some of what I’m saying, but I have some errors that make my writing hard to understand.
@@ -91,17 +118,149 @@ Grades explanation:
 """
 
 
-def single_grader(essay_text: str, prompt: str =prompt_one_grader):
+categories = {
+    "ideas": prompt_ideas,
+    "organization": prompt_organization,
+    "voice": prompt_voice,
+    "word_choice": prompt_word_choice,
+    "sentence_fluency": prompt_sentence_fluency,
+    "conventions": prompt_conventions,
+}
+
+
+def essay_prefix(essay_text: str):
+    """The turns every grading request for an essay starts with: the shared grader context, then the essay.
+
+    Category instructions come after them, so all requests for one essay (per-category and
+    combined alike) share this prefix and the provider can serve it from its prompt cache
+    once it is long enough to be cached.
+    """
+    return [
+        {"role": "system", "content": GRADER_CONTEXT},
+        {"role": "user", "content": f"Here is the essay to be graded:\n\n{essay_text}"},
+    ]
+
+
+def grader_messages(essay_text: str, prompt: str, hint: str = None):
+    notes = f"{hint}\n\n" if hint else ""
+    return essay_prefix(essay_text) + [
+        {"role": "user", "content": f"{prompt.strip()}\n\n{notes}Provide a structured JSON response with 'grade' and 'comments' as keys."}
+    ]
+
+
+def combined_grader_messages(essay_text: str, hint: str = None):
+    keys = ", ".join(f"'{category}'" for category in categories)
+    notes = f"{hint}\n\n" if hint else ""
+    return essay_prefix(essay_text) + [
+        {"role": "user", "content": f"{prompt_one_grader}\n\n{notes}Provide a structured JSON response with {keys} as keys. Each key maps to an object with 'grade' (1-5) and 'comments' (reasoning and suggestions) as keys."}
+    ]
+
+
+def usage_totals(grades: list) -> dict:
+    """Sums the usage of an essay's grade records; cached_tokens is what prompt caching saved from full-price input."""
+    totals = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+    for grade in grades:
+        for key, value in (grade.get("usage") or {}).items():
+            totals[key] += value or 0
+    return totals
+
+
+def conventions_plan(essay_text: str, policy: str = None, features: dict = None):
+    """Applies the conventions policy to one essay.
+
+    Returns (result, hint): a local {"grade", "comments"} result when the essay is clear-cut
+    under the "local" policy (no model call needed), otherwise None and the hint to attach
+    to the model prompt (None under the "llm" policy). `features` can come from a batch
+    run of `conventions.analyze_batch`.
+    """
+    policy = policy or CONVENTIONS_POLICY
+    if policy not in CONVENTIONS_POLICIES:
+        raise ValueError(f"Unknown conventions policy {policy!r}. Expected one of {', '.join(CONVENTIONS_POLICIES)}.")
+    if policy == "llm":
+        return None, None
+    features = features or analyze(essay_text)
+    if policy == "local" and features["local_grade"]:
+        return {"grade": features["local_grade"], "comments": local_comments(features)}, None
+    return None, features_hint(features)
+
+
+def parse_grader_content(content: str):
+    try:
+        result = json.loads(content)
+        return result
+    except (json.JSONDecodeError, TypeError):
+        return {"error": "Failed to parse LLM response. Try reformatting the prompt."}
+
+
+def parse_grader_response(response):
+    return parse_grader_content(response.choices[0].message.content)
+
+
+def normalize_essay(essay_text: str) -> str:
+    return " ".join(essay_text.split())
+
+
+def grade_cache_key(messages) -> str:
+    """Cache key for a grading request: the model plus the full messages built from the normalized essay.
+
+    The prompt is part of the messages, so editing a prompt string changes every key built from it.
+    """
+    return content_hash(GRADING_MODEL, messages)
+
+
+def cached_grade(key: str, use_cache: bool):
+    if not (use_cache and grade_cache.enabled):
+        grade_cache.record_bypass()
+        return None
+    return grade_cache.get(key)
+
+
+def store_grade(key: str, result: dict, use_cache: bool):
+    if use_cache and grade_cache.enabled and "error" not in result:
+        grade_cache.set(key, result)
+
+
+async def cached_grade_async(key: str, use_cache: bool):
+    """`cached_grade` reading the disk tier off the event loop."""
+    if not (use_cache and grade_cache.enabled):
+        grade_cache.record_bypass()
+        return None
+    return await grade_cache.aget(key)
+
+
+async def store_grade_async(key: str, result: dict, use_cache: bool):
+    if use_cache and grade_cache.enabled and "error" not in result:
+        await grade_cache.aset(key, result)
+
+
+def grade_record(category: str, result: dict):
+    record = {
+        "type": category,
+        "grade": result.get("grade", "N/A"),
+        "comments": result.get("comments", "N/A")
+    }
+    # Only results that came from a model response carry usage; cached and local ones cost nothing
+    if result.get("usage"):
+        record["usage"] = result["usage"]
+    return record
+
+
+def single_grader(essay_text: str, prompt: str =prompt_one_grader, use_cache: bool = True):
     """
     Grades an essay using LlamaIndex with OpenAI chat models.
     
     Parameters:
     - essay_text (str): The text of the essay to be graded.
     - prompt (str): The grading criteria prompt.
+    - use_cache (bool): Reuse a stored result for the same essay, prompt and model.
 
     Returns:
     - dict: A dictionary containing the grade and comments.
     """
+    key = grade_cache_key(grader_messages(normalize_essay(essay_text), prompt))
+    cached = cached_grade(key, use_cache)
+    if cached is not None:
+        return cached
 
     # Initialize LlamaIndex with OpenAI's GPT-4 model
     # service_context = ServiceContext.from_defaults(
@@ -109,44 +268,175 @@ def single_grader(essay_text: str, prompt: str =prompt_one_grader):
     # )
     # llm_predictor = LLMPredictor(llm=service_context.llm)
 
-    # Use the structured chat format with system and user messages
-    messages = [
-        {"role": "system", "content": prompt},
-        {"role": "user", "content": f"Here is the essay to be graded:\n\n{essay_text}\n\nProvide a structured JSON response with 'grade' and 'comments' as keys."}
-    ]
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    messages = grader_messages(essay_text, prompt)
+    client = llm_gateway.get_client()
 
     # Get the response from LLM
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        response_format={"type": "json_object"},
-    )
+    def send():
+        with model_call(GRADING_MODEL, "grading"):
+            return client.chat.completions.create(
+                model=GRADING_MODEL,
+                messages=messages,
+                response_format={"type": "json_object"},
+                timeout=llm_gateway.GRADING_TIMEOUT,
+            )
 
-    try:
-        result = json.loads(response.choices[0].message.content)
-        return result
-    except json.JSONDecodeError:
-        return {"error": "Failed to parse LLM response. Try reformatting the prompt."}
+    response = llm_limiter.call_sync(send, estimate_tokens(messages, GRADER_COMPLETION_TOKENS))
+    result = parse_grader_response(response)
+    store_grade(key, result, use_cache)
+    usage = usage_record(getattr(response, "usage", None))
+    record_usage(GRADING_MODEL, usage)
+    return {**result, "usage": usage} if usage else result
 
-def grade_essay(essay: str):
-    categories = {
-        "ideas": prompt_ideas,
-        "organization": prompt_organization,
-        "voice": prompt_voice,
-        "word_choice": prompt_word_choice,
-        "sentence_fluency": prompt_sentence_fluency,
-        "conventions": prompt_conventions,
-    }
-    graders = []
-    for category, prompt in categories.items():
-        result = single_grader(essay, prompt=prompt)
-        graders.append({
-            "type": category,
-            "grade": result.get("grade", "N/A"),
-            "comments": result.get("comments", "N/A")
-        })
-    return graders
+
+async def single_grader_async(essay_text: str, prompt: str = prompt_one_grader, client: AsyncOpenAI = None, use_cache: bool = True, hint: str = None):
+    """
+    Async counterpart of `single_grader`.
+
+    Parameters:
+    - essay_text (str): The text of the essay to be graded.
+    - prompt (str): The grading criteria prompt.
+    - client (AsyncOpenAI): Client to send the request with. Defaults to the shared gateway client.
+    - use_cache (bool): Reuse a stored result for the same essay, prompt and model.
+    - hint (str): Extra notes for the model, e.g. the local conventions checks.
+
+    Returns:
+    - dict: A dictionary containing the grade and comments.
+    """
+    key = grade_cache_key(grader_messages(normalize_essay(essay_text), prompt, hint))
+    cached = await cached_grade_async(key, use_cache)
+    if cached is not None:
+        return cached
+
+    client = client or llm_gateway.get_async_client()
+    messages = grader_messages(essay_text, prompt, hint)
+
+    async def send():
+        with model_call(GRADING_MODEL, "grading"):
+            return await client.chat.completions.create(
+                model=GRADING_MODEL,
+                messages=messages,
+                response_format={"type": "json_object"},
+                timeout=llm_gateway.GRADING_TIMEOUT,
+            )
+
+    response = await llm_limiter.call(send, estimate_tokens(messages, GRADER_COMPLETION_TOKENS))
+    result = parse_grader_response(response)
+    await store_grade_async(key, result, use_cache)
+    usage = usage_record(getattr(response, "usage", None))
+    record_usage(GRADING_MODEL, usage)
+    return {**result, "usage": usage} if usage else result
+
+
+async def grade_essay_async(essay: str, max_concurrency: int = GRADING_CONCURRENCY, client: AsyncOpenAI = None, use_cache: bool = True, on_grade=None):
+    """
+    Grades an essay on every rubric category, sending the category requests concurrently.
+
+    Parameters:
+    - essay (str): The text of the essay to be graded.
+    - max_concurrency (int): Maximum number of category requests in flight at once.
+    - client (AsyncOpenAI): Client to send the requests with. Defaults to the shared gateway client.
+    - use_cache (bool): Reuse stored results for the same essay, prompt and model.
+    - on_grade (callable): Called with each category's record as soon as that category is graded.
+
+    Returns:
+    - list: One {"type", "grade", "comments"} dict per category, in rubric order.
+    """
+    client = client or llm_gateway.get_async_client()
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def grade_category(category: str, prompt: str):
+        with category_seconds.time(category=category):
+            result, hint = conventions_plan(essay) if category == "conventions" else (None, None)
+            if result is None:
+                async with semaphore:
+                    result = await single_grader_async(essay, prompt, client=client, use_cache=use_cache, hint=hint)
+        record = grade_record(category, result)
+        if on_grade:
+            on_grade(record)
+        return record
+
+    return list(await asyncio.gather(*(grade_category(category, prompt) for category, prompt in categories.items())))
+
+
+async def grade_essay_combined_async(essay: str, client: AsyncOpenAI = None, use_cache: bool = True, on_grade=None):
+    """
+    Grades an essay on every rubric category with a single request using `prompt_one_grader`.
+
+    Parameters:
+    - essay (str): The text of the essay to be graded.
+    - client (AsyncOpenAI): Client to send the request with. Defaults to the shared gateway client.
+    - use_cache (bool): Reuse a stored result for the same essay, prompt and model.
+    - on_grade (callable): Called with each category's record once the single response is in.
+
+    Returns:
+    - list: One {"type", "grade", "comments"} dict per category, in rubric order.
+    """
+    # One request covers every category anyway, so the conventions analyzer can only add its hint here
+    _, hint = conventions_plan(essay, "hint" if CONVENTIONS_POLICY == "local" else None)
+    key = grade_cache_key(combined_grader_messages(normalize_essay(essay), hint))
+    result = await cached_grade_async(key, use_cache)
+    if result is None:
+        client = client or llm_gateway.get_async_client()
+        messages = combined_grader_messages(essay, hint)
+
+        async def send():
+            with model_call(GRADING_MODEL, "grading"):
+                return await client.chat.completions.create(
+                    model=GRADING_MODEL,
+                    messages=messages,
+                    response_format={"type": "json_object"},
+                    timeout=llm_gateway.GRADING_TIMEOUT,
+                )
+
+        response = await llm_limiter.call(send, estimate_tokens(messages, COMBINED_GRADER_COMPLETION_TOKENS))
+        result = parse_grader_response(response)
+        await store_grade_async(key, result, use_cache)
+        usage = usage_record(getattr(response, "usage", None))
+        record_usage(GRADING_MODEL, usage)
+    else:
+        usage = None
+    records = [grade_record(category, category_result(result, category)) for category in categories]
+    if usage:
+        # One response graded every category; its usage is recorded once, on the first category
+        records[0]["usage"] = usage
+    if on_grade:
+        for record in records:
+            on_grade(record)
+    return records
+
+
+def category_result(result: dict, category: str):
+    """Picks one category out of a combined grading response, tolerating loose key spelling."""
+    value = result.get(category)
+    if value is None:
+        wanted = category.replace("_", "")
+        for key, candidate in result.items():
+            if key.lower().replace(" ", "").replace("_", "") == wanted:
+                value = candidate
+                break
+    return value if isinstance(value, dict) else {}
+
+
+async def grade_essay_mode_async(essay: str, mode: str = None, max_concurrency: int = GRADING_CONCURRENCY, client: AsyncOpenAI = None, use_cache: bool = True, on_grade=None):
+    """Grades an essay with the given grading mode, falling back to `GRADING_MODE`."""
+    mode = mode or GRADING_MODE
+    if mode not in GRADING_MODES:
+        raise ValueError(f"Unknown grading mode {mode!r}. Expected one of {', '.join(GRADING_MODES)}.")
+    if mode == "combined":
+        return await grade_essay_combined_async(essay, client=client, use_cache=use_cache, on_grade=on_grade)
+    return await grade_essay_async(essay, max_concurrency, client=client, use_cache=use_cache, on_grade=on_grade)
+
+
+def grade_essay(essay: str, max_concurrency: int = GRADING_CONCURRENCY, mode: str = None, use_cache: bool = True):
+    """Synchronous wrapper around `grade_essay_mode_async` for callers outside an event loop."""
+    async def run():
+        try:
+            return await grade_essay_mode_async(essay, mode, max_concurrency, use_cache=use_cache)
+        finally:
+            await llm_gateway.aclose()
+
+    return asyncio.run(run())
 
 if __name__ == "__main__":
     essay_example = "This is an example essay. It should be evaluated based on the given rubric."
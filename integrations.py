@@ -1,8 +1,15 @@
+import io
 import os
+import re
+import tempfile
+import asyncio
 from brainbase_labs import BrainbaseLabs
 from dotenv import load_dotenv
-from openai import OpenAI
 import base64
+import llm_gateway
+from cache import ResultCache, content_hash
+from rate_limit import llm_limiter, estimate_tokens
+from metrics import model_call, record_usage, usage_record
 from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey
 from sqlalchemy.orm import relationship
 
@@ -10,6 +17,36 @@ from sqlalchemy.orm import relationship
 # Load environment variables from .env file
 load_dotenv()
 
+OCR_MODEL = "gpt-4o"
+OCR_PROMPT = "Return only the text that is in the image. Be as precise."
+# Expected transcription size, reserved against the tokens-per-minute budget before each request
+OCR_COMPLETION_TOKENS = 600
+# Transcriptions of previously seen page images, keyed by a hash of the preprocessed image bytes
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "1") == "1"
+OCR_CACHE_MAX_MB = float(os.getenv("OCR_CACHE_MAX_MB", "64"))
+OCR_CACHE_MAX_AGE_DAYS = float(os.getenv("OCR_CACHE_MAX_AGE_DAYS", "30"))
+# Escalated pages sent together in one vision request; 1 sends each page on its own
+OCR_PAGES_PER_REQUEST = int(os.getenv("OCR_PAGES_PER_REQUEST", "1"))
+# Resolution PDF pages are rendered at; 200 dpi puts a letter page near OCR_MAX_SIDE
+PDF_DPI = int(os.getenv("PDF_DPI", "200"))
+PDF_RENDER_TIMEOUT = int(os.getenv("PDF_RENDER_TIMEOUT", "60"))
+# Line the model starts each page's transcription with in a multi-page request
+PAGE_MARKER = "=== PAGE {} ==="
+PAGE_MARKER_PATTERN = re.compile(r"^\s*=== PAGE (\d+) ===\s*$", re.MULTILINE)
+OCR_MULTI_PAGE_PROMPT = (
+    "The images are {count} separate pages. For each page, in order, write the line "
+    f"'{PAGE_MARKER.format('N')}' with N the page number, then return only the text that is "
+    "on that page. Be as precise."
+)
+
+ocr_cache = ResultCache(
+    "ocr_cache",
+    memory_size=int(os.getenv("OCR_CACHE_MEMORY_SIZE", "256")),
+    enabled=OCR_CACHE_ENABLED,
+    max_bytes=int(OCR_CACHE_MAX_MB * 1024 * 1024),
+    max_age=OCR_CACHE_MAX_AGE_DAYS * 24 * 60 * 60,
+)
+
 # Function to encode the image
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
@@ -25,69 +62,195 @@ def get_brainbase_client():
     return client
 
 def get_openai_client():
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-    return client
+    # Shared, connection-pooled client owned by the gateway
+    return llm_gateway.get_client()
 
-def read_text_in_image(image_path: str):
+def image_mime_type(image_path: str):
+    extension = os.path.splitext(image_path)[1].lower()
+    return {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp", ".gif": "image/gif"}.get(extension, "image/png")
+
+def ocr_messages(image_bytes: bytes, mime_type: str = "image/png"):
     # Getting the Base64 string
-    client = get_openai_client()
-    base64_image = encode_image(image_path)
-
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    { "type": "text", "text": "Return only the text that is in the image. Be as precise." },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}",
-                        },
+    base64_image = base64.b64encode(image_bytes).decode("utf-8")
+    return [
+        {
+            "role": "user",
+            "content": [
+                { "type": "text", "text": OCR_PROMPT },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime_type};base64,{base64_image}",
                     },
-                ],
-            }
-        ],
-    )
-    return completion.choices[0].message.content
+                },
+            ],
+        }
+    ]
+
+def multi_page_ocr_messages(pages: list):
+    """One vision message holding several (image bytes, mime type) pages, each image preceded by its page label."""
+    content = [{"type": "text", "text": OCR_MULTI_PAGE_PROMPT.format(count=len(pages))}]
+    for number, (image_bytes, mime_type) in enumerate(pages, start=1):
+        base64_image = base64.b64encode(image_bytes).decode("utf-8")
+        content.append({"type": "text", "text": f"Page {number}:"})
+        content.append({"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}})
+    return [{"role": "user", "content": content}]
+
+def split_pages(text: str, count: int):
+    """Splits a multi-page transcription at its page markers, or returns None if they are not pages 1..count in order."""
+    markers = list(PAGE_MARKER_PATTERN.finditer(text or ""))
+    if [int(marker.group(1)) for marker in markers] != list(range(1, count + 1)):
+        return None
+    ends = [marker.start() for marker in markers[1:]] + [len(text)]
+    return [text[marker.end():end].strip("\n") for marker, end in zip(markers, ends)]
+
+def transcription_key(image_bytes: bytes) -> str:
+    # Identical page images return the stored transcription without a vision call
+    return content_hash(OCR_MODEL, OCR_PROMPT, image_bytes)
 
-def pdf2image(pdf_path: str):
+def cached_transcription(image_bytes: bytes, use_cache: bool):
+    """Returns (cache_key, stored text or None) for a page image."""
+    cache_key = transcription_key(image_bytes)
+    if use_cache and ocr_cache.enabled:
+        return cache_key, ocr_cache.get(cache_key)
+    ocr_cache.record_bypass()
+    return cache_key, None
+
+def store_transcription(cache_key: str, text: str, use_cache: bool):
+    if use_cache and ocr_cache.enabled and text is not None:
+        ocr_cache.set(cache_key, text)
+
+async def cached_transcription_async(image_bytes: bytes, use_cache: bool):
+    """`cached_transcription` reading the disk tier off the event loop."""
+    cache_key = transcription_key(image_bytes)
+    if use_cache and ocr_cache.enabled:
+        return cache_key, await ocr_cache.aget(cache_key)
+    ocr_cache.record_bypass()
+    return cache_key, None
+
+async def store_transcription_async(cache_key: str, text: str, use_cache: bool):
+    if use_cache and ocr_cache.enabled and text is not None:
+        await ocr_cache.aset(cache_key, text)
+
+def read_text_in_image(image_path: str, use_cache: bool = True):
+    with open(image_path, "rb") as image_file:
+        image_bytes = image_file.read()
+    mime_type = image_mime_type(image_path)
+
+    cache_key, cached = cached_transcription(image_bytes, use_cache)
+    if cached is not None:
+        return cached
+
+    client = get_openai_client()
+    messages = ocr_messages(image_bytes, mime_type)
+
+    def send():
+        with model_call(OCR_MODEL, "ocr"):
+            return client.chat.completions.create(
+                model=OCR_MODEL,
+                messages=messages,
+                timeout=llm_gateway.OCR_TIMEOUT,
+            )
+
+    completion = llm_limiter.call_sync(send, estimate_tokens(messages, OCR_COMPLETION_TOKENS))
+    record_usage(OCR_MODEL, usage_record(getattr(completion, "usage", None)))
+    text = completion.choices[0].message.content
+    store_transcription(cache_key, text, use_cache)
+    return text
+
+async def read_text_in_image_async(image_bytes: bytes, mime_type: str = "image/png", use_cache: bool = True):
+    """Async counterpart of `read_text_in_image` taking already encoded image bytes, so no temp file is needed."""
+    cache_key, cached = await cached_transcription_async(image_bytes, use_cache)
+    if cached is not None:
+        return cached
+
+    client = llm_gateway.get_async_client()
+    messages = ocr_messages(image_bytes, mime_type)
+
+    async def send():
+        with model_call(OCR_MODEL, "ocr"):
+            return await client.chat.completions.create(
+                model=OCR_MODEL,
+                messages=messages,
+                timeout=llm_gateway.OCR_TIMEOUT,
+            )
+
+    completion = await llm_limiter.call(send, estimate_tokens(messages, OCR_COMPLETION_TOKENS))
+    record_usage(OCR_MODEL, usage_record(getattr(completion, "usage", None)))
+    text = completion.choices[0].message.content
+    await store_transcription_async(cache_key, text, use_cache)
+    return text
+
+async def read_text_in_images_async(pages: list, use_cache: bool = True):
+    """Transcribes several (image bytes, mime type) pages with one vision request and returns one text per page.
+
+    Cached pages are not sent again, and each page's transcription is cached on its own,
+    so a page costs the same cache entry whichever way it was read. If the reply cannot be
+    split back into pages, the pages are read one request each instead.
+    """
+    texts, keys = [], []
+    for image_bytes, _ in pages:
+        cache_key, cached = await cached_transcription_async(image_bytes, use_cache)
+        keys.append(cache_key)
+        texts.append(cached)
+    missing = [index for index, text in enumerate(texts) if text is None]
+    if len(missing) == 1:
+        texts[missing[0]] = await read_text_in_image_async(*pages[missing[0]], use_cache=use_cache)
+    elif missing:
+        client = llm_gateway.get_async_client()
+        messages = multi_page_ocr_messages([pages[index] for index in missing])
+
+        async def send():
+            with model_call(OCR_MODEL, "ocr"):
+                return await client.chat.completions.create(
+                    model=OCR_MODEL,
+                    messages=messages,
+                    timeout=llm_gateway.OCR_TIMEOUT,
+                )
+
+        completion = await llm_limiter.call(send, estimate_tokens(messages, OCR_COMPLETION_TOKENS * len(missing)))
+        record_usage(OCR_MODEL, usage_record(getattr(completion, "usage", None)))
+        split = split_pages(completion.choices[0].message.content, len(missing))
+        if split is None:
+            split = await asyncio.gather(*(read_text_in_image_async(*pages[index], use_cache=use_cache) for index in missing))
+        else:
+            for index, text in zip(missing, split):
+                await store_transcription_async(keys[index], text, use_cache)
+        for index, text in zip(missing, split):
+            texts[index] = text
+    return texts
+
+def is_pdf(data: bytes) -> bool:
+    return data[:5] == b"%PDF-"
+
+def spool_pdf(pdf_bytes: bytes) -> str:
+    """Writes an uploaded PDF to a temporary file for poppler to read page by page; the caller removes it."""
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as spooled:
+        spooled.write(pdf_bytes)
+    return spooled.name
+
+def pdf_page_count(pdf_path: str) -> int:
+    from pdf2image import pdfinfo_from_path
+    return int(pdfinfo_from_path(pdf_path, timeout=PDF_RENDER_TIMEOUT)["Pages"])
+
+def render_pdf_page(pdf_path: str, page_number: int, dpi: int = None) -> bytes:
+    """Renders one page (numbered from 1) of a PDF to grayscale PNG bytes, so only that page is ever in memory."""
     from pdf2image import convert_from_path
-    images = convert_from_path(pdf_path)
+    image = convert_from_path(pdf_path, dpi=dpi or PDF_DPI, first_page=page_number, last_page=page_number,
+                              grayscale=True, timeout=PDF_RENDER_TIMEOUT)[0]
+    buffer = io.BytesIO()
+    # Fast compression: preprocessing decodes the page again right away
+    image.save(buffer, format="PNG", compress_level=1)
+    image.close()
+    return buffer.getvalue()
+
+def pdf2image(pdf_path: str, dpi: int = None):
     images_path = pdf_path[:-len(".pdf")].replace(" ", "_")
-    os.mkdir(images_path)
+    os.makedirs(images_path, exist_ok=True)
 
-    # Save each page as an image
-    for i, image in enumerate(images):
-        image.save(f"{images_path}/page_{i + 1}.png", "PNG")
+    # Save each page as an image, rendering one page at a time
+    for page_number in range(1, pdf_page_count(pdf_path) + 1):
+        with open(f"{images_path}/page_{page_number}.png", "wb") as page_file:
+            page_file.write(render_pdf_page(pdf_path, page_number, dpi))
 
     return images_path
-
-if __name__ == "__main__":
-    # print(read_text_in_image("data/a1.png"))
-    # pdf2image("data/Anchor - 2b.pdf")
-    # print(read_text_in_image("data/Anchor_-_2b/page_1.png"))
-    example_text = {
-        "filepath": "data/Anchor_-_2b/page_1.png", "text": """Puerto Rico
-
-I visited puerto rico in 2015
-Summer there are some of the n thing puerto Rico 
-It was very hipical Also it had lots of 
-trees. Next had very warn, water the water 
-color was lightish blue and it was at the 
-ocean. Therefor, Puerto Rico had very good 
-food my faverit food for now was 
-the bear sauce and chicken at Puerto rico 
-in a resterunt it smelled very good.
-The people there were hat diffrent 
-Finally, the worst part was that I steped 
-on a dead sea urchin also the wether was 
-very hot. 
-
-At the hotel we stayed at a 
-place there was a pool and I
-really liked to go into the pool 
-in the night and day. We also got some 
-thing that you dive for."""
-    }
@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import sqlite3
+import asyncio
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from metrics import record_error
+
+
+load_dotenv()
+
+# SQLite file backing the job queue, kept next to database.db
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.db")
+# Uploaded files wait here until their job has run
+JOB_UPLOAD_DIR = os.getenv("JOB_UPLOAD_DIR", "job_uploads")
+# Number of jobs processed at once
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# A running job belongs to the process holding its lease, renewed while the job runs. A job whose lease
+# ran out (its process died) goes back to the queue; one another live process is running is left alone
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+# Idle workers also look for work this often: jobs submitted to other processes, and expired leases
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+
+class JobStore:
+    """Persists jobs in a SQLite table so queued work survives a restart."""
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        # Identifies this store's process in the jobs it claims
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, stage TEXT NOT NULL, "
+            "params TEXT NOT NULL, result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+            "owner TEXT, lease_expires REAL)"
+        )
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")}
+        # Tables created before leases existed lack the ownership columns
+        if "owner" not in columns:
+            self._connection.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        if "lease_expires" not in columns:
+            self._connection.execute("ALTER TABLE jobs ADD COLUMN lease_expires REAL")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status_created_at ON jobs (status, created_at)")
+        self._connection.commit()
+
+    def _row_to_job(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def create(self, kind: str, params: dict, job_id: str = None) -> str:
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO jobs (id, kind, status, stage, params, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, QUEUED, json.dumps(params), now, now),
+            )
+            self._connection.commit()
+        return job_id
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def update(self, job_id: str, **fields):
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._connection.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._connection.commit()
+
+    def claim_next(self):
+        """Marks the oldest queued job as running under this store's lease and returns it, or None when the queue is empty.
+
+        The claim is a conditional UPDATE, so when several processes share the queue only one of them gets each job.
+        """
+        with self._lock:
+            while True:
+                row = self._connection.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)).fetchone()
+                if row is None:
+                    return None
+                now = time.time()
+                cursor = self._connection.execute(
+                    "UPDATE jobs SET status = ?, stage = ?, owner = ?, lease_expires = ?, updated_at = ? WHERE id = ? AND status = ?",
+                    (RUNNING, "started", self.owner, now + JOB_LEASE_SECONDS, now, row["id"], QUEUED))
+                self._connection.commit()
+                if cursor.rowcount == 1:
+                    break
+                # Another process claimed it between the SELECT and the UPDATE
+        job = self._row_to_job(row)
+        job["status"], job["stage"], job["owner"] = RUNNING, "started", self.owner
+        return job
+
+    def renew(self, job_id: str) -> bool:
+        """Extends this store's lease on a running job; False if the job is no longer ours."""
+        with self._lock:
+            cursor = self._connection.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND owner = ? AND status = ?",
+                (time.time() + JOB_LEASE_SECONDS, job_id, self.owner, RUNNING))
+            self._connection.commit()
+        return cursor.rowcount == 1
+
+    def requeue_interrupted(self) -> int:
+        """Puts running jobs whose lease ran out, because their process stopped, back in the queue.
+
+        Jobs another live process is running keep renewing their lease and are left alone.
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                "UPDATE jobs SET status = ?, stage = ?, owner = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE status = ? AND (lease_expires IS NULL OR lease_expires < ?)",
+                (QUEUED, QUEUED, time.time(), RUNNING, time.time()))
+            self._connection.commit()
+        return cursor.rowcount
+
+    def count(self, status: str) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+
+class JobQueue:
+    """Runs persisted jobs on a bounded pool of asyncio workers.
+
+    `handlers` maps a job kind to `async def handler(params, set_stage) -> result`,
+    where `set_stage(name)` records progress and `result` is JSON-serializable.
+
+    Job store commits and upload cleanup run on one background thread, in the order they
+    were issued, so a busy jobs.db never stalls the event loop.
+    """
+
+    def __init__(self, store: JobStore, handlers: dict, workers: int = JOB_WORKERS):
+        self.store = store
+        self.handlers = handlers
+        self.workers = max(1, workers)
+        self._wakeup = None
+        self._tasks = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs")
+
+    def _in_background(self, function, *args, **kwargs) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(self._executor, partial(function, *args, **kwargs))
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        await self._in_background(self.store.requeue_interrupted)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._wakeup.set()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind: str, params: dict, job_id: str = None) -> str:
+        job_id = await self._in_background(self.store.create, kind, params, job_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def _work(self):
+        while True:
+            job = await self._in_background(self.store.claim_next)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    await self._in_background(self.store.requeue_interrupted)
+                continue
+            # Let the other workers pick up anything else that is queued
+            self._wakeup.set()
+            await self.run(job)
+
+    async def run(self, job: dict):
+        job_id = job["id"]
+
+        def set_stage(stage: str) -> asyncio.Future:
+            # Handlers need not wait for the write; later updates of the job are queued behind it
+            return self._in_background(self.store.update, job_id, stage=stage)
+
+        heartbeat = asyncio.create_task(self._renew_lease(job_id))
+        try:
+            handler = self.handlers[job["kind"]]
+            result = await handler(job["params"], set_stage)
+            await self._in_background(self.store.update, job_id, status=SUCCEEDED, stage="done", result=result)
+        except asyncio.CancelledError:
+            # Leave the job running; once its lease runs out requeue_interrupted puts it back in the queue
+            raise
+        except Exception as e:
+            record_error("job", e)
+            detail = getattr(e, "detail", None) or str(e)
+            await self._in_background(self.store.update, job_id, status=FAILED, stage="failed", error=detail)
+        finally:
+            heartbeat.cancel()
+        # A failed job is not retried, so its uploads are not needed either
+        await self._in_background(remove_job_uploads, job_id)
+
+    async def _renew_lease(self, job_id: str):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            await self._in_background(self.store.renew, job_id)
+
+
+def job_upload_dir(job_id: str) -> str:
+    return os.path.join(JOB_UPLOAD_DIR, job_id)
+
+
+def save_job_uploads(job_id: str, files) -> list:
+    """Writes (filename, bytes) pairs under the job's upload directory and returns their paths in order."""
+    directory = job_upload_dir(job_id)
+    os.makedirs(directory, exist_ok=True)
+    saved = []
+    for index, (filename, data) in enumerate(files):
+        path = os.path.join(directory, f"{index:04d}_{os.path.basename(filename or 'page')}")
+        with open(path, "wb") as upload:
+            upload.write(data)
+        saved.append({"filename": filename, "path": path})
+    return saved
+
+
+def load_job_uploads(saved: list) -> list:
+    pages = []
+    for upload in saved:
+        with open(upload["path"], "rb") as page:
+            pages.append((upload["filename"], page.read()))
+    return pages
+
+
+def remove_job_uploads(job_id: str):
+    shutil.rmtree(job_upload_dir(job_id), ignore_errors=True)
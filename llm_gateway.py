@@ -0,0 +1,123 @@
+import os
+import threading
+import weakref
+import asyncio
+import httpx
+from openai import OpenAI, AsyncOpenAI
+from dotenv import load_dotenv
+from rate_limit import llm_limiter
+
+
+load_dotenv()
+
+# Point this at any OpenAI-compatible server, e.g. the stand-in in testing/fake_openai.py
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+# Connections kept open per client; every OCR and grading request shares this pool
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+# Per-call timeouts (seconds) for the two kinds of model requests
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", LLM_TIMEOUT))
+GRADING_TIMEOUT = float(os.getenv("GRADING_TIMEOUT", LLM_TIMEOUT))
+
+_settings = {
+    "api_key": None,
+    "base_url": OPENAI_BASE_URL,
+    "pool_size": LLM_POOL_SIZE,
+}
+_lock = threading.Lock()
+_sync_client = None
+# httpx async connections belong to the event loop that opened them, so keep one client per loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def configure(api_key: str = None, base_url: str = None, pool_size: int = None):
+    """Changes the gateway settings and drops the existing clients so the next call picks them up."""
+    global _sync_client
+    with _lock:
+        if api_key is not None:
+            _settings["api_key"] = api_key
+        if base_url is not None:
+            _settings["base_url"] = base_url
+        if pool_size is not None:
+            _settings["pool_size"] = pool_size
+        if _sync_client is not None:
+            _sync_client.close()
+        _sync_client = None
+        _async_clients.clear()
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=_settings["pool_size"],
+        max_keepalive_connections=_settings["pool_size"],
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout():
+    return httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def _observe(response: httpx.Response):
+    llm_limiter.observe(response.headers)
+
+
+async def _observe_async(response: httpx.Response):
+    llm_limiter.observe(response.headers)
+
+
+def _api_key():
+    return _settings["api_key"] or os.getenv('OPENAI_API_KEY') or "missing-api-key"
+
+
+def get_client() -> OpenAI:
+    """Returns the process-wide sync client, creating it on first use."""
+    global _sync_client
+    with _lock:
+        if _sync_client is None:
+            _sync_client = OpenAI(
+                api_key=_api_key(),
+                base_url=_settings["base_url"],
+                timeout=_timeout(),
+                # rate_limit.RateLimiter retries failed requests itself, with backoff shared by every caller
+                max_retries=0,
+                http_client=httpx.Client(limits=_limits(), timeout=_timeout(), event_hooks={"response": [_observe]}),
+            )
+        return _sync_client
+
+
+def get_async_client() -> AsyncOpenAI:
+    """Returns the async client for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=_api_key(),
+                base_url=_settings["base_url"],
+                timeout=_timeout(),
+                max_retries=0,
+                http_client=httpx.AsyncClient(limits=_limits(), timeout=_timeout(), event_hooks={"response": [_observe_async]}),
+            )
+            _async_clients[loop] = client
+        return client
+
+
+async def aclose():
+    """Closes the async client of the running event loop, e.g. on application shutdown."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.pop(loop, None)
+    if client is not None:
+        await client.close()
+
+
+def close():
+    """Closes the sync client."""
+    global _sync_client
+    with _lock:
+        if _sync_client is not None:
+            _sync_client.close()
+        _sync_client = None
@@ -1,149 +1,501 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from typing import List
-from PIL import Image, ImageOps, ImageEnhance
-import pytesseract
+from fastapi import FastAPI, Depends, File, Form, UploadFile, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from typing import List, Optional
 import io
-import cv2
-import numpy as np
-from integrations import read_text_in_image
-from grading import grade_essay
-import traceback
-import tempfile
-from datetime import datetime
-
-from sqlalchemy import create_engine, Column, Integer, String, Text, Float, ForeignKey
-from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+from integrations import read_text_in_image_async, read_text_in_images_async, ocr_cache, OCR_PAGES_PER_REQUEST
+from integrations import is_pdf, spool_pdf, pdf_page_count, render_pdf_page
+from grading import grade_essay_mode_async, usage_totals, GRADING_MODES, GRADING_MODE, grade_cache, categories
+from conventions import analyze as analyze_conventions
+from preprocessing import page_task, preprocess_pool, reset_pool, shutdown_pool
+from tiered_ocr import local_transcription, accept_local, LOCAL_TIER, VISION_TIER
+import llm_gateway
+from rate_limit import llm_limiter
+from jobs import JobQueue, JobStore, save_job_uploads, load_job_uploads, QUEUED, RUNNING
+import metrics
+import asyncio
+import os
+import uuid
+import json
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import aclosing
+
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import or_
+from sqlalchemy.orm import undefer
+from database import Author, Essay, EssayGrade, AuthorGradeStats, SessionLocal, get_session, write_session, migrate_schema
+from persistence import save_essay, EssayWriter, WRITE_BATCHING, backfill_grade_stats
 
 app = FastAPI()
-Base = declarative_base()
-
-class Author(Base):
-    __tablename__ = 'authors'
-    id = Column(Integer, primary_key=True)
-    authorname = Column(String, unique=True)
-    name = Column(String)
-    essays = relationship("Essay", back_populates="author")
-
-class Essay(Base):
-    __tablename__ = 'essays'
-    id = Column(Integer, primary_key=True)
-    author_id = Column(Integer, ForeignKey('authors.id'))
-    title = Column(String)
-    text = Column(Text)
-    date_submitted = Column(String, default=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))  # Store as string
-    images = relationship("EssayImage", back_populates="essay")  # Multiple images
-    grades = relationship("EssayGrade", back_populates="essay")  # Multiple grades
-    author = relationship("Author", back_populates="essays")
-
 
-class EssayImage(Base):
-    __tablename__ = 'essay_images'
-    id = Column(Integer, primary_key=True)
-    essay_id = Column(Integer, ForeignKey('essays.id'))
-    image_path = Column(String)  # Store image file path
-    essay = relationship("Essay", back_populates="images")
+# Worker threads for local Tesseract OCR, and for preprocessing when PREPROCESS_PROCESSES is 0
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(os.cpu_count() or 4)))
+# Rendered PDF pages waiting for or in preprocessing at once per essay; bounds memory for long scanned packets
+PDF_PAGES_IN_FLIGHT = int(os.getenv("PDF_PAGES_IN_FLIGHT", "2"))
+# Maximum page OCR requests in flight at once per essay
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", "4"))
+# Saves the essay ungraded; batch_grading.py grades pending essays later through a batch API
+OFFLINE_GRADING_MODE = "offline"
+SUBMIT_MODES = GRADING_MODES + (OFFLINE_GRADING_MODE,)
+# Essays of one batch processed at once; their model calls share the global rate limiter
+BATCH_ESSAY_CONCURRENCY = int(os.getenv("BATCH_ESSAY_CONCURRENCY", "10"))
+
+preprocess_executor = ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS, thread_name_prefix="preprocess")
+
+@app.on_event("startup")
+async def start_job_workers():
+    await job_queue.start()
+
+
+@app.on_event("shutdown")
+async def close_llm_clients():
+    await job_queue.stop()
+    await llm_gateway.aclose()
+    llm_gateway.close()
+    shutdown_pool()
+
+
+async def read_page_locally(filename: str, image_data: bytes):
+    """Preprocesses one uploaded page and lets Tesseract read it without blocking the event loop.
+
+    The page's text is left as None when Tesseract is not confident enough, so the page is escalated to the vision model.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+        # Preprocessing runs in the process pool, so pages of concurrent requests spread over every core
+        with metrics.page_seconds.time(step="preprocess"):
+            for attempt in range(2):
+                pool = preprocess_pool()
+                try:
+                    page_bytes, mime_type = await loop.run_in_executor(pool or preprocess_executor, page_task(), image_data)
+                    break
+                except BrokenProcessPool:
+                    # A dead worker (e.g. killed for memory) breaks the whole pool: replace it so later pages
+                    # keep working, and give this page one more try on the new pool
+                    reset_pool(pool)
+                    if attempt:
+                        raise
+
+        with metrics.page_seconds.time(step="tesseract"):
+            local = await loop.run_in_executor(preprocess_executor, local_transcription, page_bytes)
+        accepted = accept_local(local)
+        return {
+            "filename": filename,
+            "text": local["text"] if accepted else None,
+            "page_bytes": page_bytes,
+            "bytes_uploaded": len(image_data),
+            "bytes_sent": 0,
+            "mime_type": mime_type,
+            "ocr_tier": LOCAL_TIER if accepted else VISION_TIER,
+            # Tesseract's mean word confidence, also kept for escalated pages to help tune the thresholds
+            "ocr_confidence": round(local["mean_confidence"], 1) if local else None,
+        }
 
+    except Exception as e:
+        metrics.record_error("ocr", e)
+        raise HTTPException(status_code=400, detail=f"Error processing {filename}: {str(e)}")
+
+async def read_pages_with_vision(group: list, semaphore: asyncio.Semaphore, use_cache: bool = True):
+    """Fills in the text of escalated pages, OCR_PAGES_PER_REQUEST of them per vision request."""
+    try:
+        async with semaphore:
+            if len(group) == 1:
+                texts = [await read_text_in_image_async(group[0]["page_bytes"], group[0]["mime_type"], use_cache=use_cache)]
+            else:
+                texts = await read_text_in_images_async([(page["page_bytes"], page["mime_type"]) for page in group], use_cache=use_cache)
+    except Exception as e:
+        metrics.record_error("ocr", e)
+        raise HTTPException(status_code=400, detail=f"Error processing {', '.join(page['filename'] for page in group)}: {str(e)}")
+    for page, text in zip(group, texts):
+        page["text"] = text
+        page["bytes_sent"] = len(page["page_bytes"])
+
+async def upload_pages(pages: list):
+    """Yields (filename, image bytes, rendered) for each uploaded page, rendering PDF uploads one page at a time as they are consumed."""
+    loop = asyncio.get_running_loop()
+    for filename, data in pages:
+        if not is_pdf(data):
+            yield filename, data, False
+            continue
+        try:
+            pdf_path = await loop.run_in_executor(None, spool_pdf, data)
+        except Exception as e:
+            metrics.record_error("pdf", e)
+            raise HTTPException(status_code=400, detail=f"Error processing {filename}: {str(e)}")
+        try:
+            page_count = await loop.run_in_executor(None, pdf_page_count, pdf_path)
+            for page_number in range(1, page_count + 1):
+                with metrics.page_seconds.time(step="render"):
+                    page_data = await loop.run_in_executor(None, render_pdf_page, pdf_path, page_number)
+                yield f"{filename}#page={page_number}", page_data, True
+        except HTTPException:
+            raise
+        except Exception as e:
+            metrics.record_error("pdf", e)
+            raise HTTPException(status_code=400, detail=f"Error processing {filename}: {str(e)}")
+        finally:
+            os.remove(pdf_path)
 
-class EssayGrade(Base):
-    __tablename__ = 'essay_grades'
-    id = Column(Integer, primary_key=True)
-    essay_id = Column(Integer, ForeignKey('essays.id'))
-    grade_type = Column(String)  # Type of grade (e.g., content, grammar)
-    grade = Column(Float)  # Score
-    comments = Column(Text)  # Comments
-    essay = relationship("Essay", back_populates="grades")
+async def extract_texts(pages: list, use_cache: bool = True) -> list:
+    """OCRs an essay's (filename, bytes) uploads and returns one record per page in upload order.
 
+    A PDF upload counts as one page per PDF page. Its pages are rendered one by one and go to
+    preprocessing as soon as they exist, with at most PDF_PAGES_IN_FLIGHT of them in preprocessing at a time.
+    Tesseract reads every page first; only pages it is not confident about go to the vision model.
+    """
+    in_flight = asyncio.Semaphore(max(1, PDF_PAGES_IN_FLIGHT))
 
-def preprocess_image(image: Image.Image) -> Image.Image:
-    # Convert the image to grayscale
-    gray_image = ImageOps.grayscale(image)
+    async def read_locally(filename: str, data: bytes, rendered: bool):
+        try:
+            return await read_page_locally(filename, data)
+        finally:
+            if rendered:
+                in_flight.release()
+
+    reads = []
+    try:
+        async with aclosing(upload_pages(pages)) as uploads:
+            async for filename, data, rendered in uploads:
+                # Rendered PDF pages wait for a slot so a long document never sits in memory all at once
+                if rendered:
+                    await in_flight.acquire()
+                reads.append(asyncio.ensure_future(read_locally(filename, data, rendered)))
+        extracted_texts = await asyncio.gather(*reads)
+    finally:
+        for read in reads:
+            read.cancel()
+
+    escalated = [page for page in extracted_texts if page["text"] is None]
+    per_request = max(1, OCR_PAGES_PER_REQUEST)
+    semaphore = asyncio.Semaphore(max(1, OCR_CONCURRENCY))
+    await asyncio.gather(*(read_pages_with_vision(escalated[start:start + per_request], semaphore, use_cache)
+                           for start in range(0, len(escalated), per_request)))
+    for page in extracted_texts:
+        # The encoded page is no longer needed once it has been read
+        del page["page_bytes"]
+        metrics.pages.inc(tier=page["ocr_tier"])
+    return extracted_texts
+
+def check_grading_mode(mode: Optional[str]):
+    if mode is not None and mode not in SUBMIT_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown grading mode {mode}. Expected one of {', '.join(SUBMIT_MODES)}.")
+
+def check_parent_essay(authorname: str, parent_id: Optional[int]):
+    """Rejects a parent_id that is not one of the author's essays before any model calls are made."""
+    if parent_id is None:
+        return
+    with SessionLocal() as session:
+        parent = session.get(Essay, parent_id)
+        if parent is None or parent.author.authorname != authorname:
+            raise HTTPException(status_code=404, detail=f"Essay {parent_id} not found for author {authorname}.")
+
+async def save_essay_async(authorname: str, title: str, full_text: str, extracted_texts: list, grades: list, parent_id: Optional[int] = None) -> int:
+    # Database writes run on a worker thread so they don't hold up the event loop
+    return await asyncio.get_running_loop().run_in_executor(None, save_essay, authorname, title, full_text, extracted_texts, grades, parent_id)
+
+async def process_essay(authorname: str, title: str, pages: list, mode: Optional[str] = None, use_cache: bool = True, set_stage=None, save=None, on_event=None, parent_id: Optional[int] = None):
+    """Runs OCR, grading and persistence for one essay given as (filename, bytes) pages.
+
+    `parent_id` makes the essay a revision of an earlier one. Without it the essay starts a new
+    chain, unless REVISION_LINK_BY_TITLE=1 links a resubmitted title to the author's latest
+    essay of that title (see persistence.py).
+
+    `save` stores the essay and returns its ID; it defaults to one commit per essay
+    and can be an `EssayWriter.save` to share commits with other essays.
+    `on_event(event, data)` receives the OCR text and then each category grade as it completes.
+    """
+    set_stage = set_stage or (lambda stage: None)
+    save = save or save_essay_async
+    on_event = on_event or (lambda event, data: None)
+
+    timings = metrics.Timings(authorname=authorname, title=title, pages=len(pages), mode=mode or GRADING_MODE)
+    try:
+        # Pages are preprocessed and OCRed concurrently; gather keeps them in upload order
+        set_stage("ocr")
+        with timings.stage("ocr"):
+            extracted_texts = await extract_texts(pages, use_cache)
+
+        # Combine extracted texts into a single essay text
+        full_text = " ".join([text["text"] for text in extracted_texts])
+        on_event("text", {"text": full_text})
+        # Instant preliminary conventions feedback from the local analyzer, before any model call
+        on_event("conventions", analyze_conventions(full_text))
+
+        # Compute grades, unless they are left to the offline batch run
+        if (mode or GRADING_MODE) == OFFLINE_GRADING_MODE:
+            grades = []
+            message = "Essay saved. Grades will be added by the next offline batch run."
+        else:
+            set_stage("grading")
+            grading_started = time.perf_counter()
+
+            def on_grade(grade):
+                timings.category(grade["type"], time.perf_counter() - grading_started)
+                on_event("grade", grade)
+
+            with timings.stage("grading"):
+                grades = await grade_essay_mode_async(full_text, mode, use_cache=use_cache, on_grade=on_grade)
+            message = "Essay submitted successfully!"
+
+        set_stage("saving")
+        with timings.stage("saving"):
+            essay_id = await save(authorname, title, full_text, extracted_texts, grades, parent_id)
+    except Exception as e:
+        timings.log("failed", error=type(e).__name__)
+        raise
+    timings.log("succeeded", essay_id=essay_id, usage=usage_totals(grades))
 
-    # Enhance contrast
-    enhancer = ImageEnhance.Contrast(gray_image)
-    enhanced_image = enhancer.enhance(2.0)
+    return {
+        "message": message,
+        "essay_id": essay_id,
+        "text": full_text,
+        "grades": grades,
+        "usage": usage_totals(grades),
+        "pages": [
+            {key: page[key] for key in ("filename", "bytes_uploaded", "bytes_sent", "mime_type", "ocr_tier", "ocr_confidence")}
+            for page in extracted_texts
+        ]
+    }
 
-    # Convert to numpy array for OpenCV processing
-    open_cv_image = np.array(enhanced_image)
+@app.post("/submit-essay/")
+async def submit_essay(authorname: str, title: str, files: List[UploadFile] = File(...), mode: Optional[str] = None, use_cache: bool = True, parent_id: Optional[int] = None):
+    check_grading_mode(mode)
+    await asyncio.get_running_loop().run_in_executor(None, check_parent_essay, authorname, parent_id)
+    pages = [(file.filename, await file.read()) for file in files]
+    return await process_essay(authorname, title, pages, mode, use_cache, parent_id=parent_id)
 
-    # Apply Gaussian Blur to reduce noise
-    blurred_image = cv2.GaussianBlur(open_cv_image, (5, 5), 0)
 
-    # Binarize the image using Otsu's thresholding
-    _, binary_image = cv2.threshold(blurred_image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    # Convert back to PIL Image
-    preprocessed_image = Image.fromarray(binary_image)
+async def stream_essay(authorname: str, title: str, pages: list, mode: Optional[str] = None, use_cache: bool = True, parent_id: Optional[int] = None):
+    """Runs `process_essay` and yields its progress as Server-Sent Events.
 
-    return preprocessed_image
+    Emits `stage` events, a `text` event once OCR is done, the local `conventions` features,
+    one `grade` event per category as it completes, and finally `result` with the full response (or `error`).
+    """
+    events = asyncio.Queue()
+    done = object()
 
-@app.post("/submit-essay/")
-async def submit_essay(authorname: str, title: str, files: List[UploadFile] = File(...)):
-    extracted_texts = []
-
-    for file in files:
+    async def run():
         try:
-            image_data = await file.read()
-            image = Image.open(io.BytesIO(image_data))
-            preprocessed_image = preprocess_image(image)
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as temp_image:
-                preprocessed_image.save(temp_image, format="PNG")
-                temp_image_path = temp_image.name
-
-            text = read_text_in_image(temp_image_path)
-            extracted_texts.append({"filename": file.filename, "text": text})
-
+            result = await process_essay(authorname, title, pages, mode, use_cache,
+                                         set_stage=lambda stage: events.put_nowait(("stage", {"stage": stage})),
+                                         on_event=lambda event, data: events.put_nowait((event, data)), parent_id=parent_id)
+            events.put_nowait(("result", result))
+        except HTTPException as e:
+            events.put_nowait(("error", {"detail": e.detail}))
         except Exception as e:
-            traceback.print_exc()
-            raise HTTPException(status_code=400, detail=f"Error processing {file.filename}: {str(e)}")
-
-    # Combine extracted texts into a single essay text
-    full_text = " ".join([text["text"] for text in extracted_texts])
-
-    # Compute grades
-    grades = grade_essay(full_text)
-
-    # Get or create author
-    author = session.query(Author).filter_by(authorname=authorname).first()
-    if not author:
-        author = Author(authorname=authorname)
-        session.add(author)
-        session.commit()
+            metrics.record_error("stream", e)
+            events.put_nowait(("error", {"detail": str(e)}))
+        finally:
+            events.put_nowait(done)
+
+    task = asyncio.create_task(run())
+    try:
+        while (item := await events.get()) is not done:
+            yield sse_event(*item)
+    finally:
+        # The client went away; stop spending model calls on it
+        if not task.done():
+            task.cancel()
+
+@app.post("/submit-essay/stream")
+async def submit_essay_stream(authorname: str, title: str, files: List[UploadFile] = File(...), mode: Optional[str] = None, use_cache: bool = True, parent_id: Optional[int] = None):
+    """Like /submit-essay/, but streams the OCR text and each category grade as Server-Sent Events."""
+    check_grading_mode(mode)
+    await asyncio.get_running_loop().run_in_executor(None, check_parent_essay, authorname, parent_id)
+    pages = [(file.filename, await file.read()) for file in files]
+    return StreamingResponse(stream_essay(authorname, title, pages, mode, use_cache, parent_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# Job workers finishing close together share commits
+job_essay_writer = EssayWriter()
+
+async def run_essay_job(params: dict, set_stage):
+    pages = await asyncio.get_running_loop().run_in_executor(None, load_job_uploads, params["files"])
+    save = job_essay_writer.save if WRITE_BATCHING else None
+    return await process_essay(params["authorname"], params["title"], pages, params["mode"], params["use_cache"], set_stage, save,
+                               parent_id=params.get("parent_id"))
+
+job_queue = JobQueue(JobStore(), {"submit-essay": run_essay_job})
+
+metrics.Gauge("jobs", "Background jobs waiting or running.", ("status",),
+              function=lambda: {(status,): job_queue.store.count(status) for status in (QUEUED, RUNNING)})
+
+@app.post("/jobs/")
+async def submit_essay_job(authorname: str, title: str, files: List[UploadFile] = File(...), mode: Optional[str] = None, use_cache: bool = True, parent_id: Optional[int] = None):
+    """Queues an essay for OCR, grading and persistence and returns its job ID right away."""
+    check_grading_mode(mode)
+    await asyncio.get_running_loop().run_in_executor(None, check_parent_essay, authorname, parent_id)
+    job_id = uuid.uuid4().hex
+    uploads = [(file.filename, await file.read()) for file in files]
+    saved = await asyncio.get_running_loop().run_in_executor(None, save_job_uploads, job_id, uploads)
+    await job_queue.submit("submit-essay", {
+        "authorname": authorname,
+        "title": title,
+        "files": saved,
+        "mode": mode,
+        "use_cache": use_cache,
+        "parent_id": parent_id,
+    }, job_id=job_id)
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Reports the status, current stage and, once done, the result of a job."""
+    job = job_queue.store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    return {key: job[key] for key in ("id", "kind", "status", "stage", "result", "error", "created_at", "updated_at")}
+
+
+def read_batch(uploads: list, manifest: Optional[str] = None) -> list:
+    """Groups uploaded pages into essays following the manifest.
+
+    `uploads` are (filename, bytes) pairs; a .zip upload is unpacked and may carry the
+    manifest as manifest.json. The manifest is a JSON list of
+    {"authorname", "title", "files": [page filenames in order]}.
+    """
+    pages, by_basename = {}, {}
+
+    def add_page(name: str, data: bytes):
+        if name in pages:
+            raise HTTPException(status_code=400, detail=f"More than one uploaded file is named {name}.")
+        pages[name] = data
+        by_basename.setdefault(os.path.basename(name), []).append(name)
+
+    for filename, data in uploads:
+        if filename and filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for name in archive.namelist():
+                    if name.endswith("/"):
+                        continue
+                    if os.path.basename(name) == "manifest.json":
+                        manifest = manifest or archive.read(name).decode("utf-8")
+                        continue
+                    add_page(name, archive.read(name))
+        else:
+            add_page(filename, data)
+    # Pages can also be referenced by their bare filename, as long as only one file has it
+    ambiguous = set()
+    for basename, names in by_basename.items():
+        if basename in pages:
+            continue
+        if len(names) == 1:
+            pages[basename] = pages[names[0]]
+        else:
+            ambiguous.add(basename)
+
+    if not manifest:
+        raise HTTPException(status_code=400, detail="A manifest listing the author, title and files of each essay is required.")
+    try:
+        entries = json.loads(manifest)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Manifest is not valid JSON: {e}")
+    if not isinstance(entries, list) or not entries:
+        raise HTTPException(status_code=400, detail="Manifest must be a non-empty list of essays.")
+
+    essays = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get("authorname") or not entry.get("title") or not entry.get("files"):
+            raise HTTPException(status_code=400, detail=f"Manifest entry {index} needs authorname, title and files.")
+        unclear = [name for name in entry["files"] if name in ambiguous]
+        if unclear:
+            raise HTTPException(status_code=400, detail=f"Manifest entry {index} lists files that match more than one uploaded file; "
+                                                        f"use their full paths: {', '.join(unclear)}")
+        missing = [name for name in entry["files"] if name not in pages]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Manifest entry {index} lists files that were not uploaded: {', '.join(missing)}")
+        essays.append({
+            "authorname": entry["authorname"],
+            "title": entry["title"],
+            "pages": [(name, pages[name]) for name in entry["files"]],
+        })
+    return essays
+
+async def grade_batch(essays: list, mode: Optional[str] = None, use_cache: bool = True):
+    """Processes every essay of a batch concurrently, yielding each outcome as it finishes and then a summary."""
+    started = time.perf_counter()
+    limiter_before = dict(llm_limiter.stats)
+    semaphore = asyncio.Semaphore(max(1, BATCH_ESSAY_CONCURRENCY))
+    writer = EssayWriter() if WRITE_BATCHING else None
+    save = writer.save if writer else None
+
+    async def run(index: int, essay: dict):
+        outcome = {"type": "essay", "index": index, "authorname": essay["authorname"], "title": essay["title"]}
+        async with semaphore:
+            try:
+                result = await process_essay(essay["authorname"], essay["title"], essay["pages"], mode, use_cache, save=save)
+                return {**outcome, "status": "succeeded", "result": result}
+            except Exception as e:
+                # Page errors arrive as HTTPExceptions and were counted where they happened
+                if not isinstance(e, HTTPException):
+                    metrics.record_error("batch", e)
+                return {**outcome, "status": "failed", "error": getattr(e, "detail", None) or str(e)}
+
+    succeeded = 0
+    for finished in asyncio.as_completed([run(index, essay) for index, essay in enumerate(essays)]):
+        outcome = await finished
+        succeeded += outcome["status"] == "succeeded"
+        yield outcome
+
+    yield {
+        "type": "summary",
+        "essays": len(essays),
+        "succeeded": succeeded,
+        "failed": len(essays) - succeeded,
+        "elapsed_seconds": round(time.perf_counter() - started, 3),
+        "model_requests": llm_limiter.stats["requests"] - limiter_before["requests"],
+        "estimated_tokens": llm_limiter.stats["tokens"] - limiter_before["tokens"],
+        "throttled_seconds": round(llm_limiter.stats["throttled_seconds"] - limiter_before["throttled_seconds"], 3),
+        "model_retries": llm_limiter.stats["retries"] - limiter_before["retries"],
+        "database_commits": writer.commits if writer else succeeded,
+    }
 
-    # Create and store the essay
-    essay = Essay(author=author, title=title, text=full_text, date_submitted=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))    
-    session.add(essay)
-    session.commit()  # Commit now to get `essay.id`
+@app.post("/submit-batch/")
+async def submit_batch(files: List[UploadFile] = File(...), manifest: Optional[str] = Form(None), mode: Optional[str] = None, use_cache: bool = True):
+    """Grades a class set of essays, streaming one JSON line per essay as it finishes and a final summary line."""
+    check_grading_mode(mode)
+    essays = read_batch([(file.filename, await file.read()) for file in files], manifest)
 
-    # Store multiple images linked to the essay
-    for extracted_text in extracted_texts:
-        essay_image = EssayImage(essay=essay, image_path=extracted_text["filename"])
-        session.add(essay_image)
+    async def lines():
+        async for outcome in grade_batch(essays, mode, use_cache):
+            yield json.dumps(outcome) + "\n"
 
-    session.commit()  # Batch commit images
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
-    # Store grades
-    for grade in grades:
-        essay_grade = EssayGrade(essay=essay, grade_type=grade["type"], grade=grade["grade"], comments=grade["comments"])
-        session.add(essay_grade)
 
-    session.commit()  # Batch commit grades
-
-    return {
-        "message": "Essay submitted successfully!",
-        "essay_id": essay.id,
-        "text": full_text,
-        "grades": grades
-    }
+# Page sizes for the read endpoints
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
 
+def page_size(limit: int) -> int:
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+    return limit
 
 @app.get("/get-authors/")
-def get_authors():
-    """Fetch all authors and their essays."""
-    authors = session.query(Author).all()
-    
+def get_authors(cursor: Optional[int] = None, limit: int = DEFAULT_PAGE_SIZE, session: Session = Depends(get_session)):
+    """Fetch a page of authors and their essays.
+
+    Pass the returned `next_cursor` as `cursor` to get the following page; it is None on the last page.
+    """
+    limit = page_size(limit)
+    query = session.query(Author).order_by(Author.id).options(
+        # One extra query for every essay of the page, without the essay texts
+        selectinload(Author.essays).load_only(Essay.id, Essay.author_id, Essay.title, Essay.date_submitted)
+    )
+    if cursor is not None:
+        query = query.filter(Author.id > cursor)
+    authors = query.limit(limit + 1).all()
+    next_cursor = authors[limit - 1].id if len(authors) > limit else None
+
     authors_data = []
-    for author in authors:
+    for author in authors[:limit]:
         author_info = {
             "authorname": author.authorname,
             "name": author.name,
@@ -151,35 +503,148 @@ def get_authors():
         }
         authors_data.append(author_info)
 
-    return {"authors": authors_data}
+    return {"authors": authors_data, "next_cursor": next_cursor}
+
+
+def grade_data(grade: EssayGrade) -> dict:
+    data = {"type": grade.grade_type, "grade": grade.grade, "comments": grade.comments}
+    if grade.prompt_tokens is not None:
+        data["usage"] = {"prompt_tokens": grade.prompt_tokens, "completion_tokens": grade.completion_tokens, "cached_tokens": grade.cached_tokens}
+    return data
 
+def grades_data(essay: Essay) -> list:
+    return [grade_data(grade) for grade in essay.grades]
 
 @app.post("/get-author-grades/")
-async def get_author_grades(authorname: str):
+def get_author_grades(authorname: str, cursor: Optional[int] = None, limit: int = DEFAULT_PAGE_SIZE, include_text: bool = True,
+                      session: Session = Depends(get_session)):
+    """Fetch a page of an author's essays with their grades and images, oldest first.
+
+    Pass the returned `next_cursor` as `cursor` to get the following page; it is None on the last page.
+    `include_text=false` leaves out the essay texts, so none of them is loaded or decompressed.
+    """
+    limit = page_size(limit)
     author = session.query(Author).filter_by(authorname=authorname).first()
     if not author:
         raise HTTPException(status_code=404, detail=f"Author {authorname} not found.")
 
-    return [
-        {
-            "text": essay.text,
-            "title": essay.title,
-            "date_submitted": essay.date_submitted,
-            "grades": [{"type": grade.grade_type, "grade": grade.grade, "comments": grade.comments} for grade in essay.grades],
-            "images": [img.image_path for img in essay.images]  # Return multiple image paths
-        }
-        for essay in author.essays
-    ]
+    query = session.query(Essay).filter(Essay.author_id == author.id).order_by(Essay.id).options(
+        selectinload(Essay.grades), selectinload(Essay.images)
+    )
+    if include_text:
+        query = query.options(undefer(Essay.plain_text), undefer(Essay.text_data))
+    if cursor is not None:
+        query = query.filter(Essay.id > cursor)
+    essays = query.limit(limit + 1).all()
+    next_cursor = essays[limit - 1].id if len(essays) > limit else None
 
-@app.post("/create-author/")
-async def create_author(authorname: str, name: str):
-    author = Author(authorname=authorname, name=name)
-    session.add(author)
-    session.commit()
-    return author
+    return {
+        "essays": [
+            {
+                "id": essay.id,
+                **({"text": essay.text} if include_text else {}),
+                "title": essay.title,
+                "parent_id": essay.parent_id,
+                "revision": essay.revision or 1,
+                "date_submitted": essay.date_submitted,
+                "grades": grades_data(essay),
+                "images": [img.image_path for img in essay.images],  # Return multiple image paths
+                "ocr_tiers": [img.ocr_tier for img in essay.images],
+            }
+            for essay in essays[:limit]
+        ],
+        "next_cursor": next_cursor,
+    }
+
+def grade_stats_data(stats: AuthorGradeStats) -> dict:
+    return {"type": stats.grade_type, "count": stats.count, "mean": round(stats.mean, 2),
+            "latest": stats.latest_grade, "trend": round(stats.trend, 3)}
+
+@app.get("/authors/{authorname}/summary")
+def get_author_summary(authorname: str, session: Session = Depends(get_session)):
+    """Per-category grade count, mean, latest grade and trend (change per essay) of an author, in rubric order.
+
+    Read from the aggregates kept up to date with every grade, so the cost does not grow with the number of essays.
+    """
+    author = session.query(Author).filter_by(authorname=authorname).first()
+    if not author:
+        raise HTTPException(status_code=404, detail=f"Author {authorname} not found.")
+    order = {category: index for index, category in enumerate(categories)}
+    stats = sorted(author.grade_stats, key=lambda row: (order.get(row.grade_type, len(order)), row.grade_type))
+    return {
+        "authorname": author.authorname,
+        "graded_essays": max((row.count for row in stats), default=0),
+        "categories": [grade_stats_data(row) for row in stats if row.count],
+    }
+
+@app.get("/essays/{essay_id}")
+def get_essay(essay_id: int, session: Session = Depends(get_session)):
+    """Fetch one essay with its text, grades and images."""
+    essay = session.get(Essay, essay_id, options=[selectinload(Essay.grades), selectinload(Essay.images), selectinload(Essay.author)])
+    if not essay:
+        raise HTTPException(status_code=404, detail=f"Essay {essay_id} not found.")
+    grades = grades_data(essay)
+    return {
+        "id": essay.id,
+        "authorname": essay.author.authorname,
+        "title": essay.title,
+        "text": essay.text,
+        "parent_id": essay.parent_id,
+        "revision": essay.revision or 1,
+        "date_submitted": essay.date_submitted,
+        "grades": grades,
+        # Tokens spent grading the essay; cached_tokens is the share of the prompt served from the provider's prompt cache
+        "usage": usage_totals(grades),
+        "images": [img.image_path for img in essay.images],
+        "ocr_tiers": [img.ocr_tier for img in essay.images],
+    }
+
+@app.get("/essays/{essay_id}/history")
+def get_essay_history(essay_id: int, session: Session = Depends(get_session)):
+    """Grades of every revision in the essay's chain, first version first. Essay texts are not loaded."""
+    essay = session.get(Essay, essay_id)
+    if not essay:
+        raise HTTPException(status_code=404, detail=f"Essay {essay_id} not found.")
+    root_id = essay.root_id or essay.id
+    revisions = session.query(Essay).filter(or_(Essay.id == root_id, Essay.root_id == root_id)).order_by(Essay.revision, Essay.id).options(
+        selectinload(Essay.grades)
+    ).all()
+    return {
+        "root_id": root_id,
+        "revisions": [
+            {
+                "id": revision.id,
+                "parent_id": revision.parent_id,
+                "revision": revision.revision or 1,
+                "title": revision.title,
+                "date_submitted": revision.date_submitted,
+                "grades": grades_data(revision),
+            }
+            for revision in revisions
+        ],
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Stage, category and model latency histograms, token, cost and error counters, and queue depths in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-engine = create_engine('sqlite:///database.db')
-Base.metadata.create_all(engine)
+@app.get("/cache-stats/")
+def get_cache_stats():
+    """Hit/miss counters of the grading and OCR caches since the server started."""
+    ocr_stats = ocr_cache.get_stats()
+    return {
+        "grading": grade_cache.get_stats(),
+        "ocr": {**ocr_stats, "vision_calls_avoided": ocr_stats["hits"]},
+    }
+
+@app.post("/create-author/")
+def create_author(authorname: str, name: str):
+    with write_session() as session:
+        author = Author(authorname=authorname, name=name)
+        session.add(author)
+        session.flush()
+        return {"id": author.id, "authorname": author.authorname, "name": author.name}
 
-Session = sessionmaker(bind=engine)
-session = Session()
+migrate_schema()
+backfill_grade_stats()
@@ -0,0 +1,280 @@
+"""In-process metrics in the Prometheus text format, plus one structured timing log line per essay.
+
+Counters, histograms and gauges live in `registry` and are rendered by `render()` for the
+`/metrics` endpoint. Recording a value is a dictionary lookup and a few additions under a
+lock, so the instrumentation stays on in production; METRICS_ENABLED=0 turns it into no-ops.
+"""
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Log one JSON line with the stage and category timings of every essay
+METRICS_LOG_TIMINGS = os.getenv("METRICS_LOG_TIMINGS", "1") == "1"
+
+# Bucket upper bounds in seconds, from a cache hit to a slow vision call
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+# Dollars per million tokens: (prompt, cached prompt, completion)
+MODEL_PRICES = {"gpt-4o": (2.50, 1.25, 10.00)}
+
+timing_logger = logging.getLogger("essay_grader.timings")
+if not timing_logger.handlers:
+    # Uvicorn only configures its own loggers; without a handler of its own these lines would be dropped
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    timing_logger.addHandler(handler)
+    timing_logger.setLevel(logging.INFO)
+    timing_logger.propagate = False
+error_logger = logging.getLogger("essay_grader.errors")
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self):
+        """(name, rendered labels, value) for every series of the metric."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{labels} {format_value(value)}" for name, labels, value in self.samples()]
+        return "\n".join(lines)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, format_labels(self.labelnames, key), float(value)) for key, value in items]
+
+
+class Gauge(Metric):
+    """A value set by the code, or read from `function` (returning {label tuple: value}) when scraped."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), function=None):
+        super().__init__(name, help, labelnames)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                values = self.function()
+            except Exception:
+                values = {}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [(self.name, format_labels(self.labelnames, key), float(value)) for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then the sum of observations
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._values.get(self._key(labels))
+        return sum(series[:-1]) if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._values.items())
+        samples = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                samples.append((f"{self.name}_bucket", format_labels(self.labelnames, key, f'le="{le}"'), cumulative))
+            samples.append((f"{self.name}_sum", format_labels(self.labelnames, key), float(series[-1])))
+            samples.append((f"{self.name}_count", format_labels(self.labelnames, key), cumulative))
+        return samples
+
+
+registry = []
+
+stage_seconds = Histogram("essay_stage_seconds", "Time spent in each stage of processing one essay.", ("stage",))
+page_seconds = Histogram("page_stage_seconds", "Time spent on one page in each OCR step.", ("step",))
+category_seconds = Histogram("grading_category_seconds", "Time to grade one rubric category, from request to result.", ("category",))
+model_request_seconds = Histogram("llm_request_seconds", "Latency of model requests, excluding time queued in the rate limiter.", ("model", "kind"))
+model_tokens = Counter("llm_tokens_total", "Tokens reported by model responses.", ("model", "type"))
+model_cost = Counter("llm_cost_dollars_total", "Estimated spend on model requests at MODEL_PRICES.", ("model",))
+model_errors = Counter("llm_errors_total", "Model requests that raised, by exception type.", ("model", "kind", "error"))
+model_retries = Counter("llm_retries_total", "Model requests retried by the rate limiter, by the error that failed them.", ("error",))
+errors = Counter("essay_errors_total", "Errors while processing essays, by stage and exception type.", ("stage", "error"))
+pages = Counter("pages_total", "Pages read, by the OCR tier that produced their text.", ("tier",))
+essays = Counter("essays_total", "Essays processed, by outcome.", ("status",))
+db_write_seconds = Histogram("db_write_seconds", "Time to write and commit one transaction of essays.")
+
+
+def usage_record(usage):
+    """Token counts of one response, including prompt tokens the provider served from its prompt cache.
+
+    Accepts the SDK's usage object or the plain dict of a batch result; None when no usage was reported.
+    """
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        details = usage.get("prompt_tokens_details") or {}
+        cached = details.get("cached_tokens")
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens"), usage.get("completion_tokens")
+    else:
+        cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+        prompt_tokens, completion_tokens = getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+    if prompt_tokens is None:
+        return None
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens or 0, "cached_tokens": cached or 0}
+
+
+def record_usage(model: str, usage):
+    """Adds a response's usage (as returned by `usage_record`) to the token and cost counters."""
+    if not usage:
+        return
+    cached = usage.get("cached_tokens") or 0
+    prompt = usage.get("prompt_tokens") or 0
+    completion = usage.get("completion_tokens") or 0
+    model_tokens.inc(prompt, model=model, type="prompt")
+    model_tokens.inc(cached, model=model, type="cached")
+    model_tokens.inc(completion, model=model, type="completion")
+    prices = MODEL_PRICES.get(model)
+    if prices:
+        model_cost.inc(((prompt - cached) * prices[0] + cached * prices[1] + completion * prices[2]) / 1_000_000, model=model)
+
+
+@contextmanager
+def model_call(model: str, kind: str):
+    """Times one model request and counts it as an error, by exception type, if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        model_errors.inc(model=model, kind=kind, error=type(e).__name__)
+        raise
+    finally:
+        model_request_seconds.observe(time.perf_counter() - started, model=model, kind=kind)
+
+
+def record_error(stage: str, error: BaseException):
+    """Counts an error and logs it with its traceback."""
+    errors.inc(stage=stage, error=type(error).__name__)
+    error_logger.error("Error during %s", stage, exc_info=error)
+
+
+class Timings:
+    """Stage and category timings of one essay, observed into the histograms and logged as one JSON line."""
+
+    def __init__(self, **fields):
+        self.fields = fields
+        self.stages = {}
+        self.categories = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stages[name] = round(self.stages.get(name, 0) + elapsed, 4)
+            stage_seconds.observe(elapsed, stage=name)
+
+    def category(self, name: str, elapsed: float):
+        """Records when a category's grade arrived, in seconds after grading started (`grading` observes the histogram)."""
+        self.categories[name] = round(elapsed, 4)
+
+    def log(self, status: str, **fields):
+        essays.inc(status=status)
+        if METRICS_ENABLED and METRICS_LOG_TIMINGS:
+            timing_logger.info(json.dumps({
+                "event": "essay_timings",
+                "status": status,
+                **self.fields,
+                **fields,
+                "total_seconds": round(time.perf_counter() - self.started, 4),
+                "stages": self.stages,
+                "categories": self.categories,
+            }, default=str))
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in registry) + "\n"
@@ -0,0 +1,214 @@
+import os
+import asyncio
+from datetime import datetime
+from dotenv import load_dotenv
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from database import Author, Essay, EssayImage, EssayGrade, AuthorGradeStats, write_session
+from metrics import db_write_seconds
+
+
+load_dotenv()
+
+# Batch and job paths group essays finished close together into one commit
+WRITE_BATCHING = os.getenv("WRITE_BATCHING", "1") == "1"
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "20"))
+# Seconds an essay may wait for others to share its commit
+WRITE_BATCH_DELAY = float(os.getenv("WRITE_BATCH_DELAY", "0.2"))
+# Opt-in: without an explicit parent, a resubmitted title becomes a revision of the author's latest essay with that title.
+# Off by default because titles are not unique: the UI submits every untitled essay as "Untitled"
+REVISION_LINK_BY_TITLE = os.getenv("REVISION_LINK_BY_TITLE", "0") == "1"
+
+
+def get_or_create_author(session: Session, authorname: str) -> Author:
+    author = session.query(Author).filter_by(authorname=authorname).first()
+    if not author:
+        author = Author(authorname=authorname)
+        session.add(author)
+    return author
+
+
+def find_parent_essay(session: Session, author: Author, title: str, parent_id: int = None):
+    """The essay a new submission revises: `parent_id` if given, else (optionally) the latest one with the same title."""
+    if parent_id is not None:
+        parent = session.get(Essay, parent_id)
+        if parent is None or parent.author is not author:
+            raise ValueError(f"Essay {parent_id} not found for author {author.authorname}.")
+        return parent
+    if not REVISION_LINK_BY_TITLE or author.id is None:
+        return None
+    return session.query(Essay).filter(Essay.author_id == author.id, Essay.title == title).order_by(Essay.id.desc()).first()
+
+
+def grade_value(value):
+    """The numeric grade stored for a model's value, e.g. 4.0 for 4 or "4"; None when it is not a number, e.g. "N/A"."""
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def grade_row(grade: dict, **columns) -> EssayGrade:
+    """An `EssayGrade` for a grade record, with the token usage of its model response when it has one."""
+    usage = grade.get("usage") or {}
+    return EssayGrade(grade_type=grade["type"], grade=grade_value(grade["grade"]), comments=grade["comments"],
+                      prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"),
+                      cached_tokens=usage.get("cached_tokens"), **columns)
+
+
+def add_grade_stats(session: Session, author: Author, grades: list, date_submitted: str = None):
+    """Folds new `EssayGrade` rows into the author's per-category aggregates, in the caller's transaction.
+
+    Call it with the rows from `grade_row` wherever they are added, so the aggregates count the
+    stored values. Grades without a numeric value are left out.
+    """
+    with session.no_autoflush:
+        if author.id is not None and "grade_stats" in inspect(author).unloaded:
+            # Lock the rows so concurrent writers on server databases queue instead of losing updates
+            rows = session.query(AuthorGradeStats).filter(AuthorGradeStats.author_id == author.id).with_for_update().all()
+            set_committed_value(author, "grade_stats", rows)
+        stats = {row.grade_type: row for row in author.grade_stats}
+        for grade in grades:
+            if grade.grade is None:
+                continue
+            row = stats.get(grade.grade_type)
+            if row is None:
+                row = stats[grade.grade_type] = AuthorGradeStats(grade_type=grade.grade_type)
+                author.grade_stats.append(row)
+            row.add(grade.grade, date_submitted)
+
+
+def rebuild_grade_stats(session: Session) -> int:
+    """Recomputes every author's aggregates from the stored grades, in essay order, and returns how many rows it wrote."""
+    session.query(AuthorGradeStats).delete()
+    rows = session.query(Essay.author_id, Essay.date_submitted, EssayGrade.grade_type, EssayGrade.grade).join(
+        EssayGrade, EssayGrade.essay_id == Essay.id
+    ).order_by(Essay.id, EssayGrade.id)
+    stats = {}
+    for author_id, date_submitted, grade_type, grade in rows:
+        if not isinstance(grade, (int, float)):
+            continue
+        row = stats.get((author_id, grade_type))
+        if row is None:
+            row = stats[(author_id, grade_type)] = AuthorGradeStats(author_id=author_id, grade_type=grade_type)
+            session.add(row)
+        row.add(grade, date_submitted)
+    return len(stats)
+
+
+def backfill_grade_stats():
+    """Builds the aggregates once for a database whose grades predate them."""
+    with write_session() as session:
+        if session.query(AuthorGradeStats.id).first() is None and session.query(EssayGrade.id).first() is not None:
+            rebuild_grade_stats(session)
+
+
+def add_essay(session: Session, authorname: str, title: str, full_text: str, extracted_texts: list, grades: list, parent_id: int = None) -> Essay:
+    """Adds an essay with its images and grades to the session without committing.
+
+    A revision stores its text as a delta against its parent when that is smaller.
+    """
+    author = get_or_create_author(session, authorname)
+    parent = find_parent_essay(session, author, title, parent_id)
+    essay = Essay(
+        author=author,
+        title=title,
+        parent=parent,
+        root=parent and (parent.root or parent),
+        revision=parent.revision + 1 if parent else 1,
+        date_submitted=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+        images=[EssayImage(image_path=extracted_text["filename"], ocr_tier=extracted_text.get("ocr_tier"),
+                           ocr_confidence=extracted_text.get("ocr_confidence")) for extracted_text in extracted_texts],
+        grades=[grade_row(grade) for grade in grades],
+    )
+    # Reading the parent's text must not flush the half-built essay
+    with session.no_autoflush:
+        essay.text = full_text
+    session.add(essay)
+    add_grade_stats(session, author, essay.grades, essay.date_submitted)
+    return essay
+
+
+def save_essays(records: list) -> list:
+    """Stores many essays in one transaction; images and grades go out as multi-row inserts.
+
+    `records` are (authorname, title, full_text, extracted_texts, grades[, parent_id]) tuples.
+    Returns the new essay IDs in order.
+    """
+    with db_write_seconds.time(), write_session() as session:
+        essays = [add_essay(session, *record) for record in records]
+        session.flush()
+        return [essay.id for essay in essays]
+
+
+def save_essay(authorname: str, title: str, full_text: str, extracted_texts: list, grades: list, parent_id: int = None) -> int:
+    """Stores the essay with its images and grades in a single commit and returns the essay ID."""
+    return save_essays([(authorname, title, full_text, extracted_texts, grades, parent_id)])[0]
+
+
+class EssayWriter:
+    """Groups essays saved around the same time into one transaction.
+
+    `await writer.save(...)` resolves with the essay ID once the batch holding it is
+    committed. A batch is written when it reaches `max_batch` essays or `max_delay`
+    seconds after its first essay arrived, whichever comes first.
+    """
+
+    def __init__(self, max_batch: int = None, max_delay: float = None):
+        self.max_batch = max(1, max_batch or WRITE_BATCH_SIZE)
+        self.max_delay = WRITE_BATCH_DELAY if max_delay is None else max_delay
+        self._pending = []
+        self._timer = None
+        self.commits = 0
+        self.essays = 0
+
+    async def save(self, authorname: str, title: str, full_text: str, extracted_texts: list, grades: list, parent_id: int = None) -> int:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(((authorname, title, full_text, extracted_texts, grades, parent_id), future))
+        if len(self._pending) >= self.max_batch:
+            self._schedule_flush(loop)
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._schedule_flush, loop)
+        return await future
+
+    def _schedule_flush(self, loop):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            loop.create_task(self._write(batch))
+
+    async def _write(self, batch: list):
+        loop = asyncio.get_running_loop()
+        try:
+            # The commit runs on a worker thread so the event loop keeps going
+            essay_ids = await loop.run_in_executor(None, save_essays, [record for record, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                self._fail(batch, e)
+                return
+            # One bad record rolls back the whole transaction; write each essay on its own so only the bad ones fail
+            for entry in batch:
+                await self._write([entry])
+            return
+        self.commits += 1
+        self.essays += len(batch)
+        for (_, future), essay_id in zip(batch, essay_ids):
+            if not future.done():
+                future.set_result(essay_id)
+
+    @staticmethod
+    def _fail(batch: list, error: Exception):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def flush(self):
+        """Writes whatever is pending right away."""
+        self._schedule_flush(asyncio.get_running_loop())
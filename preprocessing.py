@@ -0,0 +1,194 @@
+"""Page preprocessing for OCR with NumPy and OpenCV only, run in a process pool across cores.
+
+Each page is decoded straight to grayscale, downscaled, contrast-stretched, blurred,
+binarized with Otsu, deskewed and cropped to the bounding box of its ink, then encoded
+with whichever format is smallest. `prepare_pages` handles a list of pages; the API
+sends pages one at a time to `preprocess_pool()` so pages of every request in flight
+share the cores.
+"""
+import os
+import atexit
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Worker processes for page preprocessing; 0 runs it in the calling process
+PREPROCESS_PROCESSES = int(os.getenv("PREPROCESS_PROCESSES", str(os.cpu_count() or 1)))
+# Longest side (pixels) of the page image sent to OCR; the vision model downsizes anything larger anyway
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "2048"))
+# Quality of the lossy JPEG candidate; lower values start to blur thin pen strokes
+OCR_JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "85"))
+# Straighten pages photographed at an angle, searching up to PREPROCESS_MAX_SKEW degrees either way
+PREPROCESS_DESKEW = os.getenv("PREPROCESS_DESKEW", "1") == "1"
+PREPROCESS_MAX_SKEW = float(os.getenv("PREPROCESS_MAX_SKEW", "10"))
+# Crop away the margins around the ink, keeping PREPROCESS_CROP_MARGIN pixels of white around it
+PREPROCESS_CROP = os.getenv("PREPROCESS_CROP", "1") == "1"
+PREPROCESS_CROP_MARGIN = int(os.getenv("PREPROCESS_CROP_MARGIN", "16"))
+
+# Contrast factor, matching the ImageEnhance.Contrast(2.0) step this pipeline replaced
+CONTRAST = 2.0
+# Rows/columns with less ink than this share of their length are treated as specks when cropping
+SPECK_RATIO = 0.002
+# Width the skew search works at; the angle does not need full resolution
+SKEW_SEARCH_WIDTH = 400
+
+
+def decode_gray(image_data: bytes) -> np.ndarray:
+    gray = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ValueError("Unsupported or corrupt image.")
+    return gray
+
+
+def downscale(gray: np.ndarray, max_side: int) -> np.ndarray:
+    height, width = gray.shape
+    scale = max_side / max(height, width) if max_side else 1
+    if scale >= 1:
+        return gray
+    return cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+
+def binarize(gray: np.ndarray) -> np.ndarray:
+    """Contrast stretch around the mean, 5x5 Gaussian blur and Otsu threshold: black ink (0) on white (255)."""
+    mean = int(gray.mean() + 0.5)
+    table = np.clip(np.arange(256) * CONTRAST - mean * (CONTRAST - 1), 0, 255).astype(np.uint8)
+    blurred = cv2.GaussianBlur(cv2.LUT(gray, table), (5, 5), 0)
+    _, binary = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return binary
+
+
+def rotate(image: np.ndarray, angle: float, interpolation=cv2.INTER_NEAREST, border=255) -> np.ndarray:
+    height, width = image.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(image, matrix, (width, height), flags=interpolation, borderValue=border)
+
+
+def skew_angle(binary: np.ndarray, max_skew: float = None) -> float:
+    """Angle in degrees that makes the text lines horizontal.
+
+    Projection-profile search: the right angle turns each text line into a row band full
+    of ink between empty gaps, which maximizes the variance of the row sums. A coarse 1 degree
+    sweep is refined in 0.1 degree steps, on a reduced copy of the page.
+    """
+    max_skew = PREPROCESS_MAX_SKEW if max_skew is None else max_skew
+    ink = (binary < 128).astype(np.float32)
+    scale = min(1.0, SKEW_SEARCH_WIDTH / ink.shape[1])
+    if scale < 1:
+        ink = cv2.resize(ink, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if not ink.any():
+        return 0.0
+
+    def score(angle):
+        return float(np.var(rotate(ink, angle, cv2.INTER_LINEAR, 0).sum(axis=1)))
+
+    coarse = max(np.arange(-max_skew, max_skew + 0.5, 1.0), key=score)
+    return float(max(np.arange(coarse - 1, coarse + 1.05, 0.1), key=score))
+
+
+def ink_bounds(binary: np.ndarray, margin: int = None):
+    """(top, bottom, left, right) of the region holding ink, widened by `margin`; None for a blank page."""
+    margin = PREPROCESS_CROP_MARGIN if margin is None else margin
+    ink = binary < 128
+    rows = np.flatnonzero(ink.sum(axis=1) > ink.shape[1] * SPECK_RATIO)
+    columns = np.flatnonzero(ink.sum(axis=0) > ink.shape[0] * SPECK_RATIO)
+    if not len(rows) or not len(columns):
+        return None
+    height, width = binary.shape
+    return (max(0, rows[0] - margin), min(height, rows[-1] + 1 + margin),
+            max(0, columns[0] - margin), min(width, columns[-1] + 1 + margin))
+
+
+def preprocess(gray: np.ndarray, deskew: bool = None, crop: bool = None) -> np.ndarray:
+    """Binarizes a grayscale page, then straightens it and crops it to its ink."""
+    deskew = PREPROCESS_DESKEW if deskew is None else deskew
+    crop = PREPROCESS_CROP if crop is None else crop
+    binary = binarize(gray)
+    if deskew:
+        angle = skew_angle(binary)
+        if abs(angle) >= 0.1:
+            binary = rotate(binary, angle)
+    if crop:
+        bounds = ink_bounds(binary)
+        if bounds:
+            top, bottom, left, right = bounds
+            binary = binary[top:bottom, left:right]
+    return binary
+
+
+def encode(binary: np.ndarray, jpeg_quality: int = None):
+    """Encodes a page with whichever format is smallest: a PNG (1-bit when the page is binarized) or a JPEG.
+
+    Returns (bytes, mime type).
+    """
+    jpeg_quality = jpeg_quality or OCR_JPEG_QUALITY
+    candidates = [(cv2.imencode(".jpg", binary, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1])[1], "image/jpeg")]
+    if np.isin(binary, (0, 255)).all():
+        # A 1-bit PNG is always smaller than a grayscale one for a two-tone page, so that one is skipped
+        candidates.append((cv2.imencode(".png", binary, [cv2.IMWRITE_PNG_BILEVEL, 1, cv2.IMWRITE_PNG_COMPRESSION, 9])[1], "image/png"))
+    else:
+        candidates.append((cv2.imencode(".png", binary)[1], "image/png"))
+    data, mime_type = min(candidates, key=lambda candidate: candidate[0].size)
+    return data.tobytes(), mime_type
+
+
+def prepare_page(image_data: bytes, max_side: int = None, jpeg_quality: int = None, deskew: bool = None, crop: bool = None):
+    """Decodes, preprocesses and encodes one uploaded page. Returns (encoded bytes, mime type).
+
+    Options left as None use the module settings of the process running it, so callers
+    dispatching to the pool should bind them with `page_task()`.
+    """
+    gray = downscale(decode_gray(image_data), max_side or OCR_MAX_SIDE)
+    return encode(preprocess(gray, deskew, crop), jpeg_quality)
+
+
+def page_task():
+    """`prepare_page` with this process's current settings bound, ready to send to a worker process."""
+    return partial(prepare_page, max_side=OCR_MAX_SIDE, jpeg_quality=OCR_JPEG_QUALITY, deskew=PREPROCESS_DESKEW, crop=PREPROCESS_CROP)
+
+
+_pool = None
+
+
+def preprocess_pool():
+    """Process pool shared by every request, started on first use; None when PREPROCESS_PROCESSES is 0."""
+    global _pool
+    if _pool is None and PREPROCESS_PROCESSES > 0:
+        # Spawned rather than forked: the API process runs an event loop and thread pools
+        _pool = ProcessPoolExecutor(max_workers=PREPROCESS_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def reset_pool(pool):
+    """Drops `pool` once it is broken (a worker died), so the next `preprocess_pool()` call starts a new one.
+
+    Every page in flight fails with the same broken pool; only the first of them replaces it.
+    """
+    global _pool
+    if pool is not None and _pool is pool:
+        _pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+atexit.register(shutdown_pool)
+
+
+def prepare_pages(pages: list, pool=None) -> list:
+    """Preprocesses a list of page bytes across the pool's processes, keeping their order."""
+    pool = pool or preprocess_pool()
+    task = page_task()
+    if pool is None:
+        return [task(page) for page in pages]
+    return list(pool.map(task, pages, chunksize=max(1, len(pages) // (4 * PREPROCESS_PROCESSES))))
@@ -0,0 +1,353 @@
+import os
+import re
+import time
+import random
+import asyncio
+import weakref
+import itertools
+import threading
+from email.utils import parsedate_to_datetime
+from contextlib import asynccontextmanager
+import openai
+from dotenv import load_dotenv
+from metrics import Gauge, model_retries
+
+
+load_dotenv()
+
+# Process-wide budget shared by every OCR and grading request, across essays and batches
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "450000"))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "5000"))
+# Retries of one failed model request (429, 5xx, timeouts), with full-jitter exponential backoff in seconds
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "20"))
+
+# Rough token cost of one page image at high detail (4 tiles of 170 plus the 85 base)
+IMAGE_TOKENS = 765
+
+
+def estimate_tokens(messages, completion_tokens: int = 0) -> int:
+    """Approximate tokens a request will use: ~4 characters per text token plus a flat cost per image."""
+    tokens = completion_tokens
+    for message in messages:
+        content = message.get("content", "")
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content}]
+        for part in parts:
+            if part.get("type") == "image_url":
+                tokens += IMAGE_TOKENS
+            else:
+                tokens += len(part.get("text") or "") // 4 + 1
+    return tokens
+
+
+def parse_duration(value) -> float:
+    """Seconds in an x-ratelimit-reset-* header such as "1s", "6m0s" or "20ms"; None if absent or unreadable."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def header_number(value) -> float:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def retry_after(headers) -> float:
+    """Seconds the provider asked to wait, from retry-after-ms or retry-after (seconds or an HTTP date)."""
+    milliseconds = header_number(headers.get("retry-after-ms"))
+    if milliseconds is not None:
+        return milliseconds / 1000
+    value = headers.get("retry-after")
+    seconds = header_number(value)
+    if seconds is None and value:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return seconds
+
+
+def retryable(error: Exception) -> bool:
+    if isinstance(error, openai.RateLimitError):
+        # An exhausted quota is not a rate limit: no amount of waiting makes the request succeed
+        return getattr(error, "code", None) != "insufficient_quota"
+    return isinstance(error, (openai.APIConnectionError, openai.InternalServerError))
+
+
+class TokenBucket:
+    """Per-minute budget (of tokens, or of requests) that refills continuously."""
+
+    def __init__(self, tokens_per_minute: int):
+        self.configured = tokens_per_minute
+        self.capacity = tokens_per_minute
+        self.available = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def try_take(self, tokens: int) -> float:
+        """Takes `tokens` if available and returns 0, otherwise returns the seconds to wait."""
+        # A single request larger than the whole budget only has to wait for a full bucket
+        tokens = min(tokens, self.capacity)
+        with self._lock:
+            self._refill()
+            if self.available >= tokens:
+                self.available -= tokens
+                return 0.0
+            return (tokens - self.available) * 60.0 / self.capacity
+
+    def give_back(self, tokens: int):
+        """Returns (or, if negative, charges) tokens once the real usage of a request is known."""
+        with self._lock:
+            self._refill()
+            self.available = min(self.capacity, self.available + tokens)
+
+    def sync(self, limit: float = None, remaining: float = None):
+        """Adopts the provider's view of this budget: an account `limit` below the configured one, and a lower `remaining` count."""
+        with self._lock:
+            self._refill()
+            if limit:
+                self.capacity = min(self.configured, limit)
+            if remaining is not None:
+                self.available = min(self.available, remaining)
+
+
+class Reservation:
+    def __init__(self, limiter, estimated: int):
+        self.limiter = limiter
+        self.estimated = estimated
+
+    def settle(self, usage):
+        """Corrects the budget with the `usage` of the response, if the provider reported one."""
+        total = getattr(usage, "total_tokens", None)
+        if total is not None:
+            self.limiter.bucket.give_back(self.estimated - total)
+            self.limiter.stats["tokens"] += total - self.estimated
+
+
+class ConcurrencyGate:
+    """Admits callers while fewer than `limit()` of them are inside; the limit may change between calls."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self._waiters = []
+
+    async def acquire(self, limit):
+        while self.in_flight >= limit():
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        # Everyone re-checks against the current limit, which may have grown since they started waiting
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+class RateLimiter:
+    """Keeps model requests within the requests- and tokens-per-minute budgets of the whole process.
+
+    Concurrency adapts AIMD-style: every success raises the limit by 1/limit, about one more
+    slot per round of requests, and a 429 halves it. The provider's x-ratelimit-* headers tighten
+    both budgets, and a Retry-After pauses every caller rather than only the one rejected.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+                 requests_per_minute: int = LLM_REQUESTS_PER_MINUTE, min_concurrency: int = LLM_MIN_CONCURRENCY,
+                 max_retries: int = LLM_MAX_RETRIES):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = min(max(1, min_concurrency), self.max_concurrency)
+        # Current concurrency limit, between min_concurrency and max_concurrency
+        self.limit = float(self.max_concurrency)
+        self.bucket = TokenBucket(tokens_per_minute)
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.max_retries = max_retries
+        self.paused_until = 0.0
+        self._last_decrease = 0.0
+        # asyncio futures belong to one event loop, so keep one gate per loop
+        self._gates = weakref.WeakKeyDictionary()
+        self.in_flight = 0
+        # Requests waiting for budget or a free slot
+        self.waiting = 0
+        self.stats = {"requests": 0, "tokens": 0, "throttled_seconds": 0.0, "retries": 0, "rate_limited": 0}
+
+    def _gate(self) -> ConcurrencyGate:
+        loop = asyncio.get_running_loop()
+        gate = self._gates.get(loop)
+        if gate is None:
+            gate = self._gates[loop] = ConcurrencyGate()
+        return gate
+
+    def _budget_wait(self, tokens: int) -> float:
+        """Takes one request and `tokens` from the budgets and returns 0, or returns the seconds to wait first."""
+        pause = self.paused_until - time.monotonic()
+        if pause > 0:
+            return pause
+        wait = self.request_bucket.try_take(1)
+        if wait > 0:
+            return wait
+        wait = self.bucket.try_take(tokens)
+        if wait > 0:
+            self.request_bucket.give_back(1)
+        return wait
+
+    async def _take_budget(self, tokens: int):
+        while True:
+            wait = self._budget_wait(tokens)
+            if wait <= 0:
+                return
+            self.stats["throttled_seconds"] += wait
+            await asyncio.sleep(wait)
+
+    def _take_budget_sync(self, tokens: int):
+        while True:
+            wait = self._budget_wait(tokens)
+            if wait <= 0:
+                return
+            self.stats["throttled_seconds"] += wait
+            time.sleep(wait)
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int):
+        """Waits for a free request slot and budget; yields a `Reservation` to settle with the real usage."""
+        gate = self._gate()
+        self.waiting += 1
+        try:
+            await gate.acquire(lambda: int(self.limit))
+            try:
+                # Budget is taken last so a pause that started while waiting for the slot still applies
+                await self._take_budget(estimated_tokens)
+            except BaseException:
+                gate.release()
+                raise
+        finally:
+            self.waiting -= 1
+        try:
+            self.in_flight += 1
+            self.stats["requests"] += 1
+            self.stats["tokens"] += estimated_tokens
+            yield Reservation(self, estimated_tokens)
+        finally:
+            self.in_flight -= 1
+            gate.release()
+
+    def pause(self, seconds: float):
+        """Holds back every request for `seconds`."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def observe(self, headers):
+        """Follows the provider's x-ratelimit-* response headers for both budgets.
+
+        Other processes may share the account, so a lower remaining count than ours drains the
+        budget, and an exhausted one pauses every request until its reset.
+        """
+        for kind, bucket in (("requests", self.request_bucket), ("tokens", self.bucket)):
+            remaining = header_number(headers.get(f"x-ratelimit-remaining-{kind}"))
+            bucket.sync(header_number(headers.get(f"x-ratelimit-limit-{kind}")), remaining)
+            if remaining is not None and remaining <= 0:
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self.pause(reset)
+
+    def _succeeded(self):
+        self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+
+    def _rate_limited(self, started: float, error: openai.RateLimitError):
+        self.stats["rate_limited"] += 1
+        response = getattr(error, "response", None)
+        wait = retry_after(response.headers) if response is not None else None
+        if wait:
+            self.pause(wait)
+        # Requests sent before the last cut were rejected by the same burst; halve once per burst
+        if started >= self._last_decrease:
+            self.limit = max(float(self.min_concurrency), self.limit / 2)
+            self._last_decrease = time.monotonic()
+
+    def _retry_delay(self, error: Exception, attempt: int, started: float) -> float:
+        """Seconds to back off before retrying after `error`, or None if the request should fail."""
+        if isinstance(error, openai.RateLimitError):
+            self._rate_limited(started, error)
+        if attempt >= self.max_retries or not retryable(error):
+            return None
+        self.stats["retries"] += 1
+        model_retries.inc(error=type(error).__name__)
+        return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+    async def call(self, send, estimated_tokens: int):
+        """Sends one model request with `send()`, a coroutine function, within the budgets.
+
+        A rate-limited, failed or timed-out attempt is retried on its own with jittered
+        backoff; the last error is raised once retries run out or for errors retrying cannot fix.
+        """
+        for attempt in itertools.count():
+            async with self.slot(estimated_tokens) as reservation:
+                started = time.monotonic()
+                try:
+                    response = await send()
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt, started)
+                    if delay is None:
+                        raise
+                else:
+                    reservation.settle(getattr(response, "usage", None))
+                    self._succeeded()
+                    return response
+            # Back off without holding the slot
+            await asyncio.sleep(delay)
+
+    def call_sync(self, send, estimated_tokens: int):
+        """Blocking counterpart of `call`: shares the budgets, pauses and retries, while callers' threads bound concurrency."""
+        for attempt in itertools.count():
+            self._take_budget_sync(estimated_tokens)
+            self.stats["requests"] += 1
+            self.stats["tokens"] += estimated_tokens
+            started = time.monotonic()
+            try:
+                response = send()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, started)
+                if delay is None:
+                    raise
+            else:
+                Reservation(self, estimated_tokens).settle(getattr(response, "usage", None))
+                self._succeeded()
+                return response
+            time.sleep(delay)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "in_flight": self.in_flight, "max_concurrency": self.max_concurrency,
+                "concurrency_limit": int(self.limit), "tokens_per_minute": self.bucket.capacity,
+                "requests_per_minute": self.request_bucket.capacity}
+
+
+llm_limiter = RateLimiter()
+
+Gauge("llm_requests", "Model requests in flight, and waiting for budget or a free slot.", ("state",),
+      function=lambda: {("in_flight",): llm_limiter.in_flight, ("waiting",): llm_limiter.waiting})
+Gauge("llm_concurrency_limit", "Adaptive limit on model requests in flight: grows with successes, halves on 429.",
+      function=lambda: {(): int(llm_limiter.limit)})
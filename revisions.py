@@ -0,0 +1,65 @@
+import os
+import re
+import json
+import zlib
+from difflib import SequenceMatcher
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Every Nth revision of an essay is stored whole, so rebuilding a text never replays more than N-1 deltas
+REVISION_SNAPSHOT_INTERVAL = int(os.getenv("REVISION_SNAPSHOT_INTERVAL", "10"))
+
+# Values of Essay.text_encoding; rows from before revisions have none and keep their plain `text`
+ZLIB = "zlib"
+DELTA = "delta"
+
+# Sentences with their trailing whitespace, so joining the tokens gives back the exact text.
+# Diffing whole sentences keeps SequenceMatcher fast on long essays; an edited sentence is stored again in full.
+TOKEN_PATTERN = re.compile(r"[^.!?\n]*(?:[.!?\n]+\s*|$)")
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_PATTERN.findall(text)
+
+
+def make_delta(parent_text: str, text: str) -> list:
+    """Sentence-level edit script turning `parent_text` into `text`.
+
+    Operations are [start, end] (copy parent tokens start..end) or a string (insert it).
+    """
+    parent_tokens, tokens = tokenize(parent_text), tokenize(text)
+    ops = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, parent_tokens, tokens, autojunk=False).get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(tokens[j1:j2]))
+    return ops
+
+
+def apply_delta(parent_text: str, ops: list) -> str:
+    parent_tokens = tokenize(parent_text)
+    return "".join(op if isinstance(op, str) else "".join(parent_tokens[op[0]:op[1]]) for op in ops)
+
+
+def encode_text(text: str, parent_text: str = None, revision: int = 1):
+    """Picks the smaller of a compressed snapshot and a compressed delta against the parent.
+
+    Returns (encoding, data). Deltas are only considered for a revision that has a parent
+    and is not due for a snapshot.
+    """
+    snapshot = zlib.compress(text.encode("utf-8"))
+    if parent_text is None or revision % REVISION_SNAPSHOT_INTERVAL == 0:
+        return ZLIB, snapshot
+    delta = zlib.compress(json.dumps(make_delta(parent_text, text), separators=(",", ":")).encode("utf-8"))
+    return (DELTA, delta) if len(delta) < len(snapshot) else (ZLIB, snapshot)
+
+
+def decode_text(encoding: str, data: bytes, parent_text: str = None) -> str:
+    if encoding == ZLIB:
+        return zlib.decompress(data).decode("utf-8")
+    if encoding == DELTA:
+        return apply_delta(parent_text, json.loads(zlib.decompress(data)))
+    raise ValueError(f"Unknown text encoding {encoding!r}.")
@@ -0,0 +1,122 @@
+import asyncio
+import io
+import json
+import time
+import zipfile
+
+import httpx
+import pytest
+
+import main
+from rate_limit import RateLimiter, TokenBucket
+from test_submit_essay import page
+
+MANIFEST = [
+    {"authorname": "ana", "title": "Puerto Rico", "files": ["ana_1.png", "ana_2.png"]},
+    {"authorname": "ben", "title": "My Dog", "files": ["ben_1.png"]},
+    {"authorname": "cleo", "title": "Summer", "files": ["cleo_1.png"]},
+]
+PAGES = {"ana_1.png": 100, "ana_2.png": 200, "ben_1.png": 300, "cleo_1.png": 400}
+
+
+def post_batch(**kwargs):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/submit-batch/", **kwargs)
+
+    response = asyncio.run(run())
+    return response, [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_batch_streams_each_essay_and_a_summary(db_session, fake_pipeline):
+    files = [("files", (name, page(width), "image/png")) for name, width in PAGES.items()]
+    started = time.perf_counter()
+    response, lines = post_batch(files=files, data={"manifest": json.dumps(MANIFEST)})
+    elapsed = time.perf_counter() - started
+
+    assert response.status_code == 200
+    essays = {line["authorname"]: line for line in lines if line["type"] == "essay"}
+    assert essays["ana"]["result"]["text"] == "page-100 page-200"
+    assert essays["cleo"]["result"]["text"] == "page-400"
+    assert lines[-1]["type"] == "summary"
+    assert lines[-1]["succeeded"] == 3
+    assert lines[-1]["database_commits"] < 3
+    # Essays share the pipeline instead of running one after another
+    assert fake_pipeline["max"] == 4
+    assert elapsed < 1.0
+    # Faster essays are streamed first
+    assert [line["authorname"] for line in lines[:-1]] == ["cleo", "ben", "ana"]
+
+
+def test_batch_accepts_a_zip_with_its_manifest(db_session, fake_pipeline):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zipped:
+        zipped.writestr("class/manifest.json", json.dumps(MANIFEST))
+        for name, width in PAGES.items():
+            zipped.writestr(f"class/{name}", page(width))
+
+    response, lines = post_batch(files=[("files", ("class.zip", archive.getvalue(), "application/zip"))])
+
+    assert response.status_code == 200
+    assert lines[-1]["succeeded"] == 3
+
+
+def test_batch_rejects_manifest_with_missing_files(db_session, fake_pipeline):
+    files = [("files", ("ana_1.png", page(100), "image/png"))]
+    response, _ = post_batch(files=files, data={"manifest": json.dumps(MANIFEST[:1])})
+
+    assert response.status_code == 400
+    assert "ana_2.png" in response.json()["detail"]
+
+
+def test_batch_rejects_ambiguous_and_duplicate_filenames():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zipped:
+        zipped.writestr("ana/page1.png", page(100))
+        zipped.writestr("ben/page1.png", page(200))
+    zipped_pages = [("class.zip", archive.getvalue())]
+    by_path = [{"authorname": "ana", "title": "Trip", "files": ["ana/page1.png"]},
+               {"authorname": "ben", "title": "Dog", "files": ["ben/page1.png"]}]
+
+    essays = main.read_batch(zipped_pages, json.dumps(by_path))
+    assert [essay["pages"][0][1] for essay in essays] == [page(100), page(200)]
+
+    by_basename = [{**entry, "files": ["page1.png"]} for entry in by_path]
+    with pytest.raises(main.HTTPException) as ambiguous:
+        main.read_batch(zipped_pages, json.dumps(by_basename))
+    assert ambiguous.value.status_code == 400
+    assert "page1.png" in ambiguous.value.detail
+
+    with pytest.raises(main.HTTPException) as duplicate:
+        main.read_batch([("page1.png", page(100)), ("page1.png", page(200))], json.dumps(by_basename[:1]))
+    assert duplicate.value.status_code == 400
+
+
+def test_token_bucket_throttles_beyond_the_budget():
+    bucket = TokenBucket(tokens_per_minute=600)
+
+    assert bucket.try_take(500) == 0
+    assert bucket.try_take(200) == pytest.approx(10, abs=0.1)
+    bucket.give_back(400)
+    assert bucket.try_take(200) == 0
+
+
+def test_rate_limiter_bounds_requests_across_callers():
+    limiter = RateLimiter(max_concurrency=3, tokens_per_minute=10_000_000)
+    peak = {"now": 0, "max": 0}
+
+    async def call():
+        async with limiter.slot(100):
+            peak["now"] += 1
+            peak["max"] = max(peak["max"], peak["now"])
+            await asyncio.sleep(0.01)
+            peak["now"] -= 1
+
+    async def run():
+        await asyncio.gather(*(call() for _ in range(12)))
+
+    asyncio.run(run())
+
+    assert peak["max"] == 3
+    assert limiter.get_stats()["requests"] == 12
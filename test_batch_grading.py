@@ -0,0 +1,172 @@
+import json
+
+import openai
+import pytest
+
+import batch_grading
+import grading
+import llm_gateway
+import main
+import persistence
+from benchmarks.bench_read_path import QueryCounter
+from testing.fake_openai import FakeOpenAIServer
+
+
+def add_essay(session, authorname, text, graded_types=()):
+    author = main.Author(authorname=authorname)
+    essay = main.Essay(author=author, title=f"{authorname}'s essay", text=text)
+    session.add(essay)
+    for grade_type in graded_types:
+        session.add(main.EssayGrade(essay=essay, grade_type=grade_type, grade=3, comments="Done."))
+    session.commit()
+    return essay
+
+
+def test_a_backend_missing_a_method_fails_when_created():
+    class NoResults(batch_grading.BatchBackend):
+        def submit(self, input_path):
+            return "batch"
+
+        def status(self, batch_id):
+            return batch_grading.COMPLETED
+
+    with pytest.raises(TypeError, match="results"):
+        NoResults()
+
+
+def test_openai_backend_keeps_the_sdk_retries_the_gateway_client_turns_off(isolated_gateway):
+    backend = batch_grading.OpenAIBatchBackend(client=llm_gateway.get_client())
+
+    assert llm_gateway.get_client().max_retries == 0
+    assert backend.client.max_retries == openai.DEFAULT_MAX_RETRIES
+
+
+def test_batch_requests_match_single_grader(db_session):
+    essay = add_essay(db_session, "ana", "I visited Puerto Rico.", graded_types=["ideas", "voice"])
+
+    pending = batch_grading.pending_essays(db_session)
+    requests = batch_grading.build_batch_requests(pending)
+
+    assert [missing for _, missing in pending] == [["organization", "word_choice", "sentence_fluency", "conventions"]]
+    assert requests[0]["custom_id"] == f"essay-{essay.id}-organization"
+    assert requests[0]["body"]["messages"] == grading.grader_messages(essay.text, grading.prompt_organization)
+    assert requests[0]["body"]["response_format"] == {"type": "json_object"}
+
+
+def test_local_backend_grades_pending_essays_offline(db_session, tmp_path, monkeypatch, isolated_gateway):
+    monkeypatch.setattr(batch_grading, "BATCH_DIR", str(tmp_path / "batches"))
+    pending_essay = add_essay(db_session, "ana", "I visited Puerto Rico.")
+    add_essay(db_session, "ben", "My dog is fast.", graded_types=list(grading.categories))
+
+    with FakeOpenAIServer(grade=4, rate_limited_first=1, retry_after=0.01) as server:
+        llm_gateway.configure(base_url=server.url, api_key="test-key")
+        backend = batch_grading.LocalBatchBackend(str(tmp_path / "service"))
+        summary = batch_grading.run_offline_batch(backend, poll_interval=0)
+        llm_gateway.close()
+
+    assert summary["status"] == batch_grading.COMPLETED
+    assert summary["essays"] == 1
+    assert summary["grades_written"] == len(grading.categories)
+    # The simulated service goes through the limiter, which retried the rate-limited request
+    assert server.statuses == {429: 1, 200: len(grading.categories)}
+    assert isolated_gateway.stats["retries"] == 1
+    assert sorted(grade.grade_type for grade in pending_essay.grades) == sorted(grading.categories)
+    assert all(grade.grade == 4 for grade in pending_essay.grades)
+    assert batch_grading.pending_essays(db_session) == []
+    author_summary = main.get_author_summary("ana", session=db_session)
+    assert [(row["type"], row["count"], row["mean"]) for row in author_summary["categories"]] == [(category, 1, 4.0) for category in grading.categories]
+
+    with open(backend._path(summary["batch_id"], "output.jsonl")) as output:
+        assert all(json.loads(line)["response"]["status_code"] == 200 for line in output)
+
+
+def test_failed_requests_leave_the_essay_pending(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_grading, "BATCH_DIR", str(tmp_path / "batches"))
+    essay = add_essay(db_session, "ana", "I visited Puerto Rico.")
+
+    def responder(body):
+        if "Voice Grader" in body["messages"][-1]["content"]:
+            raise RuntimeError("server error")
+        return {"choices": [{"message": {"content": json.dumps({"grade": 2, "comments": "Ok."})}}]}
+
+    backend = batch_grading.LocalBatchBackend(str(tmp_path / "service"), responder=responder)
+    summary = batch_grading.run_offline_batch(backend, poll_interval=0)
+
+    assert summary["grades_written"] == len(grading.categories) - 1
+    assert summary["requests_failed"] == 1
+    assert [missing for _, missing in batch_grading.pending_essays(db_session)] == [["voice"]]
+    assert essay.id == batch_grading.pending_essays(db_session)[0][0].id
+
+
+def test_essays_saved_while_the_batch_runs_do_not_block_its_results(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_grading, "BATCH_DIR", str(tmp_path / "batches"))
+    essay_id = add_essay(db_session, "ana", "I visited Puerto Rico.").id
+    db_session.close()
+
+    class BusyServerBackend(batch_grading.LocalBatchBackend):
+        def status(self, batch_id):
+            # The API keeps saving essays while the batch is polled
+            persistence.save_essay("ben", "My Dog", "My dog is fast.", [], [{"type": "ideas", "grade": 3, "comments": "Ok."}])
+            return super().status(batch_id)
+
+    responder = lambda body: {"choices": [{"message": {"content": json.dumps({"grade": 2, "comments": "Ok."})}}]}
+    summary = batch_grading.run_offline_batch(BusyServerBackend(str(tmp_path / "service"), responder=responder), poll_interval=0)
+
+    assert summary["grades_written"] == len(grading.categories)
+    assert sorted(grade.grade_type for grade in db_session.get(main.Essay, essay_id).grades) == sorted(grading.categories)
+
+
+def test_pending_essays_are_found_with_a_constant_number_of_queries(db_session):
+    # Every third essay is fully graded, the others miss all or half of the categories
+    for index in range(12):
+        add_essay(db_session, f"author{index}", "I visited Puerto Rico.", graded_types=list(grading.categories)[:index % 3 * 3])
+    db_session.expire_all()
+
+    with QueryCounter(db_session.get_bind()) as counter:
+        pending = batch_grading.pending_essays(db_session)
+
+    assert counter.count == 2
+    assert [len(missing) for _, missing in pending] == [6, 3] * 4
+    assert [essay.id for essay, _ in batch_grading.pending_essays(db_session, limit=3)] == [essay.id for essay, _ in pending[:3]]
+
+
+def test_a_batch_left_in_progress_is_resumed_instead_of_resubmitted(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_grading, "BATCH_DIR", str(tmp_path / "batches"))
+    essay_id = add_essay(db_session, "ana", "I visited Puerto Rico.").id
+    db_session.close()
+    responder = lambda body: {"choices": [{"message": {"content": json.dumps({"grade": 3, "comments": "Ok."})}}]}
+
+    class SlowBackend(batch_grading.LocalBatchBackend):
+        ready = False
+
+        def status(self, batch_id):
+            return super().status(batch_id) if self.ready else batch_grading.IN_PROGRESS
+
+    backend = SlowBackend(str(tmp_path / "service"), responder=responder)
+    stopped = batch_grading.run_offline_batch(backend, poll_interval=0, timeout=0)
+    # The stopped batch's requests are still covered, so a new run submits nothing
+    rerun = batch_grading.run_offline_batch(backend, poll_interval=0, timeout=0)
+
+    backend.ready = True
+    resumed = batch_grading.resume_batches(backend, poll_interval=0)
+
+    assert stopped["status"] == batch_grading.IN_PROGRESS
+    assert stopped["grades_written"] == 0
+    assert rerun["requests"] == 0
+    assert [(summary["batch_id"], summary["grades_written"]) for summary in resumed] == [(stopped["batch_id"], len(grading.categories))]
+    assert batch_grading.resume_batches(backend, poll_interval=0) == []
+    assert len(db_session.get(main.Essay, essay_id).grades) == len(grading.categories)
+    author_summary = main.get_author_summary("ana", session=db_session)
+    assert all(row["count"] == 1 for row in author_summary["categories"])
+
+
+def test_results_for_categories_graded_meanwhile_are_not_added_twice(db_session):
+    essay = add_essay(db_session, "ana", "I visited Puerto Rico.", graded_types=["ideas"])
+    line = lambda category: {"custom_id": batch_grading.custom_id(essay.id, category), "error": None, "response": {
+        "status_code": 200, "body": {"choices": [{"message": {"content": json.dumps({"grade": 5, "comments": "Great."})}}]}}}
+
+    counts = batch_grading.apply_batch_results(db_session, [line("ideas"), line("voice"), line("voice")])
+    db_session.commit()
+
+    assert counts == {"grades_written": 1, "requests_failed": 0, "already_graded": 2}
+    assert sorted((grade.grade_type, grade.grade) for grade in essay.grades) == [("ideas", 3), ("voice", 5)]
@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+from PIL import Image
+
+import grading
+import integrations
+import llm_gateway
+from cache import ResultCache
+from test_grading import fake_client
+from testing.fake_openai import FakeOpenAIServer
+
+
+def test_result_cache_memory_and_disk_tiers(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ResultCache("grade_cache", path=path, memory_size=1)
+    cache.set("a", {"grade": 1})
+    cache.set("b", {"grade": 2})
+
+    assert cache.get("b") == {"grade": 2}
+    assert cache.get("a") == {"grade": 1}
+    assert cache.get("c") is None
+    assert cache.get_stats()["memory_hits"] == 1
+    assert cache.get_stats()["disk_hits"] == 1
+    assert cache.get_stats()["misses"] == 1
+
+    reopened = ResultCache("grade_cache", path=path)
+    assert reopened.get("b") == {"grade": 2}
+
+
+def test_regrading_the_same_essay_hits_the_cache():
+    client, completions = fake_client(delay=0)
+    first = asyncio.run(grading.grade_essay_async("An   essay.\n", client=client))
+    second = asyncio.run(grading.grade_essay_async("An essay.", client=client))
+
+    assert first == second
+    assert completions.calls == len(grading.categories)
+    assert grading.grade_cache.get_stats()["hits"] == len(grading.categories)
+
+
+def test_changed_prompt_and_bypass_flag_miss_the_cache(monkeypatch):
+    client, completions = fake_client(delay=0)
+    asyncio.run(grading.grade_essay_async("An essay.", client=client))
+
+    monkeypatch.setitem(grading.categories, "ideas", grading.prompt_ideas + "\nBe kind.")
+    asyncio.run(grading.grade_essay_async("An essay.", client=client))
+    assert completions.calls == len(grading.categories) + 1
+
+    asyncio.run(grading.grade_essay_async("An essay.", client=client, use_cache=False))
+    assert completions.calls == 2 * len(grading.categories) + 1
+    assert grading.grade_cache.get_stats()["bypassed"] == len(grading.categories)
+
+
+def test_result_cache_evicts_by_size_and_age(tmp_path, monkeypatch):
+    cache = ResultCache("ocr_cache", path=str(tmp_path / "cache.db"), max_bytes=30, max_age=60)
+    cache.set("old", "x" * 10)
+    cache.set("new", "y" * 10)
+    assert cache.get("old") is not None
+
+    cache.set("newest", "z" * 10)
+    assert cache.get("new") is None
+    assert cache.get("old") is not None
+    assert cache.get_stats()["evictions"] == 1
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    assert cache.get("newest") is None
+    assert cache.get_stats()["evictions"] == 2
+
+
+def test_repeated_page_skips_the_vision_call(tmp_path, isolated_gateway):
+    image_path = tmp_path / "page.png"
+    Image.new("L", (40, 20), color=255).save(image_path)
+
+    with FakeOpenAIServer(ocr_text="Puerto Rico") as server:
+        llm_gateway.configure(base_url=server.url, api_key="test-key")
+        texts = [integrations.read_text_in_image(str(image_path)) for _ in range(3)]
+        llm_gateway.close()
+
+    assert texts == ["Puerto Rico"] * 3
+    assert len(server.requests) == 1
+    assert integrations.ocr_cache.get_stats()["hits"] == 2
+
+
+def test_result_cache_evicts_in_batches_and_keeps_a_running_size(tmp_path):
+    cache = ResultCache("ocr_cache", path=str(tmp_path / "cache.db"), max_bytes=1000)
+    for index in range(100):
+        cache.set(f"page-{index:03}", "x" * 10)
+
+    # Each entry is 12 bytes: going over 1000 evicts down to 900, so two batches of 9 rather than one eviction per write
+    assert cache.get_stats()["evictions"] == 18
+    assert cache.get("page-017") is None and cache.get("page-018") == "x" * 10
+    stored = cache._db().execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+    assert cache._total_bytes == stored == 82 * 12
+
+
+def test_async_cache_access_reads_and_writes_the_disk_tier(tmp_path):
+    path = str(tmp_path / "cache.db")
+
+    async def run():
+        await ResultCache("grade_cache", path=path).aset("a", {"grade": 1})
+        reopened = ResultCache("grade_cache", path=path)
+        return await reopened.aget("a"), await reopened.aget("a"), reopened.get_stats()
+
+    first, second, stats = asyncio.run(run())
+    assert first == second == {"grade": 1}
+    assert (stats["disk_hits"], stats["memory_hits"]) == (1, 1)
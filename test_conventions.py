@@ -0,0 +1,97 @@
+import asyncio
+
+import batch_grading
+import conventions
+import grading
+from test_batch_grading import add_essay
+from test_grading import fake_client
+
+CLEAN = ("My family went to the beach last summer. We swam in the ocean and built a big sandcastle. "
+         "My little brother found a crab and we laughed. It was the best day of the whole year.")
+UNPUNCTUATED = ("my famly went to the beech last sumer we swimed in the ocian and bilt a sandcasle "
+                "my brothr found a crab it was the best day i want to go back soon")
+# Correctly spelled, but most of its words are not in the basic word list
+UNLISTED = ("Photosynthesis transforms sunlight, carbon dioxide and groundwater into glucose. Chloroplasts contain chlorophyll pigments. "
+            "Herbivores consume vegetation; carnivores hunt herbivores. Decomposers recycle nutrients into fertile topsoil.")
+VARIED = ("Puerto Rico is an island in the Caribbean. The people there speak Spanish and English! "
+          "Have you ever visited? My grandmother says, \"The food is delicious.\" I agree with her, because I tried the rice.")
+
+
+def test_batch_features_match_single_essays():
+    features = conventions.analyze_batch([CLEAN, UNPUNCTUATED, VARIED, ""])
+
+    assert list(features["words"]) == [conventions.analyze(text)["words"] for text in (CLEAN, UNPUNCTUATED, VARIED, "")]
+    assert list(features["sentences"]) == [4, 1, 5, 0]
+    assert features["misspelled"][0] == 0
+    assert features["misspelled"][1] >= 6
+    assert features["capitalization_rate"][1] == 0
+    assert features["lowercase_i"][1] == 1
+    # Names are skipped rather than counted as misspellings
+    assert features["misspelled"][2] == 0
+
+
+def test_only_clear_cut_essays_get_a_local_grade():
+    grades = conventions.local_grades(conventions.analyze_batch([CLEAN, UNPUNCTUATED, VARIED, "Too short."]))
+
+    assert list(grades) == [4, 1, 0, 0]
+
+
+def test_unknown_words_alone_do_not_get_a_local_grade():
+    features = conventions.analyze(UNLISTED)
+
+    assert features["misspelling_rate"] >= 0.15
+    assert features["local_grade"] == 0
+    _, hint = grading.conventions_plan(UNLISTED, "local", features)
+    assert "not in a basic word list" in hint
+
+
+def test_inflected_forms_are_known():
+    assert all(conventions.is_known(word) for word in ("cried", "making", "running", "happily", "unhappy", "boxes"))
+    assert not conventions.is_known("becuase")
+
+
+def test_local_policy_skips_the_model_for_clear_cut_conventions(monkeypatch):
+    monkeypatch.setattr(grading, "CONVENTIONS_POLICY", "local")
+    client, completions = fake_client()
+    prompts = []
+    create = completions.create
+
+    async def record(model, messages, **kwargs):
+        prompts.append(messages)
+        return await create(model, messages, **kwargs)
+
+    completions.create = record
+    clean = asyncio.run(grading.grade_essay_async(CLEAN, client=client))
+    assert completions.calls == len(grading.categories) - 1
+    assert clean[-1] == {"type": "conventions", "grade": 4, "comments": conventions.local_comments(conventions.analyze(CLEAN))}
+
+    asyncio.run(grading.grade_essay_async(VARIED, client=client))
+    conventions_prompt = next(messages for messages in prompts if messages[-1]["content"].startswith(grading.prompt_conventions.strip()))
+    assert "Automated conventions checks" in conventions_prompt[-1]["content"]
+    assert completions.calls == 2 * len(grading.categories) - 1
+
+
+def test_llm_policy_keeps_the_original_prompt(monkeypatch):
+    monkeypatch.setattr(grading, "CONVENTIONS_POLICY", "llm")
+    assert grading.conventions_plan(CLEAN) == (None, None)
+
+
+def test_offline_batch_grades_clear_cut_conventions_locally(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_grading, "BATCH_DIR", str(tmp_path / "batches"))
+    clean = add_essay(db_session, "ana", CLEAN, graded_types=[c for c in grading.categories if c != "conventions"])
+    varied = add_essay(db_session, "ben", VARIED, graded_types=[c for c in grading.categories if c != "conventions"])
+    seen = []
+
+    def responder(body):
+        seen.append(body["messages"])
+        return {"choices": [{"message": {"content": '{"grade": 3, "comments": "Ok."}'}}]}
+
+    backend = batch_grading.LocalBatchBackend(str(tmp_path / "service"), responder=responder)
+    summary = batch_grading.run_offline_batch(backend, poll_interval=0, conventions_policy="local")
+
+    assert summary["requests"] == 1
+    assert summary["graded_locally"] == 1
+    assert "Automated conventions checks" in seen[0][-1]["content"]
+    assert [grade.grade for grade in clean.grades if grade.grade_type == "conventions"] == [4]
+    assert [grade.grade for grade in varied.grades if grade.grade_type == "conventions"] == [3]
+    assert batch_grading.pending_essays(db_session) == []
@@ -0,0 +1,61 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from sqlalchemy import func, text
+
+import database
+import main
+from test_submit_essay import upload
+
+GRADES = [{"type": "ideas", "grade": 4, "comments": "Clear idea."}, {"type": "voice", "grade": 3, "comments": "Lively."}]
+
+
+def test_sqlite_runs_in_wal_mode_with_a_busy_timeout(db_session):
+    assert db_session.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+    assert db_session.execute(text("PRAGMA busy_timeout")).scalar() == database.SQLITE_BUSY_TIMEOUT_MS
+
+
+def test_parallel_writes_and_reads_lose_no_rows(db_session):
+    def write(index):
+        pages = [{"filename": f"page_{index}.png"}]
+        return main.save_essay(f"student{index % 5}", f"Essay {index}", f"Text {index}", pages, GRADES)
+
+    def read(_):
+        session = database.SessionLocal()
+        try:
+            return len(main.get_authors(session=session)["authors"])
+        finally:
+            session.close()
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        writes = [pool.submit(write, index) for index in range(40)]
+        reads = [pool.submit(read, index) for index in range(40)]
+        essay_ids = [future.result() for future in writes]
+        author_counts = [future.result() for future in reads]
+
+    assert len(set(essay_ids)) == 40
+    assert all(0 <= count <= 5 for count in author_counts)
+    assert db_session.query(func.count(main.Author.id)).scalar() == 5
+    assert db_session.query(func.count(main.Essay.id)).scalar() == 40
+    assert db_session.query(func.count(main.EssayGrade.id)).scalar() == 80
+    assert db_session.query(func.count(database.EssayImage.id)).scalar() == 40
+
+
+def test_concurrent_submissions_through_the_api(db_session, fake_pipeline):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            submissions = [
+                client.post("/submit-essay/", params={"authorname": f"student{index % 3}", "title": f"Essay {index}"},
+                            files=upload([100]))
+                for index in range(12)
+            ]
+            reads = [client.get("/get-authors/") for _ in range(12)]
+            return await asyncio.gather(*submissions, *reads)
+
+    responses = asyncio.run(run())
+
+    assert all(response.status_code == 200 for response in responses)
+    assert db_session.query(func.count(main.Essay.id)).scalar() == 12
+    assert db_session.query(func.count(main.Author.id)).scalar() == 3
@@ -0,0 +1,132 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import grading
+
+
+class FakeCompletions:
+    """Stands in for `client.chat.completions`, tracking how many requests overlap."""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+
+    async def create(self, model, messages, **kwargs):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        content = json.dumps({"grade": 3, "comments": messages[-1]["content"][:20]})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def fake_client(delay=0.05):
+    completions = FakeCompletions(delay)
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions)), completions
+
+
+def test_grade_essay_async_runs_categories_concurrently():
+    client, completions = fake_client()
+    grades = asyncio.run(grading.grade_essay_async("An essay.", client=client))
+
+    assert [grade["type"] for grade in grades] == list(grading.categories)
+    assert all(grade["grade"] == 3 for grade in grades)
+    assert completions.calls == len(grading.categories)
+    assert completions.max_in_flight == len(grading.categories)
+
+
+def test_grade_essay_async_respects_concurrency_limit():
+    client, completions = fake_client(delay=0.01)
+    asyncio.run(grading.grade_essay_async("An essay.", max_concurrency=2, client=client))
+
+    assert completions.max_in_flight == 2
+
+
+def test_combined_mode_grades_every_category_in_one_request():
+    content = json.dumps({
+        "ideas": {"grade": 4, "comments": "Clear idea."},
+        "Organization": {"grade": 3, "comments": "Add transitions."},
+        "voice": {"grade": 5, "comments": "Lively."},
+        "Word Choice": {"grade": 2, "comments": "Vary words."},
+        "sentence_fluency": {"grade": 3, "comments": "Mix lengths."},
+    })
+    calls = []
+
+    async def create(model, messages, **kwargs):
+        calls.append(messages)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    grades = asyncio.run(grading.grade_essay_mode_async("An essay.", mode="combined", client=client))
+
+    assert len(calls) == 1
+    assert calls[0][:2] == grading.essay_prefix("An essay.")
+    assert calls[0][-1]["content"].startswith(grading.prompt_one_grader)
+    assert [grade["type"] for grade in grades] == list(grading.categories)
+    assert grades[1] == {"type": "organization", "grade": 3, "comments": "Add transitions."}
+    assert grades[3]["grade"] == 2
+    assert grades[5] == {"type": "conventions", "grade": "N/A", "comments": "N/A"}
+
+
+def test_unknown_grading_mode_is_rejected():
+    try:
+        asyncio.run(grading.grade_essay_mode_async("An essay.", mode="fastest"))
+    except ValueError as error:
+        assert "fastest" in str(error)
+    else:
+        raise AssertionError("expected ValueError")
+
+
+def test_each_category_is_reported_as_soon_as_it_is_graded():
+    client, completions = fake_client()
+    slow_create = completions.create
+
+    async def create(model, messages, **kwargs):
+        # Conventions takes much longer than the other categories
+        if messages[-1]["content"].startswith(grading.categories["conventions"].strip()):
+            await asyncio.sleep(0.3)
+        return await slow_create(model, messages, **kwargs)
+
+    completions.create = create
+    reported = []
+
+    async def run():
+        started = asyncio.get_running_loop().time()
+        grades = await grading.grade_essay_async(
+            "An essay.", client=client,
+            on_grade=lambda record: reported.append((record["type"], asyncio.get_running_loop().time() - started)))
+        return grades
+
+    grades = asyncio.run(run())
+
+    assert sorted(category for category, _ in reported) == sorted(grading.categories)
+    assert reported[-1][0] == "conventions"
+    assert reported[0][1] < 0.2 < reported[-1][1]
+    assert [grade["type"] for grade in grades] == list(grading.categories)
+
+
+def test_category_requests_share_the_essay_prefix_and_report_usage():
+    calls = []
+
+    async def create(model, messages, **kwargs):
+        calls.append(messages)
+        usage = SimpleNamespace(prompt_tokens=1200, completion_tokens=80, total_tokens=1280,
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=1024 if len(calls) > 1 else 0))
+        content = json.dumps({"grade": 3, "comments": "Ok."})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    grades = asyncio.run(grading.grade_essay_async("An essay.", max_concurrency=1, client=client, use_cache=False))
+
+    # Everything up to the category instructions is identical, so the provider can cache it
+    assert all(messages[:-1] == grading.essay_prefix("An essay.") for messages in calls)
+    assert [messages[-1]["content"].startswith(prompt.strip()) for messages, prompt in zip(calls, grading.categories.values())] == [True] * 6
+    assert grades[0]["usage"] == {"prompt_tokens": 1200, "completion_tokens": 80, "cached_tokens": 0}
+    assert grading.usage_totals(grades) == {"prompt_tokens": 7200, "completion_tokens": 480, "cached_tokens": 5120}
+
+    # A cached grade cost no tokens, so it carries no usage
+    assert grading.grade_record("ideas", {"grade": 3, "comments": "Ok."}) == {"type": "ideas", "grade": 3, "comments": "Ok."}
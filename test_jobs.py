@@ -0,0 +1,167 @@
+import os
+import asyncio
+
+import httpx
+import pytest
+
+import jobs
+import main
+from test_submit_essay import upload
+
+
+async def wait_for(store, job_id, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while asyncio.get_running_loop().time() < deadline:
+        job = store.get(job_id)
+        if job["status"] in (jobs.SUCCEEDED, jobs.FAILED):
+            return job
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+@pytest.fixture
+def job_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_UPLOAD_DIR", str(tmp_path / "job_uploads"))
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    yield store
+    store.close()
+
+
+def test_job_runs_through_stages_and_stores_its_result(job_store):
+    stages = []
+    submitted = {}
+
+    async def handler(params, set_stage):
+        for stage in ("ocr", "grading"):
+            await set_stage(stage)
+            stages.append(job_store.get(submitted["id"])["stage"])
+        return {"doubled": params["value"] * 2}
+
+    async def run():
+        queue = jobs.JobQueue(job_store, {"double": handler}, workers=2)
+        await queue.start()
+        submitted["id"] = await queue.submit("double", {"value": 21})
+        job = await wait_for(job_store, submitted["id"])
+        await queue.stop()
+        return job
+
+    job = asyncio.run(run())
+
+    assert stages == ["ocr", "grading"]
+    assert job["status"] == jobs.SUCCEEDED
+    assert job["stage"] == "done"
+    assert job["result"] == {"doubled": 42}
+
+
+def test_failed_job_records_the_error_and_removes_its_uploads(job_store):
+    async def handler(params, set_stage):
+        raise ValueError("page 2 is unreadable")
+
+    job_id = job_store.create("fail", {})
+    jobs.save_job_uploads(job_id, [("page1.png", b"png")])
+
+    async def run():
+        queue = jobs.JobQueue(job_store, {"fail": handler})
+        await queue.start()
+        job = await wait_for(job_store, job_id)
+        await queue.stop()
+        return job
+
+    job = asyncio.run(run())
+
+    assert job["status"] == jobs.FAILED
+    assert job["error"] == "page 2 is unreadable"
+    assert not os.path.exists(jobs.job_upload_dir(job_id))
+
+
+def test_a_busy_job_store_does_not_block_the_event_loop(job_store):
+    async def handler(params, set_stage):
+        return params["value"]
+
+    async def run():
+        queue = jobs.JobQueue(job_store, {"echo": handler})
+        await queue.start()
+        loop = asyncio.get_running_loop()
+        # Another writer holds the store, e.g. a process with the jobs.db lock
+        job_store._lock.acquire()
+        loop.call_later(0.3, job_store._lock.release)
+        started = loop.time()
+        submitted = asyncio.create_task(queue.submit("echo", {"value": 7}))
+        await asyncio.sleep(0.01)
+        ticked = loop.time() - started
+        job = await wait_for(job_store, await submitted)
+        await queue.stop()
+        return ticked, job
+
+    ticked, job = asyncio.run(run())
+
+    assert ticked < 0.2
+    assert job["result"] == 7
+
+
+def test_a_claimed_job_is_not_claimed_again_by_another_process(tmp_path, job_store):
+    other_store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    job_id = job_store.create("echo", {"value": 1})
+
+    try:
+        assert job_store.claim_next()["id"] == job_id
+        assert other_store.claim_next() is None
+        # A restart elsewhere leaves the job alone while its lease is live
+        assert other_store.requeue_interrupted() == 0
+        assert other_store.get(job_id)["status"] == jobs.RUNNING
+        assert other_store.renew(job_id) is False
+        assert job_store.renew(job_id) is True
+    finally:
+        other_store.close()
+
+
+def test_queued_and_interrupted_jobs_survive_a_restart(tmp_path, job_store, monkeypatch):
+    queued = job_store.create("echo", {"value": 1})
+    interrupted = job_store.create("echo", {"value": 2})
+    # The process holding the claim stops without renewing its lease
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", -1)
+    assert job_store.claim_next()["id"] == queued
+    job_store.close()
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 60)
+
+    async def handler(params, set_stage):
+        return params["value"]
+
+    async def run():
+        store = jobs.JobStore(str(tmp_path / "jobs.db"))
+        queue = jobs.JobQueue(store, {"echo": handler})
+        await queue.start()
+        finished = [await wait_for(store, job_id) for job_id in (queued, interrupted)]
+        await queue.stop()
+        store.close()
+        return finished
+
+    finished = asyncio.run(run())
+
+    assert [job["result"] for job in finished] == [1, 2]
+
+
+def test_submit_essay_job_returns_immediately_and_reports_the_result(db_session, fake_pipeline, job_store, monkeypatch):
+    monkeypatch.setattr(main, "job_queue", jobs.JobQueue(job_store, {"submit-essay": main.run_essay_job}))
+
+    async def run():
+        await main.job_queue.start()
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            submitted = await client.post("/jobs/", params={"authorname": "ana", "title": "Puerto Rico"},
+                                          files=upload([100, 200]))
+            job_id = submitted.json()["job_id"]
+            first_status = (await client.get(f"/jobs/{job_id}")).json()
+            await wait_for(job_store, job_id)
+            final_status = (await client.get(f"/jobs/{job_id}")).json()
+            missing = await client.get("/jobs/unknown")
+        await main.job_queue.stop()
+        return submitted, first_status, final_status, missing
+
+    submitted, first_status, final_status, missing = asyncio.run(run())
+
+    assert submitted.status_code == 200
+    assert first_status["status"] in (jobs.QUEUED, jobs.RUNNING)
+    assert final_status["status"] == jobs.SUCCEEDED
+    assert final_status["result"]["text"] == "page-100 page-200"
+    assert missing.status_code == 404
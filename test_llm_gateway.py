@@ -0,0 +1,189 @@
+import asyncio
+import io
+import time
+
+import httpx
+import openai
+import pytest
+from PIL import Image
+
+import grading
+import integrations
+import llm_gateway
+import main
+import rate_limit
+from rate_limit import RateLimiter
+from testing.fake_openai import FakeOpenAIServer
+from test_submit_essay import upload
+
+
+@pytest.fixture
+def fake_openai(isolated_gateway):
+    with FakeOpenAIServer(ocr_text="Puerto Rico", grade=4) as server:
+        llm_gateway.configure(base_url=server.url, api_key="test-key")
+        yield server
+    llm_gateway.close()
+
+
+def test_sync_client_is_shared_and_keeps_connections_alive(fake_openai):
+    assert llm_gateway.get_client() is integrations.get_openai_client()
+
+    for _ in range(3):
+        result = grading.single_grader("An essay.", grading.prompt_ideas, use_cache=False)
+        assert {key: result[key] for key in ("grade", "comments")} == {"grade": 4, "comments": "Add more details."}
+        # The sync path reports usage like single_grader_async
+        assert result["usage"]["prompt_tokens"] > 0
+
+    assert len(fake_openai.requests) == 3
+    assert fake_openai.connections == 1
+
+
+def test_ocr_goes_through_gateway(fake_openai, tmp_path):
+    image_path = tmp_path / "page.png"
+    Image.new("L", (40, 20), color=255).save(image_path)
+
+    assert integrations.read_text_in_image(str(image_path)) == "Puerto Rico"
+    assert fake_openai.requests[0]["messages"][0]["content"][1]["type"] == "image_url"
+
+
+def test_async_client_is_shared_per_event_loop(fake_openai):
+    async def run():
+        assert llm_gateway.get_async_client() is llm_gateway.get_async_client()
+        first = await grading.grade_essay_async("An essay.")
+        second = await grading.grade_essay_mode_async("An essay.", mode="combined")
+        await llm_gateway.aclose()
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert [grade["grade"] for grade in first + second] == [4] * 12
+    assert len(fake_openai.requests) == 7
+    assert fake_openai.connections <= len(grading.categories)
+
+
+def test_pages_share_one_vision_request_and_are_split_back(fake_openai):
+    pages = []
+    for width in (40, 50, 60):
+        image = Image.new("L", (width, 20), color=255)
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        pages.append((buffer.getvalue(), "image/png"))
+
+    async def run():
+        texts = await integrations.read_text_in_images_async(pages)
+        # Each page was cached on its own, so reading them again needs no request
+        again = await integrations.read_text_in_images_async(pages)
+        single = await integrations.read_text_in_image_async(*pages[1])
+        await llm_gateway.aclose()
+        return texts, again, single
+
+    texts, again, single = asyncio.run(run())
+
+    assert texts == again == ["Puerto Rico"] * 3
+    assert single == "Puerto Rico"
+    assert len(fake_openai.requests) == 1
+    content = fake_openai.requests[0]["messages"][0]["content"]
+    assert [part["type"] for part in content].count("image_url") == 3
+    assert content[1] == {"type": "text", "text": "Page 1:"}
+
+
+def test_split_pages_needs_every_marker_in_order():
+    text = "=== PAGE 1 ===\nFirst page\n\n=== PAGE 2 ===\nSecond\npage"
+
+    assert integrations.split_pages(text, 2) == ["First page", "Second\npage"]
+    assert integrations.split_pages(text, 3) is None
+    assert integrations.split_pages("=== PAGE 2 ===\nA\n=== PAGE 1 ===\nB", 2) is None
+    assert integrations.split_pages("no markers", 1) is None
+
+
+def test_essay_goes_through_the_fake_server_despite_rate_limits(db_session, sample_essay, isolated_gateway):
+    with FakeOpenAIServer(ocr_text=sample_essay, grade=4, rate_limited_first=1, retry_after=0.01) as server:
+        llm_gateway.configure(base_url=server.url, api_key="test-key")
+
+        async def run():
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                response = await client.post("/submit-essay/", params={"authorname": "ana", "title": "Puerto Rico", "use_cache": False},
+                                             files=upload([300]))
+            await llm_gateway.aclose()
+            return response
+
+        response = asyncio.run(run())
+    llm_gateway.close()
+
+    assert response.status_code == 200
+    assert response.json()["text"] == sample_essay
+    assert [grade["grade"] for grade in response.json()["grades"]] == [4] * len(grading.categories)
+    # The rate-limited request was retried
+    assert server.statuses[429] == 1
+    assert server.statuses[200] == 1 + len(grading.categories)
+
+
+def test_limiter_retries_only_the_rate_limited_requests(monkeypatch, isolated_gateway):
+    monkeypatch.setattr(rate_limit, "LLM_RETRY_BASE_DELAY", 0.01)
+    limiter = RateLimiter(max_concurrency=4)
+
+    with FakeOpenAIServer(grade=4, rate_limited_first=2, retry_after=0.01) as server:
+        llm_gateway.configure(base_url=server.url, api_key="test-key")
+
+        async def grade(category: str):
+            client = llm_gateway.get_async_client()
+
+            async def send():
+                return await client.chat.completions.create(model="gpt-4o", messages=grading.grader_messages("An essay.", grading.categories[category]),
+                                                            response_format={"type": "json_object"})
+
+            return grading.parse_grader_response(await limiter.call(send, 100))
+
+        async def run():
+            results = await asyncio.gather(*(grade(category) for category in ["ideas", "voice", "organization", "word_choice"]))
+            await llm_gateway.aclose()
+            return results
+
+        results = asyncio.run(run())
+    llm_gateway.close()
+
+    assert results == [{"grade": 4, "comments": "Add more details."}] * 4
+    assert server.statuses == {429: 2, 200: 4}
+    assert limiter.stats["retries"] == limiter.stats["rate_limited"] == 2
+    # Both 429s came from the same burst, so the limit was halved once and has been growing back since
+    assert 2 < limiter.limit < 4
+
+
+def test_limiter_gives_up_after_max_retries_and_on_errors_retrying_cannot_fix(monkeypatch, isolated_gateway):
+    monkeypatch.setattr(rate_limit, "LLM_RETRY_BASE_DELAY", 0.01)
+    limiter = RateLimiter(max_retries=2)
+
+    with FakeOpenAIServer(error_rate=1.0) as server:
+        llm_gateway.configure(base_url=server.url, api_key="test-key")
+        client = llm_gateway.get_client()
+        with pytest.raises(openai.InternalServerError):
+            limiter.call_sync(lambda: client.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "Hi"}]), 10)
+    llm_gateway.close()
+
+    assert len(server.requests) == 3
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise ValueError("not a model error")
+
+    with pytest.raises(ValueError):
+        limiter.call_sync(broken, 10)
+    assert calls == [1]
+
+
+def test_provider_headers_tighten_the_budgets():
+    limiter = RateLimiter(tokens_per_minute=10_000, requests_per_minute=500)
+    limiter.observe({
+        "x-ratelimit-limit-requests": "60", "x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "1.5s",
+        "x-ratelimit-limit-tokens": "90000", "x-ratelimit-remaining-tokens": "200", "x-ratelimit-reset-tokens": "6m0s",
+    })
+
+    assert limiter.request_bucket.capacity == 60
+    # A higher account limit than configured does not raise the budget, but its lower remaining count drains it
+    assert limiter.bucket.capacity == 10_000
+    assert limiter.bucket.available <= 200
+    assert limiter.paused_until - time.monotonic() == pytest.approx(1.5, abs=0.1)
+    assert rate_limit.parse_duration("20ms") == 0.02
+    assert rate_limit.retry_after({"retry-after": "2"}) == 2
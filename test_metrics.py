@@ -0,0 +1,95 @@
+import asyncio
+import json
+import logging
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import grading
+import main
+import metrics
+from test_submit_essay import upload
+
+
+def test_histograms_render_cumulative_buckets_with_escaped_labels():
+    histogram = metrics.Histogram("test_seconds", "Test latencies.", ("stage",), buckets=(0.1, 1))
+    metrics.registry.remove(histogram)
+    for value in (0.05, 0.5, 0.7, 3):
+        histogram.observe(value, stage='say "hi"')
+
+    lines = histogram.render().splitlines()
+
+    assert lines[:2] == ["# HELP test_seconds Test latencies.", "# TYPE test_seconds histogram"]
+    assert lines[2:] == [
+        'test_seconds_bucket{stage="say \\"hi\\"",le="0.1"} 1',
+        'test_seconds_bucket{stage="say \\"hi\\"",le="1"} 3',
+        'test_seconds_bucket{stage="say \\"hi\\"",le="+Inf"} 4',
+        'test_seconds_sum{stage="say \\"hi\\""} 4.25',
+        'test_seconds_count{stage="say \\"hi\\""} 4',
+    ]
+
+
+def test_a_metric_without_samples_fails_when_created():
+    class Unrendered(metrics.Metric):
+        pass
+
+    with pytest.raises(TypeError, match="samples"):
+        Unrendered("unrendered", "Has no samples.")
+    assert all(metric.name != "unrendered" for metric in metrics.registry)
+
+
+def test_model_calls_count_tokens_cost_and_errors():
+    tokens_before = metrics.model_tokens.value(model=grading.GRADING_MODEL, type="cached")
+    cost_before = metrics.model_cost.value(model=grading.GRADING_MODEL)
+    errors_before = metrics.model_errors.value(model=grading.GRADING_MODEL, kind="grading", error="TimeoutError")
+    calls = []
+
+    async def create(model, messages, **kwargs):
+        calls.append(messages)
+        if len(calls) == 2:
+            raise TimeoutError("slow")
+        usage = SimpleNamespace(prompt_tokens=2000, completion_tokens=100, total_tokens=2100,
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=1024))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='{"grade": 3, "comments": "Ok."}'))], usage=usage)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    asyncio.run(grading.single_grader_async("An essay.", grading.prompt_ideas, client=client, use_cache=False))
+    with pytest.raises(TimeoutError):
+        asyncio.run(grading.single_grader_async("An essay.", grading.prompt_voice, client=client, use_cache=False))
+
+    assert metrics.model_tokens.value(model=grading.GRADING_MODEL, type="cached") - tokens_before == 1024
+    # 976 full-price and 1024 cached prompt tokens plus 100 completion tokens
+    assert metrics.model_cost.value(model=grading.GRADING_MODEL) - cost_before == pytest.approx((976 * 2.5 + 1024 * 1.25 + 100 * 10) / 1e6)
+    assert metrics.model_errors.value(model=grading.GRADING_MODEL, kind="grading", error="TimeoutError") - errors_before == 1
+
+
+def test_each_essay_is_timed_by_stage_and_logged(db_session, fake_pipeline, caplog):
+    ocr_before = metrics.stage_seconds.count(stage="ocr")
+    metrics.timing_logger.addHandler(caplog.handler)
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            submitted = await client.post("/submit-essay/", params={"authorname": "ana", "title": "Puerto Rico"}, files=upload([100, 200]))
+            return submitted, await client.get("/metrics")
+
+    try:
+        with caplog.at_level(logging.INFO, logger=metrics.timing_logger.name):
+            submitted, scraped = asyncio.run(run())
+    finally:
+        metrics.timing_logger.removeHandler(caplog.handler)
+
+    assert submitted.status_code == 200
+    assert metrics.stage_seconds.count(stage="ocr") == ocr_before + 1
+    assert scraped.headers["content-type"].startswith("text/plain")
+    assert 'essay_stage_seconds_count{stage="saving"}' in scraped.text
+    assert 'pages_total{tier="vision"}' in scraped.text
+    assert 'llm_requests{state="in_flight"} 0' in scraped.text
+    assert 'jobs{status="queued"}' in scraped.text
+    logged = json.loads(caplog.records[-1].getMessage())
+    assert logged["event"] == "essay_timings"
+    assert logged["status"] == "succeeded"
+    assert logged["essay_id"] == submitted.json()["essay_id"]
+    assert set(logged["stages"]) == {"ocr", "grading", "saving"}
+    assert set(logged["categories"]) == {"ideas"}
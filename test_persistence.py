@@ -0,0 +1,108 @@
+import asyncio
+
+from sqlalchemy import func
+
+import database
+import main
+import persistence
+from benchmarks.bench_ingest import CommitCounter, essay_records
+
+
+def test_save_essay_commits_once(db_session):
+    engine = db_session.get_bind()
+    records = essay_records(3, authors=2)
+
+    with CommitCounter(engine) as commits:
+        essay_ids = [persistence.save_essay(*record) for record in records]
+
+    assert commits.count == 3
+    essay = db_session.get(main.Essay, essay_ids[0])
+    assert essay.author.authorname == "student0"
+    assert len(essay.images) == 2
+    assert len(essay.grades) == 6
+
+
+def test_essay_writer_groups_concurrent_essays_into_one_commit(db_session):
+    engine = db_session.get_bind()
+    records = essay_records(12, authors=4)
+
+    async def run():
+        writer = persistence.EssayWriter(max_batch=5, max_delay=0.05)
+        essay_ids = await asyncio.gather(*(writer.save(*record) for record in records))
+        return writer, essay_ids
+
+    with CommitCounter(engine) as commits:
+        writer, essay_ids = asyncio.run(run())
+
+    assert len(set(essay_ids)) == 12
+    assert commits.count == writer.commits == 3
+    assert db_session.query(func.count(main.Author.id)).scalar() == 4
+    assert db_session.query(func.count(main.EssayGrade.id)).scalar() == 72
+    titles = {essay_id: db_session.get(main.Essay, essay_id).title for essay_id in essay_ids}
+    assert [titles[essay_id] for essay_id in essay_ids] == [record[1] for record in records]
+
+
+def test_bad_essay_fails_alone_and_its_batch_is_written_without_it(db_session):
+    records = essay_records(3, authors=3)
+    # A malformed model response: the grade has no comments
+    records[1] = (*records[1][:4], [{"type": "ideas", "grade": 4}])
+
+    async def run():
+        writer = persistence.EssayWriter(max_batch=3, max_delay=0.05)
+        return writer, await asyncio.gather(*(writer.save(*record) for record in records), return_exceptions=True)
+
+    writer, results = asyncio.run(run())
+
+    assert isinstance(results[1], Exception)
+    assert all(isinstance(essay_id, int) for essay_id in (results[0], results[2]))
+    assert writer.essays == writer.commits == 2
+    assert [db_session.get(main.Essay, essay_id).title for essay_id in (results[0], results[2])] == [records[0][1], records[2][1]]
+    assert db_session.query(func.count(main.Essay.id)).scalar() == 2
+
+
+def test_grade_usage_is_stored_with_each_grade(db_session):
+    usage = {"prompt_tokens": 1200, "completion_tokens": 80, "cached_tokens": 1024}
+    grades = [{"type": "ideas", "grade": 4, "comments": "Clear idea.", "usage": usage},
+              {"type": "voice", "grade": 3, "comments": "Cached."}]
+    essay_id = persistence.save_essay("ana", "Puerto Rico", "I visited Puerto Rico.", [], grades)
+
+    essay = main.get_essay(essay_id, session=db_session)
+
+    assert essay["grades"][0]["usage"] == usage
+    assert "usage" not in essay["grades"][1]
+    assert essay["usage"] == usage
+
+
+def test_author_grade_stats_follow_every_grade(db_session):
+    for number, grade in enumerate([2, 3, 4, 5]):
+        grades = [{"type": "ideas", "grade": grade, "comments": "Ok."}, {"type": "voice", "grade": 3, "comments": "Ok."}]
+        persistence.save_essay("ana", f"Essay {number}", "Text.", [], grades)
+
+    summary = main.get_author_summary("ana", session=db_session)
+
+    assert summary["graded_essays"] == 4
+    assert summary["categories"] == [
+        {"type": "ideas", "count": 4, "mean": 3.5, "latest": 5, "trend": 1.0},
+        {"type": "voice", "count": 4, "mean": 3.0, "latest": 3, "trend": 0.0},
+    ]
+
+    # Rebuilding from the stored grades gives the same aggregates
+    with database.write_session() as session:
+        assert persistence.rebuild_grade_stats(session) == 2
+    db_session.expire_all()
+    assert main.get_author_summary("ana", session=db_session) == summary
+
+
+def test_grades_are_counted_as_stored(db_session):
+    grades = [{"type": "ideas", "grade": "4", "comments": "Ok."}, {"type": "voice", "grade": "N/A", "comments": "N/A"}]
+    essay_id = persistence.save_essay("ana", "Puerto Rico", "Text.", [], grades)
+
+    stored = {grade.grade_type: grade.grade for grade in db_session.get(main.Essay, essay_id).grades}
+    summary = main.get_author_summary("ana", session=db_session)
+
+    assert stored == {"ideas": 4.0, "voice": None}
+    assert [(row["type"], row["count"], row["mean"]) for row in summary["categories"]] == [("ideas", 1, 4.0)]
+    with database.write_session() as session:
+        persistence.rebuild_grade_stats(session)
+    db_session.expire_all()
+    assert main.get_author_summary("ana", session=db_session) == summary
@@ -0,0 +1,45 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import cv2
+import numpy as np
+
+import preprocessing
+from testing.synthetic_pages import synthetic_page, encode_png
+
+
+def test_deskew_recovers_the_page_angle():
+    for angle in (-6, 0, 4.5):
+        binary = preprocessing.binarize(preprocessing.downscale(synthetic_page(angle=angle), 1600))
+        # Rotating by the found angle undoes the page's rotation
+        assert abs(preprocessing.skew_angle(binary) + angle) <= 0.3
+
+
+def test_crop_keeps_the_text_and_drops_the_margins():
+    page = synthetic_page(margin=500)
+    uncropped, _ = preprocessing.prepare_page(encode_png(page), max_side=1600, crop=False)
+    cropped, mime_type = preprocessing.prepare_page(encode_png(page), max_side=1600)
+    image = cv2.imdecode(np.frombuffer(cropped, np.uint8), cv2.IMREAD_GRAYSCALE)
+
+    assert mime_type == "image/png"
+    assert image.shape[0] < 1600 * 0.8
+    assert len(cropped) < len(uncropped)
+    # Ink reaches close to every edge of the crop, but not into the margin
+    ink = image < 128
+    assert ink[:, :preprocessing.PREPROCESS_CROP_MARGIN - 2].sum() == 0
+    assert ink[:preprocessing.PREPROCESS_CROP_MARGIN + 40].any()
+
+
+def test_blank_page_is_left_uncropped():
+    blank = np.full((800, 600), 240, dtype=np.uint8)
+    page_bytes, _ = preprocessing.prepare_page(encode_png(blank), deskew=True, crop=True)
+
+    assert cv2.imdecode(np.frombuffer(page_bytes, np.uint8), cv2.IMREAD_GRAYSCALE).shape == (800, 600)
+
+
+def test_prepare_pages_spreads_pages_over_processes_in_order():
+    pages = [encode_png(synthetic_page(width=600 + 100 * index, height=800, margin=60, lines=8, seed=index)) for index in range(4)]
+    with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn")) as pool:
+        results = preprocessing.prepare_pages(pages, pool=pool)
+
+    assert results == [preprocessing.page_task()(page) for page in pages]
@@ -0,0 +1,70 @@
+from sqlalchemy import create_engine, inspect, text
+
+import database
+import main
+import persistence
+from benchmarks.bench_read_path import QueryCounter, seed_database
+
+
+def test_get_authors_pages_with_a_constant_number_of_queries(db_session):
+    engine = db_session.get_bind()
+    seed_database(engine, authors=25, essays_per_author=3)
+
+    pages, cursor = [], None
+    with QueryCounter(engine) as counter:
+        while True:
+            page = main.get_authors(cursor=cursor, limit=10, session=db_session)
+            pages.append(page["authors"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert [author["authorname"] for author in pages[1]][:2] == ["student11", "student12"]
+    assert len(pages[2][0]["essays"]) == 3
+    assert counter.count == 2 * len(pages)
+
+
+def test_get_author_grades_loads_relationships_eagerly(db_session):
+    engine = db_session.get_bind()
+    seed_database(engine, authors=3, essays_per_author=12)
+
+    with QueryCounter(engine) as counter:
+        first = main.get_author_grades("student2", limit=8, session=db_session)
+        second = main.get_author_grades("student2", cursor=first["next_cursor"], limit=8, session=db_session)
+
+    assert len(first["essays"]) == 8
+    assert len(second["essays"]) == 4
+    assert second["next_cursor"] is None
+    assert all(len(essay["grades"]) == 6 and len(essay["images"]) == 2 for essay in first["essays"] + second["essays"])
+    # Author, essays, grades and images: four queries per page no matter how many essays
+    assert counter.count == 8
+
+
+def test_migrate_schema_adds_missing_indexes(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE essays (id INTEGER PRIMARY KEY, author_id INTEGER, title VARCHAR, text TEXT, date_submitted VARCHAR)"))
+
+    main.migrate_schema(engine)
+
+    indexed = {column for index in inspect(engine).get_indexes("essays") for column in index["column_names"]}
+    assert "author_id" in indexed
+    assert inspect(engine).get_indexes("essay_grades")[0]["column_names"] == ["essay_id"]
+
+
+def test_author_summary_costs_the_same_for_3_or_300_essays(db_session):
+    engine = db_session.get_bind()
+    seed_database(engine, authors=2, essays_per_author=300)
+    with database.write_session() as session:
+        persistence.rebuild_grade_stats(session)
+    few = persistence.save_essay("newcomer", "First", "Text.", [], [{"type": "ideas", "grade": 4, "comments": "Ok."}])
+
+    counts = []
+    for authorname in ("student1", db_session.get(main.Essay, few).author.authorname):
+        with QueryCounter(engine) as counter:
+            summary = main.get_author_summary(authorname, session=db_session)
+        counts.append(counter.count)
+
+    assert counts == [2, 2]
+    assert summary["categories"] == [{"type": "ideas", "count": 1, "mean": 4.0, "latest": 4, "trend": 0.0}]
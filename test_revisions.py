@@ -0,0 +1,127 @@
+import asyncio
+import random
+import sqlite3
+
+import httpx
+from sqlalchemy import text
+
+import database
+import main
+import persistence
+import revisions
+from persistence import save_essay
+
+WORDS = "the island people live there storm coast market school family music river morning town boat".split()
+ESSAY = " ".join(f"Sentence {index} about " + " ".join(random.Random(index).choices(WORDS, k=12)) + "." for index in range(200))
+GRADES = [{"type": "ideas", "grade": 3, "comments": "Needs detail."}]
+
+
+def revise(essay_text, index):
+    return essay_text.replace(f"Sentence {index} about", f"Sentence {index}, revised, about")
+
+
+def test_revision_is_stored_as_a_small_delta_and_reads_back_exactly():
+    revised = revise(ESSAY, 7) + "\n\nA new closing paragraph."
+    encoding, data = revisions.encode_text(revised, parent_text=ESSAY, revision=2)
+
+    assert encoding == revisions.DELTA
+    assert len(data) < len(revisions.encode_text(revised)[1]) / 10
+    assert revisions.decode_text(encoding, data, ESSAY) == revised
+
+
+def test_snapshot_interval_bounds_the_delta_chain():
+    assert revisions.encode_text(ESSAY, parent_text=ESSAY, revision=revisions.REVISION_SNAPSHOT_INTERVAL)[0] == revisions.ZLIB
+    assert revisions.encode_text(ESSAY)[0] == revisions.ZLIB
+
+
+def test_same_title_is_not_linked_unless_title_linking_is_enabled(db_session):
+    first = save_essay("ana", "Untitled", ESSAY, [], GRADES)
+    second = save_essay("ana", "Untitled", "A different essay.", [], GRADES)
+
+    revised = save_essay("ana", "Untitled", revise(ESSAY, 1), [], GRADES, parent_id=first)
+
+    assert (db_session.get(main.Essay, second).parent_id, db_session.get(main.Essay, second).revision) == (None, 1)
+    # An explicit parent still makes a revision
+    assert (db_session.get(main.Essay, revised).parent_id, db_session.get(main.Essay, revised).revision) == (first, 2)
+
+
+def test_resubmitted_title_becomes_a_revision_with_a_grade_history(db_session, monkeypatch):
+    monkeypatch.setattr(persistence, "REVISION_LINK_BY_TITLE", True)
+    texts = [ESSAY]
+    for index in range(1, 4):
+        texts.append(revise(texts[-1], index))
+    essay_ids = [save_essay("ana", "Puerto Rico", essay_text, [], [{**GRADES[0], "grade": grade}])
+                 for grade, essay_text in enumerate(texts, start=1)]
+    other_id = save_essay("ana", "Another title", ESSAY, [], GRADES)
+
+    essays = [db_session.get(main.Essay, essay_id) for essay_id in essay_ids]
+    assert [essay.revision for essay in essays] == [1, 2, 3, 4]
+    assert [essay.parent_id for essay in essays] == [None] + essay_ids[:-1]
+    assert [essay.text_encoding for essay in essays] == [revisions.ZLIB] + [revisions.DELTA] * 3
+    assert [essay.text for essay in essays] == texts
+    assert db_session.get(main.Essay, other_id).parent_id is None
+
+    history = main.get_essay_history(essay_ids[2], session=db_session)
+    assert history["root_id"] == essay_ids[0]
+    assert [revision["id"] for revision in history["revisions"]] == essay_ids
+    assert [revision["grades"][0]["grade"] for revision in history["revisions"]] == [1, 2, 3, 4]
+
+
+def test_history_and_text_free_listings_do_not_load_essay_texts(db_session):
+    first = save_essay("ana", "Puerto Rico", ESSAY, [], GRADES)
+    save_essay("ana", "Puerto Rico", revise(ESSAY, 1), [], GRADES, parent_id=first)
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    database.event.listen(database.engine, "before_cursor_execute", record)
+    try:
+        session = database.SessionLocal()
+        main.get_essay_history(first, session=session)
+        listing = main.get_author_grades("ana", include_text=False, session=session)
+        session.close()
+    finally:
+        database.event.remove(database.engine, "before_cursor_execute", record)
+
+    assert all("essays.text_data" not in statement and "essays.text AS" not in statement for statement in statements)
+    assert all("text" not in essay for essay in listing["essays"])
+    assert [essay["revision"] for essay in listing["essays"]] == [1, 2]
+
+
+def test_unknown_parent_is_rejected_before_ocr(db_session, fake_pipeline):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/submit-essay/", params={"authorname": "ana", "title": "Puerto Rico", "parent_id": 99},
+                                     files=[("files", ("page.png", b"", "image/png"))])
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 404
+    assert fake_pipeline["max"] == 0
+
+
+def test_migration_adds_revision_columns_to_an_existing_database(tmp_path):
+    path = tmp_path / "old.db"
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE authors (id INTEGER PRIMARY KEY, authorname VARCHAR UNIQUE, name VARCHAR);
+        CREATE TABLE essays (id INTEGER PRIMARY KEY, author_id INTEGER, title VARCHAR, text TEXT, date_submitted VARCHAR);
+        INSERT INTO authors (id, authorname) VALUES (1, 'ana');
+        INSERT INTO essays (id, author_id, title, text) VALUES (1, 1, 'Puerto Rico', 'Old plain text.');
+    """)
+    connection.close()
+
+    engine = database.create_db_engine(f"sqlite:///{path}")
+    database.migrate_schema(engine)
+    session = database.sessionmaker(bind=engine)()
+    try:
+        essay = session.get(database.Essay, 1)
+        assert essay.text == "Old plain text."
+        assert essay.revision is None
+        columns = {row[1] for row in session.execute(text("PRAGMA table_info(essays)"))}
+        assert {"parent_id", "root_id", "revision", "text_encoding", "text_data"} <= columns
+    finally:
+        session.close()
+        engine.dispose()
@@ -0,0 +1,208 @@
+import asyncio
+import io
+import json
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import httpx
+import pytest
+from PIL import Image
+
+import main
+import preprocessing
+from conftest import GRADES
+
+
+def page(width):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, 60), color=(255, 255, 255)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def upload(widths):
+    return [("files", (f"page_{i + 1}.png", page(width), "image/png")) for i, width in enumerate(widths)]
+
+
+def test_pages_are_ocred_concurrently_in_upload_order(db_session, fake_pipeline):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            started = time.perf_counter()
+            response = await client.post("/submit-essay/", params={"authorname": "ana", "title": "Puerto Rico"},
+                                         files=upload([100, 200, 300, 400]))
+            return response, time.perf_counter() - started
+
+    response, elapsed = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert response.json()["text"] == "page-100 page-200 page-300 page-400"
+    assert response.json()["grades"] == GRADES
+    assert fake_pipeline["max"] == 4
+    assert elapsed < 1.0
+    assert [page["filename"] for page in response.json()["pages"]] == ["page_1.png", "page_2.png", "page_3.png", "page_4.png"]
+
+
+def test_other_endpoints_stay_responsive_during_upload(db_session, fake_pipeline):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            submit = asyncio.create_task(client.post(
+                "/submit-essay/", params={"authorname": "ana", "title": "Puerto Rico"}, files=upload([100] * 6)))
+            await asyncio.sleep(0.05)
+            started = time.perf_counter()
+            authors = await client.get("/get-authors/")
+            authors_elapsed = time.perf_counter() - started
+            return authors, authors_elapsed, submit.done(), await submit
+
+    authors, authors_elapsed, submit_done, submitted = asyncio.run(run())
+
+    assert authors.status_code == 200
+    assert authors_elapsed < 0.2
+    assert not submit_done
+    assert submitted.status_code == 200
+
+
+def test_pages_are_downscaled_and_sent_with_the_smallest_encoding(monkeypatch):
+    monkeypatch.setattr(preprocessing, "OCR_MAX_SIDE", 1000)
+    image = Image.new("RGB", (2400, 3000), color=(250, 250, 245))
+    for row in range(200, 2800, 120):
+        image.paste((20, 20, 60), (150, row, 2200, row + 12))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+
+    page_bytes, mime_type = preprocessing.page_task()(buffer.getvalue())
+    encoded = Image.open(io.BytesIO(page_bytes))
+
+    assert max(encoded.size) <= 1000
+    assert mime_type == "image/png"
+    assert encoded.mode == "1"
+    assert len(page_bytes) < len(buffer.getvalue()) / 10
+
+
+def test_offline_mode_saves_the_essay_without_grading(db_session, fake_pipeline):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/submit-essay/", params={"authorname": "ana", "title": "Puerto Rico", "mode": "offline"},
+                                     files=upload([100]))
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert response.json()["grades"] == []
+    essay = db_session.get(main.Essay, response.json()["essay_id"])
+    assert essay.text == "page-100"
+    assert essay.grades == []
+
+
+def test_stream_sends_text_then_each_grade_then_the_result(db_session, fake_pipeline):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/submit-essay/stream", params={"authorname": "ana", "title": "Puerto Rico"},
+                                     files=upload([100, 200]))
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    assert [event for event, _ in events] == ["stage", "text", "conventions", "stage", "grade", "stage", "result"]
+    assert events[1][1] == {"text": "page-100 page-200"}
+    assert events[2][1]["words"] == 2
+    assert events[4][1] == GRADES[0]
+    assert db_session.get(main.Essay, events[-1][1]["essay_id"]).text == "page-100 page-200"
+
+
+def test_escalated_pages_are_tiled_into_shared_vision_requests(db_session, fake_pipeline, monkeypatch):
+    groups = []
+
+    async def read_texts(pages, use_cache=True):
+        groups.append(len(pages))
+        return [f"page-{Image.open(io.BytesIO(image_bytes)).width}" for image_bytes, _ in pages]
+
+    monkeypatch.setattr(main, "OCR_PAGES_PER_REQUEST", 3)
+    monkeypatch.setattr(main, "read_text_in_images_async", read_texts)
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/submit-essay/", params={"authorname": "ana", "title": "Puerto Rico"},
+                                     files=upload([100, 200, 300, 400]))
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert response.json()["text"] == "page-100 page-200 page-300 page-400"
+    # Three pages share one request, the fourth goes on its own
+    assert groups == [3]
+    assert fake_pipeline["calls"] == 1
+    essay = db_session.get(main.Essay, response.json()["essay_id"])
+    assert [image.image_path for image in essay.images] == ["page_1.png", "page_2.png", "page_3.png", "page_4.png"]
+    assert all(page["bytes_sent"] > 0 for page in response.json()["pages"])
+
+
+def test_pdf_pages_are_rendered_one_at_a_time_and_read_in_order(db_session, fake_pipeline, monkeypatch):
+    spooled, rendered, alive = [], [], {"now": 0, "max": 0}
+
+    def page_count(pdf_path):
+        spooled.append(pdf_path)
+        assert open(pdf_path, "rb").read().startswith(b"%PDF-")
+        return 5
+
+    def render(pdf_path, page_number):
+        rendered.append(page_number)
+        alive["now"] += 1
+        alive["max"] = max(alive["max"], alive["now"])
+        return page(100 + page_number)
+
+    read_page_locally = main.read_page_locally
+
+    async def read_locally(filename, image_data):
+        try:
+            return await read_page_locally(filename, image_data)
+        finally:
+            if "#page=" in filename:
+                alive["now"] -= 1
+
+    monkeypatch.setattr(main, "pdf_page_count", page_count)
+    monkeypatch.setattr(main, "render_pdf_page", render)
+    monkeypatch.setattr(main, "read_page_locally", read_locally)
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            files = [("files", ("packet.pdf", b"%PDF-1.4 scanned packet", "application/pdf"))] + upload([200])
+            return await client.post("/submit-essay/", params={"authorname": "ana", "title": "Puerto Rico"}, files=files)
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert response.json()["text"] == "page-101 page-102 page-103 page-104 page-105 page-200"
+    assert [page["filename"] for page in response.json()["pages"]] == [f"packet.pdf#page={number}" for number in range(1, 6)] + ["page_1.png"]
+    assert rendered == [1, 2, 3, 4, 5]
+    # One page waiting for a slot on top of the pages being preprocessed
+    assert alive["max"] <= main.PDF_PAGES_IN_FLIGHT + 1
+    assert not os.path.exists(spooled[0])
+
+
+def test_a_broken_preprocessing_pool_is_replaced(monkeypatch):
+    monkeypatch.setattr(preprocessing, "PREPROCESS_PROCESSES", 1)
+    preprocessing.shutdown_pool()
+    broken = preprocessing.preprocess_pool()
+    # A worker dying, e.g. killed for memory, breaks the whole pool
+    with pytest.raises(BrokenProcessPool):
+        broken.submit(os._exit, 1).result()
+
+    try:
+        result = asyncio.run(main.read_page_locally("page1.png", page(300)))
+        replacement = preprocessing.preprocess_pool()
+    finally:
+        preprocessing.shutdown_pool()
+
+    assert result["mime_type"] in ("image/png", "image/jpeg")
+    assert replacement is not broken
@@ -0,0 +1,80 @@
+import asyncio
+import io
+
+import httpx
+from PIL import Image
+
+import main
+import tiered_ocr
+from test_submit_essay import upload
+
+
+def tesseract_data(words):
+    """`image_to_data` output for (word, confidence, block, paragraph, line) tuples, with a non-word row first."""
+    rows = [("", -1, 1, 0, 0)] + list(words)
+    return {
+        "text": [row[0] for row in rows],
+        "conf": [row[1] for row in rows],
+        "block_num": [row[2] for row in rows],
+        "par_num": [row[3] for row in rows],
+        "line_num": [row[4] for row in rows],
+    }
+
+
+def test_transcription_keeps_lines_and_paragraphs_and_scores_confidence():
+    data = tesseract_data([("Puerto", 96, 1, 1, 1), ("Rico", 94, 1, 1, 1), ("I", 91, 1, 2, 1), ("visited", 40, 1, 2, 1),
+                           ("in", 95, 1, 2, 2), ("2015", 90, 1, 2, 2)])
+
+    transcription = tiered_ocr.transcription_from_data(data)
+
+    assert transcription["text"] == "Puerto Rico\n\nI visited\nin 2015"
+    assert transcription["words"] == 6
+    assert round(transcription["mean_confidence"], 1) == 84.3
+    assert transcription["uncertain_ratio"] == 1 / 6
+
+
+def test_thresholds_decide_escalation(monkeypatch):
+    confident = {"text": "x", "words": 40, "mean_confidence": 92.0, "uncertain_ratio": 0.02}
+
+    assert tiered_ocr.accept_local(confident)
+    assert not tiered_ocr.accept_local(None)
+    assert not tiered_ocr.accept_local({**confident, "words": 2})
+    assert not tiered_ocr.accept_local({**confident, "uncertain_ratio": 0.3})
+    monkeypatch.setattr(tiered_ocr, "OCR_MIN_MEAN_CONFIDENCE", 95)
+    assert not tiered_ocr.accept_local(confident)
+
+
+def test_without_tesseract_every_page_is_escalated(monkeypatch):
+    monkeypatch.setattr(tiered_ocr, "tesseract_available", lambda: False)
+    buffer = io.BytesIO()
+    Image.new("L", (50, 50), color=255).save(buffer, format="PNG")
+
+    assert tiered_ocr.local_transcription(buffer.getvalue()) is None
+
+
+def test_only_low_confidence_pages_reach_the_vision_model(db_session, fake_pipeline, monkeypatch):
+    def local(page_bytes):
+        # The 100px page is typed and reads cleanly, the 200px page is handwriting
+        if Image.open(io.BytesIO(page_bytes)).width == 100:
+            return {"text": "typed page", "words": 30, "mean_confidence": 95.0, "uncertain_ratio": 0.0}
+        return {"text": "h3ndwr1t", "words": 4, "mean_confidence": 41.0, "uncertain_ratio": 0.8}
+
+    monkeypatch.setattr(main, "local_transcription", local)
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/submit-essay/", params={"authorname": "ana", "title": "Puerto Rico"},
+                                     files=upload([100, 200]))
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert response.json()["text"] == "typed page page-200"
+    assert fake_pipeline["calls"] == 1
+    pages = response.json()["pages"]
+    assert [page["ocr_tier"] for page in pages] == ["tesseract", "vision"]
+    assert [page["ocr_confidence"] for page in pages] == [95.0, 41.0]
+    assert pages[0]["bytes_sent"] == 0
+    essay = db_session.get(main.Essay, response.json()["essay_id"])
+    assert [image.ocr_tier for image in essay.images] == ["tesseract", "vision"]
@@ -0,0 +1,183 @@
+"""A minimal OpenAI-compatible stand-in server for local testing.
+
+It answers `POST /v1/chat/completions` with canned responses: vision requests get
+`ocr_text` back (once per page, under page markers, when a request holds several
+images), JSON grading requests get a grade for one category or, for the combined
+rubric prompt, for every category.
+
+Responses take `latency` seconds plus up to `jitter` more. A share `error_rate` of
+requests fail with 500 and a share `rate_limit_rate` with 429 and a Retry-After of
+`retry_after` seconds, as do the first `rate_limited_first` requests and any request
+beyond `requests_per_second`. `statuses` counts the status codes sent.
+
+    with FakeOpenAIServer(latency=0.5, rate_limit_rate=0.05) as server:
+        llm_gateway.configure(base_url=server.url, api_key="test")
+"""
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CATEGORIES = ["ideas", "organization", "voice", "word_choice", "sentence_fluency", "conventions"]
+
+
+class FakeOpenAIServer:
+    def __init__(self, ocr_text: str = "I visited puerto rico in 2015.", grade: int = 3,
+                 comments: str = "Add more details.", host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 rate_limited_first: int = 0, requests_per_second: float = None, retry_after: float = 0.05, seed: int = 0):
+        self.ocr_text = ocr_text
+        self.grade = grade
+        self.comments = comments
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rate_limited_first = rate_limited_first
+        self.requests_per_second = requests_per_second
+        self.retry_after = retry_after
+        self.requests = []
+        self.connections = 0
+        self.statuses = Counter()
+        self._random = random.Random(seed)
+        self._recent = deque()
+        self._answered = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def completion_content(self, body: dict) -> str:
+        messages = body.get("messages", [])
+        images = [part for message in messages if isinstance(message.get("content"), list)
+                  for part in message["content"] if part.get("type") == "image_url"]
+        if len(images) > 1:
+            return "\n".join(f"=== PAGE {number} ===\n{self.ocr_text}" for number in range(1, len(images) + 1))
+        if images:
+            return self.ocr_text
+        if body.get("response_format", {}).get("type") == "json_object":
+            last = messages[-1]["content"] if messages else ""
+            grade = {"grade": self.grade, "comments": self.comments}
+            if all(f"'{category}'" in last for category in CATEGORIES):
+                return json.dumps({category: grade for category in CATEGORIES})
+            return json.dumps(grade)
+        return self.ocr_text
+
+    def completion(self, body: dict) -> dict:
+        content = self.completion_content(body)
+        prompt_tokens = sum(len(str(message.get("content", ""))) // 4 for message in body.get("messages", []))
+        completion_tokens = len(content) // 4
+        return {
+            "id": f"chatcmpl-fake-{len(self.requests)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def outcome(self):
+        """Decides how to answer the next request: (status, delay in seconds, extra headers)."""
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= 1.0:
+                self._recent.popleft()
+            self._answered += 1
+            draw = self._random.random()
+            delay = self.latency + self._random.random() * self.jitter
+            over_budget = self.requests_per_second is not None and len(self._recent) >= self.requests_per_second
+            if over_budget or self._answered <= self.rate_limited_first or draw < self.rate_limit_rate:
+                retry_after = (1.0 - (now - self._recent[0])) if over_budget else self.retry_after
+                headers = {"retry-after": f"{retry_after:.3f}", "retry-after-ms": str(int(retry_after * 1000)),
+                           "x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": f"{retry_after:.3f}s"}
+                return 429, 0.0, headers
+            self._recent.append(now)
+            if draw < self.rate_limit_rate + self.error_rate:
+                return 500, delay, {}
+            return 200, delay, {}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status: int, payload: dict, headers: dict = None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                with fake._lock:
+                    fake.requests.append(body)
+                if not self.path.endswith("/chat/completions"):
+                    fake.statuses[404] += 1
+                    self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                status, delay, headers = fake.outcome()
+                if delay:
+                    time.sleep(delay)
+                with fake._lock:
+                    fake.statuses[status] += 1
+                if status == 429:
+                    self.send_json(429, {"error": {"message": "Rate limit reached.", "type": "requests", "code": "rate_limit_exceeded"}}, headers)
+                elif status == 500:
+                    self.send_json(500, {"error": {"message": "The server had an error while processing your request.", "type": "server_error"}})
+                else:
+                    self.send_json(200, fake.completion(body))
+
+        return Handler
+
+
+if __name__ == "__main__":
+    server = FakeOpenAIServer(port=8100).start()
+    print(f"Fake OpenAI server listening on {server.url}")
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,25 @@
+"""The handwritten sample essay from data/, as transcribed from its first page, for tests and benchmarks."""
+
+SAMPLE_ESSAY_PATH = "data/Anchor_-_2b/page_1.png"
+
+SAMPLE_ESSAY_TEXT = """Puerto Rico
+
+I visited puerto rico in 2015
+Summer there are some of the n thing puerto Rico 
+It was very hipical Also it had lots of 
+trees. Next had very warn, water the water 
+color was lightish blue and it was at the 
+ocean. Therefor, Puerto Rico had very good 
+food my faverit food for now was 
+the bear sauce and chicken at Puerto rico 
+in a resterunt it smelled very good.
+The people there were hat diffrent 
+Finally, the worst part was that I steped 
+on a dead sea urchin also the wether was 
+very hot. 
+
+At the hotel we stayed at a 
+place there was a pool and I
+really liked to go into the pool 
+in the night and day. We also got some 
+thing that you dive for."""
@@ -0,0 +1,96 @@
+"""Local-first OCR: Tesseract reads each page, and only pages it is unsure about go to the vision model.
+
+`local_transcription` runs Tesseract on the preprocessed page and returns its text with
+per-word confidence statistics; `accept_local` decides from those whether the page needs
+to be escalated. Pages that are escalated, or every page when Tesseract is not installed,
+are read by `integrations.read_text_in_image_async` as before.
+"""
+import io
+import os
+from functools import lru_cache
+import pytesseract
+from PIL import Image
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Set to 0 to send every page to the vision model
+OCR_LOCAL_FIRST = os.getenv("OCR_LOCAL_FIRST", "1") == "1"
+# Tesseract word confidences run 0-100; words below OCR_MIN_WORD_CONFIDENCE count as uncertain
+OCR_MIN_WORD_CONFIDENCE = float(os.getenv("OCR_MIN_WORD_CONFIDENCE", "60"))
+# A page is kept locally only if its mean word confidence reaches OCR_MIN_MEAN_CONFIDENCE
+# and at most OCR_MAX_UNCERTAIN_RATIO of its words are uncertain
+OCR_MIN_MEAN_CONFIDENCE = float(os.getenv("OCR_MIN_MEAN_CONFIDENCE", "85"))
+OCR_MAX_UNCERTAIN_RATIO = float(os.getenv("OCR_MAX_UNCERTAIN_RATIO", "0.1"))
+# Pages where Tesseract finds fewer words (typically handwriting it cannot segment) are escalated
+OCR_MIN_LOCAL_WORDS = int(os.getenv("OCR_MIN_LOCAL_WORDS", "5"))
+OCR_TESSERACT_LANG = os.getenv("OCR_TESSERACT_LANG", "eng")
+OCR_TESSERACT_TIMEOUT = float(os.getenv("OCR_TESSERACT_TIMEOUT", "30"))
+
+# Values of EssayImage.ocr_tier
+LOCAL_TIER = "tesseract"
+VISION_TIER = "vision"
+
+
+@lru_cache(maxsize=1)
+def tesseract_available() -> bool:
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except (pytesseract.TesseractNotFoundError, OSError):
+        return False
+
+
+def transcription_from_data(data: dict) -> dict:
+    """Rebuilds the page text from `image_to_data` output, one line per Tesseract line and a blank line between paragraphs."""
+    lines, confidences, previous = [], [], None
+    for index, word in enumerate(data["text"]):
+        confidence = float(data["conf"][index])
+        if confidence < 0 or not word.strip():
+            continue
+        confidences.append(confidence)
+        paragraph = (data["block_num"][index], data["par_num"][index])
+        line = paragraph + (data["line_num"][index],)
+        if previous is None or line != previous:
+            if previous is not None and paragraph != previous[:2]:
+                lines.append("")
+            lines.append(word.strip())
+        else:
+            lines[-1] += " " + word.strip()
+        previous = line
+
+    uncertain = sum(1 for confidence in confidences if confidence < OCR_MIN_WORD_CONFIDENCE)
+    return {
+        "text": "\n".join(lines),
+        "words": len(confidences),
+        "mean_confidence": sum(confidences) / len(confidences) if confidences else 0.0,
+        "uncertain_ratio": uncertain / len(confidences) if confidences else 1.0,
+    }
+
+
+def local_transcription(page_bytes: bytes):
+    """Tesseract transcription of a preprocessed page with its confidence statistics, or None if local OCR is off.
+
+    CPU-bound; run it on a worker thread.
+    """
+    if not OCR_LOCAL_FIRST or not tesseract_available():
+        return None
+    image = Image.open(io.BytesIO(page_bytes))
+    try:
+        data = pytesseract.image_to_data(image, lang=OCR_TESSERACT_LANG, output_type=pytesseract.Output.DICT,
+                                         timeout=OCR_TESSERACT_TIMEOUT)
+    except RuntimeError:
+        # Tesseract timed out; the vision model gets the page
+        return None
+    return transcription_from_data(data)
+
+
+def accept_local(transcription) -> bool:
+    """True if the local transcription is confident enough that the page need not be escalated."""
+    return (
+        transcription is not None
+        and transcription["words"] >= OCR_MIN_LOCAL_WORDS
+        and transcription["mean_confidence"] >= OCR_MIN_MEAN_CONFIDENCE
+        and transcription["uncertain_ratio"] <= OCR_MAX_UNCERTAIN_RATIO
+    )
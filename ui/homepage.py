@@ -6,6 +6,7 @@ from plotly.subplots import make_subplots
 import os
 import warnings
 import time
+import json
 from wordcloud import WordCloud
 # import nltk
 import requests
@@ -26,20 +27,40 @@ ordered_types = ["ideas", "organization", "voice", "word_choice", "sentence_flue
 warnings.filterwarnings("ignore")
 API_URL = "http://127.0.0.1:8000"
 
-@st.cache_data
-def fetch_evaluation_results(authorname, essay_title, uploaded_files):
-    """Caches API call results to prevent redundant requests."""
-    files = [("files", (file.name, file.getvalue(), file.type)) for file in uploaded_files]
+stage_labels = {
+    "ocr": "Reading the pages",
+    "grading": "Grading",
+    "saving": "Saving the results",
+}
+
+
+def sse_events(response):
+    """Yields (event, data) pairs from a Server-Sent Events response."""
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
 
-    response = requests.post(
-        f"{API_URL}/submit-essay/?authorname={authorname}&title={essay_title}",
-        files=files
-    )
 
-    if response.status_code == 200:
-        return response.json()
-    else:
-        return {"error": response.json().get("detail", "Unknown error")}
+def stream_evaluation_results(authorname, essay_title, uploaded_files):
+    """Submits the essay to the streaming endpoint and yields its events as they arrive."""
+    files = [("files", (file.name, file.getvalue(), file.type)) for file in uploaded_files]
+
+    with requests.post(
+        f"{API_URL}/submit-essay/stream?authorname={authorname}&title={essay_title}",
+        files=files,
+        stream=True
+    ) as response:
+        if response.status_code != 200:
+            yield "error", {"detail": response.json().get("detail", "Unknown error")}
+            return
+        yield from sse_events(response)
 
 
 # Setting the title and page icon
@@ -48,22 +69,62 @@ st.set_page_config(
 )
 
 def fetch_authors():
-    """Fetches authors from the FastAPI backend."""
-    response = requests.get(f"{API_URL}/get-authors/")
-    if response.status_code == 200:
-        return response.json()["authors"]
-    else:
-        st.error(f"Error fetching authors: {response.json().get('detail', 'Unknown error')}")
-        return []
+    """Fetches authors from the FastAPI backend, following the pagination cursor."""
+    authors, cursor = [], None
+    while True:
+        params = {"cursor": cursor} if cursor is not None else {}
+        response = requests.get(f"{API_URL}/get-authors/", params=params)
+        if response.status_code != 200:
+            st.error(f"Error fetching authors: {response.json().get('detail', 'Unknown error')}")
+            return authors
+        page = response.json()
+        authors.extend(page["authors"])
+        cursor = page.get("next_cursor")
+        if cursor is None:
+            return authors
 
 def fetch_author_essays(authorname):
-    """Fetches essays and grades for a specific author from FastAPI."""
-    response = requests.post(f"{API_URL}/get-author-grades/?authorname={authorname}")    
-    if response.status_code == 200:
-        return response.json()
-    else:
-        st.error(f"Error fetching author essays: {response.json().get('detail', 'Unknown error')}")
+    """Fetches essays and grades for a specific author from FastAPI, following the pagination cursor."""
+    essays, cursor = [], None
+    while True:
+        # Texts are fetched one essay at a time when one is opened
+        params = {"authorname": authorname, "include_text": "false"}
+        if cursor is not None:
+            params["cursor"] = cursor
+        response = requests.post(f"{API_URL}/get-author-grades/", params=params)
+        if response.status_code != 200:
+            st.error(f"Error fetching author essays: {response.json().get('detail', 'Unknown error')}")
+            return essays
+        page = response.json()
+        essays.extend(page["essays"])
+        cursor = page.get("next_cursor")
+        if cursor is None:
+            return essays
+
+
+def fetch_author_summary(authorname):
+    """Fetches the author's per-category grade count, mean, latest grade and trend."""
+    response = requests.get(f"{API_URL}/authors/{authorname}/summary")
+    if response.status_code != 200:
         return []
+    return response.json()["categories"]
+
+
+def fetch_essay(essay_id):
+    """Fetches one essay, including its text."""
+    response = requests.get(f"{API_URL}/essays/{essay_id}")
+    if response.status_code != 200:
+        st.error(f"Error fetching essay: {response.json().get('detail', 'Unknown error')}")
+        return None
+    return response.json()
+
+
+def fetch_essay_history(essay_id):
+    """Fetches the grades of every revision of an essay, first version first."""
+    response = requests.get(f"{API_URL}/essays/{essay_id}/history")
+    if response.status_code != 200:
+        return []
+    return response.json()["revisions"]
 
 
 def authors():
@@ -115,32 +176,36 @@ def authors():
     st.markdown(styled_table, unsafe_allow_html=True)
     # st.dataframe(df)
 
-    # **Grouped Bar Plot for Grades**
-    st.subheader("📊 Essay Grades Breakdown")
- 
-    # Transform data for Plotly
-    melted_df = df.melt(id_vars=["Title", "Date Submitted"], var_name="Grade Type", value_name="Score")
-    melted_df.dropna(inplace=True)  # Remove NaN values
- 
-    if not melted_df.empty:
-        fig = px.bar(melted_df, x="Title", y="Score", color="Grade Type", 
-                     barmode="group",
-                     labels={"Score": "Grade", "Title": "Essay Title"},
-                     height=500)
+    # **Per-Criterion Summary**, from the server-side aggregates: one small response however many essays there are
+    summary = fetch_author_summary(selected_author)
+    if summary:
+        st.subheader("📊 Grades by Criterion")
+        for column, category in zip(st.columns(len(summary)), summary):
+            column.metric(db_to_nice_str_map.get(category["type"], category["type"]), f"{category['mean']:.1f}",
+                          f"{category['trend']:+.2f} per essay")
+        summary_df = pd.DataFrame([
+            {"Criterion": db_to_nice_str_map.get(category["type"], category["type"]), "Average": category["mean"], "Latest": category["latest"]}
+            for category in summary
+        ]).melt(id_vars="Criterion", var_name="Measure", value_name="Score")
+        fig = px.bar(summary_df, x="Criterion", y="Score", color="Measure", barmode="group", height=400)
+        fig.update_layout(yaxis_range=[0, 5])
         st.plotly_chart(fig, use_container_width=True)
 
-    # Prepare essay selection with date in front and sort descending by date
-    df["Date Submitted"] = pd.to_datetime(df["Date Submitted"])
-    df = df.sort_values(by="Date Submitted", ascending=False)
-    df["Title with Date"] = df["Date Submitted"].dt.strftime('%Y-%m-%d') + " - " + df["Title"]
+    # Prepare essay selection with date in front, newest first. Options are essay IDs,
+    # so revisions and other essays sharing a title stay distinct
+    essays_by_id = {essay["id"]: essay for essay in author_essays}
+    essay_ids = sorted(essays_by_id, key=lambda essay_id: (essays_by_id[essay_id]["date_submitted"] or "", essay_id), reverse=True)
+
+    def essay_label(essay_id):
+        essay = essays_by_id[essay_id]
+        label = f"{(essay['date_submitted'] or '')[:10]} - {essay['title']}"
+        return f"{label} (revision {essay['revision']})" if essay.get("revision", 1) > 1 else label
 
     # **Detailed View of Selected Essay**
-    selected_essay_title = st.selectbox("📜 Select an Essay to View Detailed Grades", df["Title with Date"])
+    selected_essay_id = st.selectbox("📜 Select an Essay to View Detailed Grades", essay_ids, format_func=essay_label)
  
-    if selected_essay_title:
-        # Extract the original title (remove the prepended date)
-        selected_essay_original_title = selected_essay_title.split(" - ", 1)[1] if " - " in selected_essay_title else selected_essay_title
-        selected_essay = next((essay for essay in author_essays if essay["title"] == selected_essay_original_title), None)
+    if selected_essay_id is not None:
+        selected_essay = essays_by_id[selected_essay_id]
  
         if selected_essay:
             st.subheader("🏆 Detailed Essay Grades")
@@ -158,6 +223,18 @@ def authors():
             # Display table using markdown to fully remove index
             st.markdown(styled_table, unsafe_allow_html=True)
 
+            # Scores across revisions of this essay
+            history = fetch_essay_history(selected_essay["id"]) if selected_essay.get("revision", 1) > 1 else []
+            if history:
+                st.subheader("🔁 Revision History")
+                history_df = pd.DataFrame([
+                    {"Revision": revision["revision"], "Criterion": db_to_nice_str_map[grade["type"]], "Score": grade["grade"]}
+                    for revision in history for grade in revision["grades"]
+                ])
+                fig = px.line(history_df, x="Revision", y="Score", color="Criterion", markers=True)
+                fig.update_layout(yaxis_range=[0, 5], xaxis_dtick=1, height=350)
+                st.plotly_chart(fig, use_container_width=True)
+
  
             st.subheader(" ✍️  Full Essay Text")
             # Layout: Display images on the left and text on the right
@@ -171,7 +248,9 @@ def authors():
 
             # Display essay text
             with cols[1]:
-                st.write(selected_essay["text"])
+                essay = fetch_essay(selected_essay["id"])
+                if essay:
+                    st.write(essay["text"])
 
 def home():
     # st.title(":material/grading: Writing Evaluation")
@@ -219,6 +298,33 @@ def home():
     )
 
 
+def feedback_table_html(evaluation_results, light_mode):
+    """Renders the feedback table for the criteria graded so far, in rubric order."""
+    # Apply dark mode or light mode styles dynamically
+    table_bg_color = "#f4f4f4" if light_mode else "#333333"
+    table_text_color = "#000000" if light_mode else "#f4f4f4"
+    border_color = "#dddddd" if light_mode else "#555555"
+
+    comments_html = f"""
+    <style>
+        table {{ width: 100%; border-collapse: collapse; font-size: 16px; }}
+        th, td {{ padding: 12px; text-align: left; border-bottom: 1px solid {border_color}; }}
+        th {{ background-color: {table_bg_color}; color: {table_text_color}; }}
+        td {{ background-color: transparent; color: {table_bg_color}; }}
+    </style>
+    <table>
+        <tr><th>Criterion</th><th>Score</th><th>Feedback</th></tr>
+    """
+    for criterion in (db_to_nice_str_map[grade_type] for grade_type in ordered_types):
+        if criterion not in evaluation_results:
+            continue
+        score = evaluation_results[criterion]["score"]
+        comment = evaluation_results[criterion]["comment"]
+        comments_html += f"<tr><td><b>{criterion}</b></td><td>{score}</td><td>{comment}</td></tr>"
+    comments_html += "</table>"
+    return comments_html
+
+
 def writing_evaluation():
     st.title(":material/grading: Writing Evaluator")
     st.subheader(
@@ -231,92 +337,68 @@ def writing_evaluation():
     essay_title = st.text_input("📝 Essay Title", "Untitled")
 
     # File uploader for images
-    uploaded_files = st.file_uploader(":file_folder: Upload essay images (JPG/PNG)", type=["jpg", "png"], accept_multiple_files=True)
+    uploaded_files = st.file_uploader(":file_folder: Upload essay images or scanned PDFs (JPG/PNG/PDF)", type=["jpg", "png", "pdf"], accept_multiple_files=True)
 
     # TODO: Send files to the backend API
     
     if st.button("🚀 Submit for Evaluation"):
         if not uploaded_files:
-            st.warning("Please upload at least one image.")
+            st.warning("Please upload at least one image or PDF.")
             return
         
         if not author_name or not essay_title:
             st.warning("Please enter an author name and essay title.")
             return
 
-        st.info("📡 Uploading and processing...")
-
-        result = fetch_evaluation_results(author_name, essay_title, uploaded_files)
-
-        # Display results
-        st.success("Evaluation Complete! Here are the results:")
         # Detect Streamlit Theme (Light/Dark Mode)
         theme = st.get_option("theme.base")
         light_mode = theme == "light"
 
-        # Define rubric criteria based on 826 Valencia grading rubric
-        
-        rubric_criteria = [
-            "Ideas", "Organization", "Voice", "Word Choice",
-            "Sentence Fluency", "Conventions"
-        ]
-
-        # Mock evaluation results (Replace with real backend results)
-        new_evaluation_results = {}
-        for grade in result["grades"]:
-            nice_str_grade_type = db_to_nice_str_map[grade["type"]]
-            new_evaluation_results[nice_str_grade_type] = {
-                "score": grade["grade"],
-                "comment": grade["comments"]
-            }
-        # evaluation_results = {
-        #     db_to_nice_str_map[grade["type"]]: {"score": 5, "comment": "Strong ideas, but needs more supporting details."},
-        #     "Organization": {"score": 4, "comment": "Well-structured, logical sequence of thoughts."},
-        #     "Voice": {"score": 3, "comment": "Engaging but could be more distinctive."},
-        #     "Word Choice": {"score": 2, "comment": "Good vocabulary but some repetitive words."},
-        #     "Sentence Fluency": {"score": 3, "comment": "Smooth flow, but some choppy transitions."},
-        #     "Conventions": {"score": 2, "comment": "Some grammar and punctuation errors."}
-        # }
-        evaluation_results = new_evaluation_results
+        # Placeholders filled in as the backend streams its progress
+        status = st.empty()
+        preliminary_box = st.empty()
+        essay_box = st.empty()
+        st.subheader("💡 Feedback & Comments")
+        feedback_table = st.empty()
+
+        evaluation_results = {}
+        for event, data in stream_evaluation_results(author_name, essay_title, uploaded_files):
+            if event == "stage":
+                status.info(f"📡 {stage_labels.get(data['stage'], 'Processing')}...")
+            elif event == "text":
+                with essay_box.container():
+                    with st.expander("📄 View Essay"):
+                        st.write(data["text"])
+            elif event == "conventions":
+                preliminary = f"Preliminary conventions check: {data['misspelled']} of {data['words']} words not recognized, " \
+                              f"{data['capitalized']} of {data['sentences']} sentences capitalized, {data['terminated']} with end punctuation."
+                preliminary_box.caption(f"✏️ {preliminary}")
+            elif event == "grade":
+                # Fill in the feedback table one row at a time as categories finish
+                evaluation_results[db_to_nice_str_map[data["type"]]] = {
+                    "score": data["grade"],
+                    "comment": data["comments"]
+                }
+                feedback_table.markdown(feedback_table_html(evaluation_results, light_mode), unsafe_allow_html=True)
+            elif event == "error":
+                status.empty()
+                st.error(f"Evaluation failed: {data['detail']}")
+                return
+
+        status.success("Evaluation Complete! Here are the results:")
+        if not evaluation_results:
+            return
+
         # Extract comments
         all_comments = " ".join([v["comment"]
                                 for v in evaluation_results.values()])
 
         # Convert data to DataFrame for visualization
         df = pd.DataFrame(
-            [(k, v["score"]) for k, v in evaluation_results.items()],
+            [(k, evaluation_results[k]["score"]) for k in (db_to_nice_str_map[t] for t in ordered_types) if k in evaluation_results],
             columns=["Criterion", "Score"]
         )
 
-        with st.expander("📄 View Essay"):
-            st.write(result["text"])
-
-        # 📝 Feedback Table
-        st.subheader("💡 Feedback & Comments")
-
-        # Apply dark mode or light mode styles dynamically
-        table_bg_color = "#f4f4f4" if light_mode else "#333333"
-        table_text_color = "#000000" if light_mode else "#f4f4f4"
-        border_color = "#dddddd" if light_mode else "#555555"
-
-        comments_html = f"""
-        <style>
-            table {{ width: 100%; border-collapse: collapse; font-size: 16px; }}
-            th, td {{ padding: 12px; text-align: left; border-bottom: 1px solid {border_color}; }}
-            th {{ background-color: {table_bg_color}; color: {table_text_color}; }}
-            td {{ background-color: transparent; color: {table_bg_color}; }}
-        </style>
-        <table>
-            <tr><th>Criterion</th><th>Score</th><th>Feedback</th></tr>
-        """
-        for criterion in rubric_criteria:
-            score = evaluation_results[criterion]["score"]
-            comment = evaluation_results[criterion]["comment"]
-            comments_html += f"<tr><td><b>{criterion}</b></td><td>{score}</td><td>{comment}</td></tr>"
-        comments_html += "</table>"
-
-        st.markdown(comments_html, unsafe_allow_html=True)
-
         word_cloud(all_comments, light_mode)
         # 🎨 Bar Chart Visualization
         st.subheader("📊 Writing Evaluation Results")